@@ -3,14 +3,44 @@ from flask import Flask, request, Response
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 
+from .config import FACE_ENROLL_WORKERS, FACE_WARMUP
 from .database import init_db, db
 from .routes import register_routes
+from .commands import register_commands
 from .utils.error_handler import register_error_handlers
 from .models.usuario import Usuario
 import os
+import threading
 
 jwt = JWTManager()
 
+_segundo_plano_iniciado = False
+_segundo_plano_lock = threading.Lock()
+
+
+def iniciar_segundo_plano(app):
+    """Aquecimento do modelo facial e workers da fila de cadastros, uma vez por processo.
+
+    Chamado no primeiro request de cada processo que atende requisições (em
+    qualquer servidor WSGI) e, no servidor de desenvolvimento, logo na subida
+    (main.py). Comandos `flask face` não atendem requisições e não os iniciam.
+    FACE_WARMUP=0 e FACE_ENROLL_WORKERS=0 desligam cada parte.
+    """
+    global _segundo_plano_iniciado
+    if _segundo_plano_iniciado:
+        return
+    with _segundo_plano_lock:
+        if _segundo_plano_iniciado:
+            return
+        from .utils.face_jobs import start_enrollment_workers
+        from .utils.facial_recognition import start_warmup
+
+        if FACE_WARMUP:
+            start_warmup()
+        if FACE_ENROLL_WORKERS > 0:
+            start_enrollment_workers(app)
+        _segundo_plano_iniciado = True
+
 def create_app():
     app = Flask(__name__)
     
@@ -39,9 +69,14 @@ def create_app():
             resp.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, PATCH"  # ← ADICIONE PATCH
             return resp
 
+    @app.before_request
+    def iniciar_reconhecimento_facial():
+        iniciar_segundo_plano(app)
+
     # Rotas e handlers
     register_routes(app)
     register_error_handlers(app)
+    register_commands(app)
 
     # --- Cria admin padrão ---
     with app.app_context():
@@ -0,0 +1,973 @@
+import os
+import time
+
+import click
+import numpy as np
+from flask.cli import AppGroup
+
+from app.config import FACE_DATA_DIR
+
+face_cli = AppGroup("face", help="Manutenção do reconhecimento facial (índice, calibração, cadastros).")
+
+
+def register_commands(app):
+    app.cli.add_command(face_cli)
+
+
+def _abrir_indice(subdir="", kind="flat"):
+    # Abre snapshot + journal do modelo ativo como os workers fazem, sem carregar o modelo.
+    # Sem subdir: o índice de centróides, com todos os seus shards
+    from app.config import FACE_SHARDS
+    from app.utils.face_store import FaceStore, SharedFaceIndex, ShardedFaceIndex, shard_directories
+    from app.utils.facial_recognition import active_model, dimension
+
+    directory = os.path.join(active_model()["diretorio"], subdir)
+    if subdir:
+        index = SharedFaceIndex(FaceStore(directory, dimension), kind=kind)
+    else:
+        stores = [FaceStore(d, dimension) for d in shard_directories(directory, FACE_SHARDS)]
+        index = ShardedFaceIndex(stores, kind=kind)
+    index.refresh()
+    return index
+
+
+def _embeddings(index):
+    """(ids, vetores) do índice; sem journal pendente, direto dos arquivos mapeados em memória."""
+    if hasattr(index, "shards"):
+        partes = [_embeddings(shard) for shard in index.shards]
+        if len(partes) == 1:
+            return partes[0]
+        return np.concatenate([p[0] for p in partes]), np.concatenate([p[1] for p in partes])
+    if not index.hidden and not index.delta.ntotal:
+        return index.snapshot.items()
+    return index.items()
+
+
+def _destinos(diretorio):
+    """[(nome, FaceStore, tipo, shard)]: templates e cada shard dos centróides do índice em `diretorio`."""
+    from app.config import FACE_INDEX_TYPE, FACE_SHARDS
+    from app.utils.face_store import FaceStore, shard_directories
+    from app.utils.facial_recognition import dimension
+
+    shards = shard_directories(diretorio, FACE_SHARDS)
+    destinos = [("templates", FaceStore(os.path.join(diretorio, "templates"), dimension), "flat", None)]
+    destinos += [
+        (f"shard-{i}" if len(shards) > 1 else "centroides", FaceStore(d, dimension), FACE_INDEX_TYPE, i)
+        for i, d in enumerate(shards)
+    ]
+    return destinos
+
+
+def _parte(destino, template_ids, templates, ids, centroids):
+    # (ids, vetores) que vão para um destino de _destinos
+    from app.config import FACE_SHARDS
+    from app.utils.face_store import shard_of
+
+    shard = destino[3]
+    if shard is None:
+        return template_ids, templates
+    rows = shard_of(ids, FACE_SHARDS) == shard
+    return ids[rows], centroids[rows]
+
+
+def _embeddings_por_paciente():
+    # Templates (vários por paciente) quando existirem; senão o vetor único de cada paciente
+    from app.utils.facial_recognition import TEMPLATE_SLOTS
+
+    ids, vectors = _embeddings(_abrir_indice("templates"))
+    if len(ids):
+        return np.asarray(ids) // TEMPLATE_SLOTS, vectors
+    ids, vectors = _embeddings(_abrir_indice())
+    return np.asarray(ids), vectors
+
+
+# ---------- CALIBRAÇÃO DO LIMIAR ----------
+@face_cli.command("calibrar")
+@click.option("--far-alvo", default=1e-4, show_default=True, help="FAR máxima aceitável para o limiar recomendado.")
+@click.option("--bloco", default=4096, show_default=True, help="Linhas por bloco do produto matricial.")
+@click.option("--amostra", default=0, help="Máximo de pacientes (0 = todos).")
+@click.option("--csv", "csv_path", type=click.Path(dir_okay=False), help="Grava a curva completa (limiar, FAR, FRR).")
+def calibrar(far_alvo, bloco, amostra, csv_path):
+    """Curvas FAR/FRR/EER sobre todos os embeddings cadastrados e limiar recomendado."""
+    from app.config import FACE_MIN_SIMILARITY
+    from app.utils.face_calibration import equal_error_rate, error_rates, score_distributions, threshold_for_far
+
+    labels, vectors = _embeddings_por_paciente()
+    if amostra and len(np.unique(labels)) > amostra:
+        escolhidos = np.random.default_rng(0).choice(np.unique(labels), amostra, replace=False)
+        rows = np.flatnonzero(np.isin(labels, escolhidos))
+        labels, vectors = labels[rows], np.asarray(vectors[rows])
+
+    pacientes = len(np.unique(labels))
+    click.echo(f"{len(labels)} embeddings de {pacientes} pacientes")
+    if pacientes < 2:
+        raise click.ClickException("São necessários pelo menos 2 pacientes cadastrados")
+
+    inicio = time.perf_counter()
+    genuine, impostor, best_genuine, best_impostor = score_distributions(labels, vectors, block_size=bloco)
+    click.echo(
+        f"{genuine.sum()} pares genuínos, {impostor.sum()} impostores "
+        f"em {time.perf_counter() - inicio:.1f}s"
+    )
+
+    thresholds, far, frr = error_rates(genuine, impostor)
+    recomendado = threshold_for_far(thresholds, far, far_alvo)
+    i = int(np.searchsorted(thresholds, recomendado))
+    click.echo(f"\n{'limiar':>7} {'FAR':>10} {'FRR':>8}")
+    for limiar in sorted({0.2, 0.3, 0.4, FACE_MIN_SIMILARITY, 0.6, recomendado}):
+        j = min(int(np.searchsorted(thresholds, limiar)), len(thresholds) - 1)
+        click.echo(f"{thresholds[j]:>7.3f} {far[j]:>10.2e} {frr[j]:>8.4f}")
+
+    if genuine.sum():
+        eer, limiar_eer = equal_error_rate(thresholds, far, frr)
+        click.echo(f"\nEER: {eer:.4f} (limiar {limiar_eer:.3f})")
+
+        # Identificação leave-one-out: cada template contra todos os outros
+        com_par = np.isfinite(best_genuine)
+        rank1 = np.mean(best_genuine[com_par] > best_impostor[com_par])
+        aceitos = np.mean((best_genuine[com_par] >= recomendado) & (best_genuine[com_par] > best_impostor[com_par]))
+        click.echo(f"Acurácia rank-1: {rank1:.4f}; identificados no limiar recomendado: {aceitos:.4f}")
+    else:
+        click.echo("\nNenhum paciente com mais de um template: só a FAR pode ser estimada")
+
+    click.echo(
+        f"\nLimiar recomendado para FAR <= {far_alvo:g}: {recomendado:.3f} "
+        f"(FRR {frr[i] if i < len(frr) else 1.0:.4f}); atual FACE_MIN_SIMILARITY={FACE_MIN_SIMILARITY}"
+    )
+
+    if csv_path:
+        np.savetxt(
+            csv_path,
+            np.column_stack([thresholds, far, frr]),
+            delimiter=",",
+            header="limiar,far,frr",
+            comments="",
+            fmt="%.6g",
+        )
+        click.echo(f"Curva gravada em {csv_path}")
+
+
+# ---------- VARREDURA DE PACIENTES DUPLICADOS ----------
+def _agrupar(pares, n):
+    # Union-find: pares (i, j) de posições viram grupos de pacientes suspeitos
+    pai = np.arange(n)
+
+    def raiz(i):
+        while pai[i] != i:
+            pai[i] = pai[pai[i]]
+            i = pai[i]
+        return i
+
+    for i, j in pares:
+        ri, rj = raiz(i), raiz(j)
+        if ri != rj:
+            pai[max(ri, rj)] = min(ri, rj)
+
+    grupos = {}
+    for i in {p for par in pares for p in par}:
+        grupos.setdefault(raiz(i), []).append(i)
+    return sorted(grupos.values(), key=len, reverse=True)
+
+
+@face_cli.command("duplicados")
+@click.option("--limiar", type=float, help="Similaridade mínima (padrão: FACE_DUPLICATE_SIMILARITY).")
+@click.option("--lote", default=4096, show_default=True, help="Consultas por chamada do range_search.")
+@click.option("--saida", default="duplicados.csv", show_default=True, type=click.Path(dir_okay=False))
+def duplicados(limiar, lote, saida):
+    """Procura rostos cadastrados para mais de um paciente e grava um relatório CSV."""
+    import csv
+
+    import faiss
+
+    from app.config import FACE_DUPLICATE_SIMILARITY
+    from app.models.paciente import Paciente
+
+    limiar = FACE_DUPLICATE_SIMILARITY if limiar is None else limiar
+    ids, vectors = _embeddings(_abrir_indice())
+    ids = np.asarray(ids)
+    n = len(ids)
+    click.echo(f"{n} pacientes no índice; limiar de similaridade {limiar}")
+
+    # Busca exata sobre os float32 crus (um centróide por paciente), em lotes:
+    # só os pares dentro do raio saem do FAISS, nunca a matriz N x N
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    for inicio in range(0, n, 65536):
+        index.add(np.ascontiguousarray(vectors[inicio:inicio + 65536], dtype=np.float32))
+    raio = 2.0 - 2.0 * limiar  # L2 ao quadrado entre vetores normalizados
+
+    pares, similaridade = [], {}
+    inicio_busca = time.perf_counter()
+    for inicio in range(0, n, lote):
+        consultas = np.ascontiguousarray(vectors[inicio:inicio + lote], dtype=np.float32)
+        lims, distancias, vizinhos = index.range_search(consultas, raio)
+        for linha in range(len(consultas)):
+            i = inicio + linha
+            for d, j in zip(distancias[lims[linha]:lims[linha + 1]], vizinhos[lims[linha]:lims[linha + 1]]):
+                if j > i:
+                    pares.append((i, int(j)))
+                    sim = 1.0 - float(d) / 2.0
+                    similaridade[i] = max(similaridade.get(i, -1.0), sim)
+                    similaridade[int(j)] = max(similaridade.get(int(j), -1.0), sim)
+    click.echo(f"{len(pares)} pares suspeitos em {time.perf_counter() - inicio_busca:.1f}s")
+
+    grupos = _agrupar(pares, n)
+    todos = [int(ids[i]) for grupo in grupos for i in grupo]
+    pacientes = {}
+    for inicio in range(0, len(todos), 500):
+        parte = todos[inicio:inicio + 500]
+        pacientes.update({p.idPaciente: p for p in Paciente.query.filter(Paciente.idPaciente.in_(parte)).all()})
+
+    with open(saida, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["grupo", "idPaciente", "nomeComp", "cpf", "similaridade_max"])
+        for numero, grupo in enumerate(grupos, start=1):
+            for i in grupo:
+                paciente = pacientes.get(int(ids[i]))
+                writer.writerow([
+                    numero,
+                    int(ids[i]),
+                    paciente.nomeComp if paciente else "",
+                    paciente.cpf if paciente else "(fora do banco)",
+                    f"{similaridade[i]:.4f}",
+                ])
+    click.echo(f"{len(grupos)} grupos de possíveis duplicados gravados em {saida}")
+
+
+# ---------- EMBEDDINGS NO BANCO: EXPORTAÇÃO E RECONSTRUÇÃO DO ÍNDICE ----------
+@face_cli.command("exportar")
+@click.option("--lote", default=1000, show_default=True, help="Registros por transação.")
+def exportar(lote):
+    """Copia para o banco os templates que hoje só existem nos arquivos do índice."""
+    from app.database import db
+    from app.models.paciente import Paciente
+    from app.models.paciente_embedding import PacienteEmbedding
+    from app.utils.facial_recognition import TEMPLATE_SLOTS, embedding_model
+
+    modelo, versao = embedding_model()
+
+    template_ids, templates = _embeddings(_abrir_indice("templates"))
+    ids, centroids = _embeddings(_abrir_indice())
+    template_ids = np.asarray(template_ids)
+    registros = [
+        (int(i) // TEMPLATE_SLOTS, int(i) % TEMPLATE_SLOTS, templates[row])
+        for row, i in enumerate(template_ids)
+    ]
+    # Paciente cadastrado antes dos templates: o vetor único vira o slot 0
+    sem_templates = np.flatnonzero(~np.isin(np.asarray(ids), template_ids // TEMPLATE_SLOTS))
+    registros += [(int(ids[row]), 0, centroids[row]) for row in sem_templates]
+
+    pacientes = {id_paciente for (id_paciente,) in db.session.query(Paciente.idPaciente)}
+    existentes = set(db.session.query(PacienteEmbedding.idPaciente, PacienteEmbedding.slot).filter_by(
+        modelo=modelo, versao=versao,
+    ))
+
+    novos = orfaos = 0
+    for id_paciente, slot, vetor in registros:
+        if id_paciente not in pacientes:
+            orfaos += 1
+            continue
+        if (id_paciente, slot) in existentes:
+            continue
+        db.session.add(PacienteEmbedding(
+            idPaciente=id_paciente,
+            slot=slot,
+            vetor=np.ascontiguousarray(vetor, dtype=np.float32).tobytes(),
+            modelo=modelo,
+            versao=versao,
+        ))
+        novos += 1
+        if novos % lote == 0:
+            db.session.commit()
+    db.session.commit()
+    click.echo(
+        f"{novos} embeddings gravados; {len(registros) - novos - orfaos} já estavam no banco; "
+        f"{orfaos} de pacientes fora do banco ignorados"
+    )
+
+
+def _decodificar(linhas, dimension, slots):
+    # (idEmbedding, idPaciente, slot, vetor) -> ids dos templates e vetores normalizados
+    validas = [linha for linha in linhas if len(linha[3]) == 4 * dimension]
+    ids = np.fromiter((p * slots + s for _, p, s, _ in validas), dtype=np.int64, count=len(validas))
+    vectors = np.frombuffer(b"".join(v for *_, v in validas), dtype=np.float32).reshape(-1, dimension)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return ids, vectors.astype(np.float32), len(linhas) - len(validas)
+
+
+def _centroides(template_ids, templates, slots):
+    # Centróide normalizado dos templates de cada paciente, como em FaceEngine.add_template
+    if not len(template_ids):
+        return np.empty(0, dtype=np.int64), np.empty((0, templates.shape[1]), dtype=np.float32)
+    order = np.argsort(template_ids, kind="stable")
+    labels = template_ids[order] // slots
+    pacientes, inicio = np.unique(labels, return_index=True)
+    centroids = np.add.reduceat(templates[order], inicio, axis=0)
+    centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+    return pacientes.astype(np.int64), centroids.astype(np.float32)
+
+
+def _montar_indice(kind, ids, vectors):
+    from app.config import FACE_INDEX_TRAIN_THRESHOLD
+    from app.utils.face_index import FaceIndex, build_index, target_kind
+    from app.utils.facial_recognition import dimension
+
+    return FaceIndex(dimension=dimension, index=build_index(
+        target_kind(kind, FACE_INDEX_TRAIN_THRESHOLD, len(ids), "flat"), vectors, ids, dimension,
+    ))
+
+
+def _reaplicar_journal(store, marca, ids, vectors):
+    """(ids, vetores, mudou) com o que foi gravado no journal durante a reconstrução (chamar com o lock)."""
+    from app.utils.face_store import OP_ADD
+
+    generation, offset = marca
+    if store.current_generation() != generation:
+        raise click.ClickException(
+            f"O índice em {store.directory} foi compactado durante a reconstrução; rode o comando de novo"
+        )
+    records, _ = store.journal(generation).read_from(offset)
+    if not records:
+        return ids, vectors, False
+
+    final = {}
+    for op, db_id, embedding in records:
+        final[db_id] = embedding if op == OP_ADD else None
+    tocados = np.fromiter(final, dtype=np.int64)
+    adicionados = [db_id for db_id, embedding in final.items() if embedding is not None]
+    keep = ~np.isin(ids, tocados)
+    ids, vectors = ids[keep], vectors[keep]
+    if adicionados:
+        novos = np.stack([final[db_id] for db_id in adicionados]).astype(np.float32)
+        ids = np.concatenate([ids, np.asarray(adicionados, dtype=np.int64)])
+        vectors = np.concatenate([vectors, novos])
+    click.echo(f"  {len(records)} registros feitos durante a reconstrução reaplicados em {store.directory}")
+    return ids, vectors, True
+
+
+@face_cli.command("reconstruir")
+@click.option("--lote", default=5000, show_default=True, help="Embeddings lidos do banco por consulta.")
+@click.option("--workers", default=os.cpu_count() or 1, show_default=True, help="Threads de decodificação e do FAISS.")
+@click.option("--simular", is_flag=True, help="Só confere banco x índice, sem gravar nada.")
+@click.option("--forcar", is_flag=True, help="Publica mesmo que pacientes do índice atual fiquem sem embedding.")
+@click.option("--sem-embedding", "sem_embedding_csv", type=click.Path(dir_okay=False),
+              help="Grava a lista de pacientes sem embedding.")
+def reconstruir(lote, workers, simular, forcar, sem_embedding_csv):
+    """Refaz o índice facial a partir dos embeddings do banco (paciente_embedding).
+
+    Lê os embeddings do modelo/versão atuais em lotes, decodifica os lotes em
+    paralelo enquanto o próximo é buscado, monta os índices de templates e de
+    centróides em paralelo e confere tudo contra a tabela de pacientes:
+    embeddings de pacientes que não existem mais são apagados e pacientes sem
+    nenhum embedding são listados. O que for cadastrado enquanto isso roda
+    (journal da geração atual) é reaplicado antes da publicação. No fim a
+    tabela de metadados do reconhecimento é regravada a partir do banco.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    import faiss
+
+    from app.database import db
+    from app.models.paciente import Paciente
+    from app.models.paciente_embedding import PacienteEmbedding
+    from app.utils.facial_recognition import TEMPLATE_SLOTS, active_model, dimension, patient_metadata
+
+    faiss.omp_set_num_threads(workers)
+    inicio = time.perf_counter()
+
+    ativo = active_model()
+    modelo, versao = ativo["pack"], ativo["versao"]
+    destinos = _destinos(ativo["diretorio"])
+    # Posição dos journals agora: o que entrar depois disso é reaplicado no fim
+    marcas = {}
+    for nome, store, _, _ in destinos:
+        with store.lock():
+            generation = store.current_generation()
+            marcas[nome] = (generation, store.journal(generation).size())
+
+    pacientes = {id_paciente for (id_paciente,) in db.session.query(Paciente.idPaciente)}
+
+    por_versao = db.session.query(
+        PacienteEmbedding.modelo, PacienteEmbedding.versao, db.func.count()
+    ).group_by(PacienteEmbedding.modelo, PacienteEmbedding.versao).all()
+    for modelo_linha, versao_linha, total in por_versao:
+        atual = (modelo_linha, versao_linha) == (modelo, versao)
+        click.echo(f"{total:>9} embeddings {modelo_linha} v{versao_linha}{'' if atual else ' (ignorados: outro modelo)'}")
+
+    consulta = db.session.query(
+        PacienteEmbedding.idEmbedding,
+        PacienteEmbedding.idPaciente,
+        PacienteEmbedding.slot,
+        PacienteEmbedding.vetor,
+    ).filter(
+        PacienteEmbedding.modelo == modelo,
+        PacienteEmbedding.versao == versao,
+    ).order_by(PacienteEmbedding.idEmbedding)
+
+    # Paginação por chave: o banco busca o próximo lote enquanto as threads decodificam o anterior
+    partes, orfaos, ultimo = [], [], 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            linhas = consulta.filter(PacienteEmbedding.idEmbedding > ultimo).limit(lote).all()
+            if not linhas:
+                break
+            ultimo = linhas[-1][0]
+            orfaos += [linha[0] for linha in linhas if linha[1] not in pacientes]
+            validas = [linha for linha in linhas if linha[1] in pacientes]
+            partes.append(executor.submit(_decodificar, validas, dimension, TEMPLATE_SLOTS))
+        partes = [parte.result() for parte in partes]
+
+    template_ids = np.concatenate([p[0] for p in partes]) if partes else np.empty(0, dtype=np.int64)
+    templates = np.concatenate([p[1] for p in partes]) if partes else np.empty((0, dimension), dtype=np.float32)
+    invalidos = sum(p[2] for p in partes)
+    ids, centroids = _centroides(template_ids, templates, TEMPLATE_SLOTS)
+    click.echo(
+        f"{len(templates)} templates de {len(ids)} pacientes lidos em {time.perf_counter() - inicio:.1f}s"
+        + (f"; {invalidos} com tamanho inválido ignorados" if invalidos else "")
+    )
+
+    sem_embedding = sorted(pacientes - set(ids.tolist()))
+    indice_atual = set(np.asarray(_embeddings(_abrir_indice())[0]).tolist())
+    so_no_indice = [id_paciente for id_paciente in sem_embedding if id_paciente in indice_atual]
+    click.echo(f"{len(orfaos)} embeddings órfãos (paciente não existe mais)")
+    click.echo(f"{len(sem_embedding)} pacientes sem embedding; {len(so_no_indice)} deles só existem no índice atual")
+    if sem_embedding:
+        click.echo("  ex.: " + ", ".join(map(str, sem_embedding[:20])) + (" ..." if len(sem_embedding) > 20 else ""))
+    if sem_embedding_csv:
+        np.savetxt(sem_embedding_csv, np.asarray(sem_embedding, dtype=np.int64), fmt="%d", header="idPaciente", comments="")
+        click.echo(f"Lista gravada em {sem_embedding_csv}")
+
+    if simular:
+        return
+    if so_no_indice and not forcar:
+        raise click.ClickException(
+            "Há pacientes cujo rosto só está no índice atual: rode `flask face exportar` "
+            "antes (ou use --forcar para descartá-los)"
+        )
+
+    if orfaos:
+        for i in range(0, len(orfaos), lote):
+            PacienteEmbedding.query.filter(PacienteEmbedding.idEmbedding.in_(orfaos[i:i + lote])).delete(
+                synchronize_session=False
+            )
+        db.session.commit()
+        click.echo(f"{len(orfaos)} embeddings órfãos apagados do banco")
+
+    # Templates e cada shard de centróides são montados em paralelo, cada um no seu store
+    inicio = time.perf_counter()
+    partes = {destino[0]: _parte(destino, template_ids, templates, ids, centroids) for destino in destinos}
+    with ThreadPoolExecutor(max_workers=len(destinos)) as executor:
+        futuros = {nome: executor.submit(_montar_indice, kind, *partes[nome]) for nome, _, kind, _ in destinos}
+        indices = {nome: futuro.result() for nome, futuro in futuros.items()}
+    click.echo(f"Índices montados em {time.perf_counter() - inicio:.1f}s")
+
+    for nome, store, kind, _ in destinos:
+        face_index, (ids_nome, vectors_nome) = indices[nome], partes[nome]
+        with store.lock():
+            ids_nome, vectors_nome, mudou = _reaplicar_journal(store, marcas[nome], ids_nome, vectors_nome)
+            if mudou:
+                # Raro (cadastros durante a reconstrução): remonta com os vetores finais
+                face_index = _montar_indice(kind, ids_nome, vectors_nome)
+            generation = store.publish(face_index, items=(ids_nome, vectors_nome))
+        click.echo(f"{nome}: geração {generation} publicada com {len(ids_nome)} vetores")
+
+    # Tabela lateral do reconhecimento (resumo de cada paciente)
+    linhas = db.session.query(Paciente.idPaciente, Paciente.nomeComp, Paciente.status, Paciente.dataNasc).all()
+    click.echo(f"Metadados faciais: {patient_metadata().rebuild(linhas)} pacientes")
+
+
+# ---------- MIGRAÇÃO DE MODELO ----------
+def _chave_foto(nome):
+    # Id estável (63 bits) da foto no checkpoint, pelo nome do arquivo
+    import hashlib
+
+    return int.from_bytes(hashlib.blake2b(nome.encode(), digest_size=8).digest(), "big") >> 1
+
+
+def _fotos_de_cadastro():
+    """{caminho: idPaciente} das fotos retidas ({idPaciente}_{uuid}_{arquivo})."""
+    from app.routes.pacientes import UPLOAD_FOLDER
+
+    fotos = {}
+    for nome in os.listdir(UPLOAD_FOLDER):
+        prefixo = nome.split("_", 1)[0]
+        if prefixo.isdigit():
+            fotos[os.path.join(UPLOAD_FOLDER, nome)] = int(prefixo)
+    return fotos
+
+
+def _no_pool(pool, itens, lote, processos, ao_concluir, carregar=None):
+    """Envia `itens` ao pool em lotes e chama ao_concluir(lote, resultados) conforme terminam.
+
+    Com `carregar`, o que vai ao pool é carregar(item) (lido só na hora do envio).
+    """
+    from concurrent.futures import FIRST_COMPLETED, wait
+
+    lotes = [itens[i:i + lote] for i in range(0, len(itens), lote)]
+    em_voo = {}
+    while lotes or em_voo:
+        # Dois lotes por processo em voo: o pool nunca fica ocioso esperando o próximo
+        while lotes and len(em_voo) < 2 * processos:
+            proximo = lotes.pop(0)
+            em_voo[pool.submit([carregar(item) for item in proximo] if carregar else proximo)] = proximo
+        prontos, _ = wait(em_voo, return_when=FIRST_COMPLETED)
+        for futuro in prontos:
+            ao_concluir(em_voo.pop(futuro), futuro.result())
+
+
+class _Reembedding:
+    """Re-embedding das fotos no pool, com checkpoint em journal (uma entrada por foto)."""
+
+    def __init__(self, pool, checkpoint, processos, lote):
+        from app.utils.face_store import OP_ADD
+
+        self.pool = pool
+        self.checkpoint = checkpoint
+        self.processos = processos
+        self.lote = lote
+        records, offset = checkpoint.read_from(0)
+        checkpoint.truncate(offset)  # cauda de uma execução interrompida
+        self.feitos = {chave: (embedding if op == OP_ADD else None) for op, chave, embedding in records}
+        self.imagens = 0
+        self.segundos = 0.0
+
+    def processar(self, fotos):
+        from app.utils.face_store import OP_ADD, OP_REMOVE
+        from app.utils.facial_recognition import dimension
+
+        pendentes = [caminho for caminho in fotos if _chave_foto(os.path.basename(caminho)) not in self.feitos]
+        if not pendentes:
+            return 0
+        inicio = time.perf_counter()
+        contagem = {"feitas": 0, "falhas": 0}
+
+        def concluir(lote, resultados):
+            for caminho, embedding in zip(lote, resultados):
+                chave = _chave_foto(os.path.basename(caminho))
+                if isinstance(embedding, Exception):
+                    # Sem rosto utilizável: fica registrado para não tentar de novo
+                    self.checkpoint.append(OP_REMOVE, chave, np.zeros(dimension, dtype=np.float32))
+                    self.feitos[chave] = None
+                    contagem["falhas"] += 1
+                    continue
+                if len(embedding) != dimension:
+                    raise click.ClickException(f"O modelo novo gera vetores de {len(embedding)}D; o índice usa {dimension}D")
+                self.checkpoint.append(OP_ADD, chave, embedding)
+                self.feitos[chave] = np.asarray(embedding, dtype=np.float32)
+            contagem["feitas"] += len(lote)
+            if contagem["feitas"] % (self.lote * 50) < self.lote:
+                click.echo(f"  {contagem['feitas']}/{len(pendentes)} fotos")
+
+        _no_pool(self.pool, pendentes, self.lote, self.processos, concluir)
+        self.checkpoint.sync()
+
+        segundos = time.perf_counter() - inicio
+        self.imagens += contagem["feitas"]
+        self.segundos += segundos
+        click.echo(f"  {contagem['feitas']} fotos em {segundos:.1f}s ({contagem['falhas']} sem rosto utilizável)")
+        return contagem["feitas"]
+
+    def templates(self, fotos, pacientes, maximo):
+        """(ids de template, vetores): as `maximo` fotos mais recentes de cada paciente."""
+        from app.utils.facial_recognition import TEMPLATE_SLOTS, dimension
+
+        por_paciente = {}
+        for caminho, id_paciente in fotos.items():
+            embedding = self.feitos.get(_chave_foto(os.path.basename(caminho)))
+            if embedding is not None and id_paciente in pacientes:
+                por_paciente.setdefault(id_paciente, []).append((os.path.getmtime(caminho), embedding))
+
+        ids, vectors = [], []
+        for id_paciente, lista in por_paciente.items():
+            lista.sort(key=lambda item: item[0], reverse=True)
+            for slot, (_, embedding) in enumerate(lista[:maximo]):
+                ids.append(id_paciente * TEMPLATE_SLOTS + slot)
+                vectors.append(embedding)
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty((0, dimension), dtype=np.float32)
+        return np.asarray(ids, dtype=np.int64), np.stack(vectors).astype(np.float32)
+
+
+@face_cli.command("migrar")
+@click.option("--perfil", required=True, help="Perfil de FACE_MODEL_PROFILES do modelo novo.")
+@click.option("--pack", help="Pacote do InsightFace (padrão: o do perfil).")
+@click.option("--versao", required=True, help="Versão gravada junto dos embeddings novos.")
+@click.option("--processos", default=os.cpu_count() or 1, show_default=True, help="Processos do pool de inferência.")
+@click.option("--lote", default=16, show_default=True, help="Fotos por tarefa enviada ao pool.")
+@click.option("--trocar/--sem-trocar", default=True, show_default=True, help="Ativa o modelo novo ao terminar.")
+@click.option("--forcar", is_flag=True, help="Troca mesmo que algum paciente fique sem rosto no índice novo.")
+def migrar(perfil, pack, versao, processos, lote, trocar, forcar):
+    """Re-gera os embeddings de todas as fotos de cadastro com outro modelo e troca o índice.
+
+    As fotos retidas em uploads/faces passam pelo pool de processos com o
+    modelo novo; cada resultado vai para um checkpoint em
+    FACE_DATA_DIR/<pack>-v<versao>, então o comando pode ser interrompido e
+    rodado de novo do ponto em que parou. O índice novo é montado nesse
+    diretório enquanto o antigo continua atendendo as buscas. A troca grava o
+    arquivo ATIVO de uma vez (modelo + índice); cada worker recarrega o motor
+    na requisição seguinte. Fotos enviadas durante a migração são processadas
+    antes da troca, com os cadastros no índice antigo bloqueados.
+    """
+    import json
+
+    from contextlib import ExitStack
+
+    from app.config import FACE_MAX_TEMPLATES, FACE_MODEL_PROFILES
+    from app.database import db
+    from app.models.paciente import Paciente
+    from app.models.paciente_embedding import PacienteEmbedding
+    from app.utils.face_pool import InferencePool
+    from app.utils.face_store import EmbeddingJournal, _atomic_write
+    from app.utils.facial_recognition import ACTIVE_MODEL_FILE, TEMPLATE_SLOTS, active_model, dimension
+
+    if perfil not in FACE_MODEL_PROFILES:
+        raise click.ClickException(f"Perfil de modelo desconhecido: {perfil}")
+    pack = pack or FACE_MODEL_PROFILES[perfil]["pack"]
+    atual = active_model()
+    if (pack, versao) == (atual["pack"], atual["versao"]):
+        raise click.ClickException(f"{pack} v{versao} já é o modelo em uso")
+
+    alvo = {"perfil": perfil, "pack": pack, "versao": versao, "diretorio": f"{pack}-v{versao}"}
+    destino = os.path.join(FACE_DATA_DIR, alvo["diretorio"])
+    os.makedirs(destino, exist_ok=True)
+    click.echo(f"Migrando de {atual['pack']} v{atual['versao']} para {pack} v{versao} em {destino}")
+
+    reembedding = _Reembedding(
+        InferencePool(processos, profile=perfil, overrides={"pack": pack}),
+        EmbeddingJournal(os.path.join(destino, "checkpoint.log"), dimension, fsync_every=lote * processos),
+        processos,
+        lote,
+    )
+    if reembedding.feitos:
+        click.echo(f"Retomando: {len(reembedding.feitos)} fotos já estavam no checkpoint")
+    inicio = time.perf_counter()
+    reembedding.pool.warm_up()
+    click.echo(f"{processos} processos com o modelo novo prontos em {time.perf_counter() - inicio:.1f}s")
+
+    def publicar(fotos):
+        pacientes = {id_paciente for (id_paciente,) in db.session.query(Paciente.idPaciente)}
+        template_ids, templates = reembedding.templates(fotos, pacientes, FACE_MAX_TEMPLATES)
+        ids, centroids = _centroides(template_ids, templates, TEMPLATE_SLOTS)
+        for alvo_store in _destinos(destino):
+            _, store, kind, _ = alvo_store
+            ids_store, vectors_store = _parte(alvo_store, template_ids, templates, ids, centroids)
+            with store.lock():
+                store.publish(_montar_indice(kind, ids_store, vectors_store), items=(ids_store, vectors_store))
+
+        # Cópia no banco com o modelo/versão novos (as linhas antigas ficam para um eventual retorno)
+        PacienteEmbedding.query.filter_by(modelo=pack, versao=versao).delete(synchronize_session=False)
+        for i in range(0, len(template_ids), 1000):
+            db.session.add_all([
+                PacienteEmbedding(
+                    idPaciente=int(template_id) // TEMPLATE_SLOTS,
+                    slot=int(template_id) % TEMPLATE_SLOTS,
+                    vetor=templates[i + row].tobytes(),
+                    modelo=pack,
+                    versao=versao,
+                )
+                for row, template_id in enumerate(template_ids[i:i + 1000])
+            ])
+            db.session.flush()
+        db.session.commit()
+        return ids
+
+    fotos = _fotos_de_cadastro()
+    click.echo(f"{len(fotos)} fotos de cadastro")
+    reembedding.processar(fotos)
+    ids = publicar(fotos)
+    click.echo(f"Índice novo: {len(ids)} pacientes")
+
+    sem_rosto = sorted(set(np.asarray(_embeddings(_abrir_indice())[0]).tolist()) - set(ids.tolist()))
+    if sem_rosto:
+        click.echo(
+            f"{len(sem_rosto)} pacientes do índice atual sem foto utilizável no modelo novo: "
+            + ", ".join(map(str, sem_rosto[:20])) + (" ..." if len(sem_rosto) > 20 else "")
+        )
+
+    if trocar and sem_rosto and not forcar:
+        raise click.ClickException("Troca cancelada: recadastre esses pacientes ou use --forcar")
+    if trocar:
+        # Cadastros no índice antigo ficam bloqueados até o ATIVO apontar para o novo
+        with ExitStack() as locks:
+            for _, store, _, _ in _destinos(atual["diretorio"]):
+                locks.enter_context(store.lock())
+            fotos = _fotos_de_cadastro()
+            if reembedding.processar(fotos):
+                publicar(fotos)
+            _atomic_write(ACTIVE_MODEL_FILE, lambda f: f.write(json.dumps(alvo).encode()))
+        click.echo(f"Modelo ativo: {pack} v{versao}; os workers recarregam na próxima requisição")
+    reembedding.pool.shutdown()
+
+    if reembedding.imagens:
+        por_segundo = reembedding.imagens / reembedding.segundos
+        click.echo(
+            f"Vazão: {por_segundo:.1f} imagens/s com {processos} processos "
+            f"({por_segundo / processos:.2f} imagens/s por núcleo)"
+        )
+
+
+# ---------- CADASTRO EM MASSA ----------
+def _leitor_de_fotos(origem):
+    """Função nome -> bytes para um ZIP ou um diretório de fotos."""
+    import zipfile
+
+    if os.path.isdir(origem):
+        def ler(nome):
+            with open(os.path.join(origem, nome), "rb") as f:
+                return f.read()
+        return ler
+
+    arquivo = zipfile.ZipFile(origem)
+    # Aceita o nome com ou sem a pasta de dentro do ZIP
+    nomes = {os.path.basename(nome): nome for nome in arquivo.namelist() if not nome.endswith("/")}
+    return lambda nome: arquivo.read(nome if nome in arquivo.NameToInfo else nomes[os.path.basename(nome)])
+
+
+def _rostos_repetidos(vetores, limiar, lote=4096):
+    """Por linha: pacientes do índice ativo e linhas anteriores de `vetores` com o mesmo rosto.
+
+    Mesmo range_search do `flask face duplicados` (float32 exatos, L2 ao
+    quadrado): {"idPaciente", "similaridade"} para centróides do índice e
+    {"posicao", "similaridade"} para posições anteriores do próprio lote.
+    """
+    import faiss
+
+    achados = [[] for _ in range(len(vetores))]
+    ids, centroides = _embeddings(_abrir_indice())
+    ids = np.asarray(ids)
+    raio = 2.0 - 2.0 * limiar
+    for base, no_lote in ((centroides, False), (vetores, True)):
+        if not len(base) or not len(vetores):
+            continue
+        index = faiss.IndexFlatL2(vetores.shape[1])
+        for inicio in range(0, len(base), 65536):
+            index.add(np.ascontiguousarray(base[inicio:inicio + 65536], dtype=np.float32))
+        for inicio in range(0, len(vetores), lote):
+            consultas = np.ascontiguousarray(vetores[inicio:inicio + lote], dtype=np.float32)
+            lims, distancias, vizinhos = index.range_search(consultas, raio)
+            for linha in range(len(consultas)):
+                i = inicio + linha
+                for d, j in zip(distancias[lims[linha]:lims[linha + 1]], vizinhos[lims[linha]:lims[linha + 1]]):
+                    similaridade = round(1.0 - float(d) / 2.0, 4)
+                    if not no_lote:
+                        achados[i].append({"idPaciente": int(ids[j]), "similaridade": similaridade})
+                    elif j < i:
+                        achados[i].append({"posicao": int(j), "similaridade": similaridade})
+    return achados
+
+
+@face_cli.command("importar")
+@click.argument("fotos", type=click.Path(exists=True))
+@click.option("--manifesto", required=True, type=click.Path(exists=True, dir_okay=False),
+              help="CSV com as colunas do paciente e a coluna foto (nome do arquivo).")
+@click.option("--processos", default=os.cpu_count() or 1, show_default=True, help="Processos do pool de inferência.")
+@click.option("--lote", default=500, show_default=True, help="Pacientes por transação.")
+@click.option("--relatorio", default="importacao.csv", show_default=True, type=click.Path(dir_okay=False))
+@click.option("--ignorar-duplicados", is_flag=True,
+              help="Importa também as linhas com rosto já cadastrado (o relatório continua apontando).")
+def importar(fotos, manifesto, processos, lote, relatorio, ignorar_duplicados):
+    """Cadastra pacientes em massa a partir de um ZIP (ou diretório) de fotos e um manifesto CSV.
+
+    Valida cada linha com o PacienteSchema, gera os embeddings no pool de
+    processos, separa os rostos já cadastrados (no índice ou em outra linha do
+    manifesto, com FACE_DUPLICATE_SIMILARITY, como o cadastro pela API),
+    insere os pacientes em transações de `lote` linhas e, no fim,
+    acrescenta todos os rostos aos índices de uma vez (um build, uma geração
+    nova). O relatório traz o resultado de cada linha do manifesto. Se o
+    processo cair entre o banco e o índice, `flask face reconstruir` refaz o
+    índice a partir dos embeddings gravados.
+    """
+    import csv
+    import json
+    import uuid
+
+    from marshmallow import ValidationError
+    from werkzeug.utils import secure_filename
+
+    from app.config import FACE_DUPLICATE_SIMILARITY, FACE_INDEX_TYPE
+    from app.database import db
+    from app.models.paciente import Paciente
+    from app.models.paciente_embedding import PacienteEmbedding
+    from app.routes.pacientes import UPLOAD_FOLDER
+    from app.schemas.paciente import PacienteSchema
+    from app.utils.face_pool import InferencePool
+    from app.utils.facial_recognition import TEMPLATE_SLOTS, active_model, patient_metadata
+
+    inicio = time.perf_counter()
+    with open(manifesto, newline="", encoding="utf-8-sig") as f:
+        linhas = list(csv.DictReader(f))
+    ler_foto = _leitor_de_fotos(fotos)
+    schema = PacienteSchema()
+    resultado = [{"linha": n + 2, "nomeComp": l.get("nomeComp", ""), "cpf": l.get("cpf", "")} for n, l in enumerate(linhas)]
+
+    def falhou(i, mensagem):
+        resultado[i].update(status="erro", erro=mensagem)
+
+    # 1) Validação das linhas e unicidade de CPF/RG (no arquivo e no banco)
+    validas, dados = [], {}
+    vistos = {"cpf": set(), "rg": set()}
+    for i, linha in enumerate(linhas):
+        foto = (linha.pop("foto", "") or "").strip()
+        try:
+            dados[i] = schema.load({k: v for k, v in linha.items() if v not in ("", None)})
+        except ValidationError as e:
+            falhou(i, json.dumps(e.messages, ensure_ascii=False))
+            continue
+        if not foto:
+            falhou(i, "Foto não informada")
+            continue
+        repetido = next((campo for campo in vistos if dados[i].get(campo) and dados[i][campo] in vistos[campo]), None)
+        if repetido:
+            falhou(i, f"{repetido} repetido no manifesto")
+            continue
+        for campo in vistos:
+            if dados[i].get(campo):
+                vistos[campo].add(dados[i][campo])
+        dados[i]["_foto"] = foto
+        validas.append(i)
+
+    for campo in ("cpf", "rg"):
+        valores = sorted(vistos[campo])
+        existentes = set()
+        for j in range(0, len(valores), 1000):
+            coluna = getattr(Paciente, campo)
+            existentes.update(v for (v,) in db.session.query(coluna).filter(coluna.in_(valores[j:j + 1000])))
+        for i in [i for i in validas if dados[i].get(campo) in existentes]:
+            falhou(i, f"{campo} já cadastrado")
+            validas.remove(i)
+    click.echo(f"{len(linhas)} linhas no manifesto, {len(validas)} válidas")
+
+    # 2) Embeddings no pool de processos (as fotos são lidas do ZIP na hora do envio)
+    ativo = active_model()
+    pool = InferencePool(processos, profile=ativo["perfil"], overrides={"pack": ativo["pack"]})
+    pool.warm_up()
+    embeddings, ausentes = {}, set()
+    inicio_embed = time.perf_counter()
+
+    def concluir(lote_linhas, resultados):
+        for i, embedding in zip(lote_linhas, resultados):
+            if i in ausentes:
+                falhou(i, f"Foto {dados[i]['_foto']} não encontrada")
+            elif isinstance(embedding, Exception):
+                falhou(i, f"Foto: {embedding}")
+            else:
+                embeddings[i] = np.asarray(embedding, dtype=np.float32)
+
+    def carregar(i):
+        try:
+            return ler_foto(dados[i]["_foto"])
+        except (KeyError, OSError):
+            ausentes.add(i)
+            return b""
+
+    _no_pool(pool, validas, 16, processos, concluir, carregar=carregar)
+    pool.shutdown()
+    segundos_embed = time.perf_counter() - inicio_embed
+    click.echo(f"{len(embeddings)} rostos em {segundos_embed:.1f}s ({len(embeddings) / max(segundos_embed, 1e-9):.1f} fotos/s)")
+
+    # 3) Rosto já no índice ou repetido numa linha anterior do manifesto
+    prontas = [i for i in validas if i in embeddings]
+    vetores = np.stack([embeddings[i] for i in prontas]) if prontas else np.zeros((0, 1), dtype=np.float32)
+    repetidas = 0
+    for i, achados in zip(prontas, _rostos_repetidos(vetores, FACE_DUPLICATE_SIMILARITY)):
+        if not achados:
+            continue
+        for achado in achados:
+            if "posicao" in achado:
+                achado["linha"] = resultado[prontas[achado.pop("posicao")]]["linha"]
+        resultado[i]["duplicados"] = json.dumps(achados, ensure_ascii=False)
+        repetidas += 1
+        if not ignorar_duplicados:
+            resultado[i].update(status="duplicado", erro="Rosto já cadastrado (ver duplicados)")
+    click.echo(f"{repetidas} linhas com rosto já cadastrado" + (" (importadas mesmo assim)" if ignorar_duplicados else ""))
+    if not ignorar_duplicados:
+        prontas = [i for i in prontas if "duplicados" not in resultado[i]]
+
+    # 4) Pacientes em transações de `lote` linhas
+    novos_ids, novos_vetores = [], []
+    for j in range(0, len(prontas), lote):
+        parte = prontas[j:j + lote]
+        gravadas, resumos = [], []
+        try:
+            pacientes = {i: Paciente(**{k: v for k, v in dados[i].items() if k != "_foto"}) for i in parte}
+            db.session.add_all(pacientes.values())
+            db.session.flush()
+            for i, paciente in pacientes.items():
+                db.session.add(PacienteEmbedding(
+                    idPaciente=paciente.idPaciente,
+                    slot=0,
+                    vetor=embeddings[i].tobytes(),
+                    modelo=ativo["pack"],
+                    versao=ativo["versao"],
+                ))
+                nome = secure_filename(f"{paciente.idPaciente}_{uuid.uuid4().hex}_{os.path.basename(dados[i]['_foto'])}")
+                caminho = os.path.join(UPLOAD_FOLDER, nome)
+                with open(caminho, "wb") as f:
+                    f.write(ler_foto(dados[i]["_foto"]))
+                gravadas.append(caminho)
+                resumos.append((paciente.idPaciente, paciente.nomeComp, paciente.status, paciente.dataNasc))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            for caminho in gravadas:
+                os.remove(caminho)
+            for i in parte:
+                falhou(i, f"Erro ao gravar o lote no banco: {e}")
+            continue
+        metadados = patient_metadata()
+        for resumo in resumos:
+            metadados.put(*resumo)
+        for i, paciente in pacientes.items():
+            resultado[i].update(status="ok", idPaciente=paciente.idPaciente)
+            novos_ids.append(paciente.idPaciente)
+            novos_vetores.append(embeddings[i])
+        click.echo(f"  {len(novos_ids)}/{len(prontas)} pacientes gravados")
+
+    # 5) Um add (e uma publicação) por índice para todos os rostos novos
+    if novos_ids:
+        ids = np.asarray(novos_ids, dtype=np.int64)
+        vetores = np.stack(novos_vetores)
+        _abrir_indice("templates").add_many(ids * TEMPLATE_SLOTS, vetores)
+        centroides = vetores / np.linalg.norm(vetores, axis=1, keepdims=True)
+        _abrir_indice(kind=FACE_INDEX_TYPE).add_many(ids, centroides)
+
+    with open(relatorio, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["linha", "nomeComp", "cpf", "status", "idPaciente", "erro", "duplicados"])
+        writer.writeheader()
+        writer.writerows(resultado)
+    duplicadas = sum(1 for r in resultado if r.get("status") == "duplicado")
+    erros = sum(1 for r in resultado if r.get("status") not in ("ok", "duplicado"))
+    click.echo(
+        f"{len(novos_ids)} pacientes cadastrados, {duplicadas} duplicados, {erros} linhas com erro em "
+        f"{time.perf_counter() - inicio:.1f}s; relatório em {relatorio}"
+    )
+
+
+# ---------- FILA DE CADASTROS FACIAIS ----------
+@face_cli.command("cadastros")
+@click.option("--workers", default=1, show_default=True, help="Threads consumindo a fila.")
+@click.option("--esvaziar", is_flag=True, help="Processa o que já está vencido na fila e sai.")
+def cadastros(workers, esvaziar):
+    """Consome a fila de cadastros faciais (tabela cadastro_facial).
+
+    Para quando os processos web rodam com FACE_ENROLL_WORKERS=0, ou para
+    esvaziar a fila depois de uma parada. Pode rodar junto com os workers dos
+    processos web: cada cadastro é reivindicado por um só consumidor.
+    """
+    from flask import current_app
+
+    from app.utils.face_jobs import EnrollmentWorkers, queue_status
+
+    click.echo("Fila: " + (", ".join(f"{status}={total}" for status, total in sorted(queue_status().items())) or "vazia"))
+    pool = EnrollmentWorkers(current_app._get_current_object(), workers)
+    if esvaziar:
+        while pool.run_once():
+            pass
+    else:
+        pool.start()
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            click.echo("Encerrando...")
+            pool.stop()
+    click.echo("Processados: " + (", ".join(f"{status}={total}" for status, total in sorted(pool.done.items(), key=str)) or "nenhum"))
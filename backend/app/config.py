@@ -0,0 +1,178 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Reconhecimento facial: índice FAISS ---
+# Tipo do índice: "flat" (busca exata), "ivf" (IVF-Flat), "hnsw",
+# "sq" (escalar quantizado) ou "pq" (product quantization)
+FACE_INDEX_TYPE = os.getenv("FACE_INDEX_TYPE", "flat").lower()
+
+# Abaixo deste número de pacientes a busca exata continua sendo usada;
+# ao passar dele o índice é treinado/reconstruído no tipo configurado
+FACE_INDEX_TRAIN_THRESHOLD = int(os.getenv("FACE_INDEX_TRAIN_THRESHOLD", "20000"))
+
+# IVF-Flat: nlist=0 escolhe automaticamente (~4*sqrt(N))
+FACE_IVF_NLIST = int(os.getenv("FACE_IVF_NLIST", "0"))
+FACE_IVF_NPROBE = int(os.getenv("FACE_IVF_NPROBE", "16"))
+
+# HNSW
+FACE_HNSW_M = int(os.getenv("FACE_HNSW_M", "32"))
+FACE_HNSW_EF_CONSTRUCTION = int(os.getenv("FACE_HNSW_EF_CONSTRUCTION", "80"))
+FACE_HNSW_EF_SEARCH = int(os.getenv("FACE_HNSW_EF_SEARCH", "64"))
+
+# Armazenamento comprimido: "sq" guarda fp16 (1 KB/paciente) ou 8bit (512 B);
+# "pq" guarda FACE_PQ_M bytes/paciente. Os top-k são reordenados pela distância
+# exata sobre os vetores float32 do snapshot (arquivo mapeado em memória),
+# buscando k * FACE_RERANK_FACTOR candidatos no índice comprimido
+FACE_SQ_TYPE = os.getenv("FACE_SQ_TYPE", "fp16")
+FACE_PQ_M = int(os.getenv("FACE_PQ_M", "64"))
+FACE_RERANK_FACTOR = int(os.getenv("FACE_RERANK_FACTOR", "8"))
+
+# --- Reconhecimento facial: persistência (snapshot + journal) ---
+FACE_DATA_DIR = os.getenv("FACE_DATA_DIR", "face_data")
+# fsync em lote do journal: a cada N cadastros ou T segundos, o que vier primeiro
+FACE_JOURNAL_FSYNC_EVERY = int(os.getenv("FACE_JOURNAL_FSYNC_EVERY", "16"))
+FACE_JOURNAL_FSYNC_INTERVAL = float(os.getenv("FACE_JOURNAL_FSYNC_INTERVAL", "1.0"))
+# Compacta o journal num snapshot novo a cada N registros
+FACE_SNAPSHOT_EVERY = int(os.getenv("FACE_SNAPSHOT_EVERY", "1000"))
+# Shards do índice de centróides (idPaciente % N), cada um com snapshot, journal e
+# lock próprios em FACE_DATA_DIR/shard-i; 1 = índice único, direto em FACE_DATA_DIR.
+# A busca consulta os shards em paralelo numa pool de FACE_SHARD_WORKERS threads (0 = um por shard)
+FACE_SHARDS = max(1, int(os.getenv("FACE_SHARDS", "1")))
+FACE_SHARD_WORKERS = int(os.getenv("FACE_SHARD_WORKERS", "0"))
+
+# --- Reconhecimento facial: micro-lotes de inferência ---
+# Requisições que chegam dentro da janela são processadas juntas (1 = sem lote)
+FACE_BATCH_WINDOW_MS = float(os.getenv("FACE_BATCH_WINDOW_MS", "10"))
+FACE_BATCH_MAX_SIZE = int(os.getenv("FACE_BATCH_MAX_SIZE", "8"))
+
+# --- Reconhecimento facial: controle de admissão ---
+# Buscas/cadastros executando ao mesmo tempo (0 = um lote cheio por processo de inferência)
+FACE_MAX_CONCURRENT = int(os.getenv("FACE_MAX_CONCURRENT", "0"))
+# Quantos podem esperar por uma vaga; acima disso a resposta é 503 imediato
+FACE_MAX_QUEUE = int(os.getenv("FACE_MAX_QUEUE", "16"))
+# Prazo de cada requisição facial em ms (o cliente pode pedir menos com X-Request-Timeout-Ms);
+# o que vence na fila é descartado antes da inferência
+FACE_REQUEST_DEADLINE_MS = float(os.getenv("FACE_REQUEST_DEADLINE_MS", "5000"))
+
+# --- Reconhecimento facial: pool de processos de inferência ---
+# 0 = inferência no próprio processo web; N = N processos, cada um com seu modelo
+FACE_POOL_SIZE = int(os.getenv("FACE_POOL_SIZE", "0"))
+# Threads do ONNX runtime em cada processo do pool
+FACE_POOL_INTRA_OP_THREADS = int(os.getenv("FACE_POOL_INTRA_OP_THREADS", "1"))
+FACE_POOL_INTER_OP_THREADS = int(os.getenv("FACE_POOL_INTER_OP_THREADS", "1"))
+
+# --- Reconhecimento facial: modelo e ONNX runtime ---
+# Perfis prontos; FACE_PROFILE escolhe um e as variáveis abaixo sobrescrevem campos dele
+FACE_MODEL_PROFILES = {
+    "padrao": {"pack": "buffalo_l", "det_size": 640},
+    "leve": {"pack": "buffalo_s", "det_size": 320},
+    "antelope": {"pack": "antelopev2", "det_size": 640},
+}
+FACE_PROFILE = os.getenv("FACE_PROFILE", "padrao")
+FACE_MODEL_PACK = os.getenv("FACE_MODEL_PACK")
+# Identificam os embeddings gravados no banco (paciente_embedding): vetores de
+# outro modelo/versão não são comparáveis e ficam fora do índice reconstruído.
+# Depois de uma migração (flask face migrar) vale o que está em FACE_DATA_DIR/ATIVO
+FACE_EMBEDDING_MODEL = FACE_MODEL_PACK or FACE_MODEL_PROFILES.get(FACE_PROFILE, {}).get("pack", "")
+FACE_EMBEDDING_VERSION = os.getenv("FACE_EMBEDDING_VERSION", "1")
+FACE_MODEL_ROOT = os.getenv("FACE_MODEL_ROOT", "~/.insightface")
+FACE_DET_SIZE = os.getenv("FACE_DET_SIZE")
+# Só detecção + reconhecimento: landmarks e gênero/idade não são usados no pipeline
+FACE_ALLOWED_MODULES = os.getenv("FACE_ALLOWED_MODULES", "detection,recognition").split(",")
+FACE_CTX_ID = int(os.getenv("FACE_CTX_ID", "0"))
+# Vazio = provedores disponíveis no onnxruntime instalado
+FACE_ORT_PROVIDERS = [p for p in os.getenv("FACE_ORT_PROVIDERS", "").split(",") if p]
+# 0 = o ONNX runtime decide
+FACE_ORT_INTRA_OP_THREADS = int(os.getenv("FACE_ORT_INTRA_OP_THREADS", "0"))
+FACE_ORT_INTER_OP_THREADS = int(os.getenv("FACE_ORT_INTER_OP_THREADS", "0"))
+# disabled, basic, extended ou all
+FACE_ORT_GRAPH_OPTIMIZATION = os.getenv("FACE_ORT_GRAPH_OPTIMIZATION", "all")
+# sequential ou parallel
+FACE_ORT_EXECUTION_MODE = os.getenv("FACE_ORT_EXECUTION_MODE", "sequential")
+
+# --- Reconhecimento facial: carga do modelo ---
+# Modelo e índice só são carregados no primeiro uso; com FACE_WARMUP=1 uma
+# thread começa a carregá-los assim que o processo sobe (ver iniciar_segundo_plano em app/__init__.py)
+FACE_WARMUP = os.getenv("FACE_WARMUP", "1") == "1"
+
+# --- Reconhecimento facial: qualidade mínima do rosto ---
+# Checagens baratas antes do ArcFace (0 desliga cada uma)
+# Menor lado da caixa do rosto, em pixels
+FACE_MIN_SIZE = int(os.getenv("FACE_MIN_SIZE", "48"))
+# Variância do Laplaciano no rosto redimensionado para 112x112 (abaixo = borrado)
+FACE_MIN_SHARPNESS = float(os.getenv("FACE_MIN_SHARPNESS", "20"))
+# Desvio do nariz em relação ao centro dos olhos, em distâncias interoculares
+FACE_MAX_YAW = float(os.getenv("FACE_MAX_YAW", "0.45"))
+# Desvio da altura do nariz entre a linha dos olhos e a boca (0.5 = frontal)
+FACE_MAX_PITCH = float(os.getenv("FACE_MAX_PITCH", "0.3"))
+
+# --- Reconhecimento facial: dicas do cliente (caixa/landmarks do face-api) ---
+# Lado da entrada do detector quando ele roda só na região indicada (múltiplo de 32)
+FACE_ROI_DET_SIZE = int(os.getenv("FACE_ROI_DET_SIZE", "224"))
+# Margem em torno da caixa indicada, em fração do lado da caixa
+FACE_ROI_MARGIN = float(os.getenv("FACE_ROI_MARGIN", "0.3"))
+# 1 = landmarks válidos do cliente dispensam o detector; 0 = só restringem a região
+FACE_TRUST_CLIENT_LANDMARKS = os.getenv("FACE_TRUST_CLIENT_LANDMARKS", "1") == "1"
+
+# --- Reconhecimento facial: cache de embeddings/resultados ---
+# Entradas por cache (0 desliga) e validade em segundos
+FACE_CACHE_SIZE = int(os.getenv("FACE_CACHE_SIZE", "256"))
+FACE_CACHE_TTL = float(os.getenv("FACE_CACHE_TTL", "30"))
+# Distância de Hamming máxima entre dHashes da região do rosto (caixa ou recorte da dica)
+# para reaproveitar o embedding (0 = só hash exato)
+FACE_CACHE_DHASH_BITS = int(os.getenv("FACE_CACHE_DHASH_BITS", "0"))
+
+# --- Reconhecimento facial: vários templates por paciente ---
+# Máximo de embeddings guardados por paciente (1 a 16, os slots do id do template); o índice principal guarda o centróide
+FACE_MAX_TEMPLATES = min(max(int(os.getenv("FACE_MAX_TEMPLATES", "5")), 1), 16)
+# Candidatos da busca pelo centróide que são reordenados pelos templates
+FACE_TEMPLATE_CANDIDATES = int(os.getenv("FACE_TEMPLATE_CANDIDATES", "5"))
+
+# --- Reconhecimento facial: decisão e confiança ---
+# Candidatos devolvidos por busca (a recepção confirma entre eles quando há dúvida)
+FACE_TOP_K = int(os.getenv("FACE_TOP_K", "3"))
+# Maior k que o cliente pode pedir (cada busca aloca k resultados por consulta)
+FACE_MAX_TOP_K = int(os.getenv("FACE_MAX_TOP_K", "20"))
+# Similaridade de cosseno mínima para aceitar (0.5 = o antigo limiar de distância 1.0)
+FACE_MIN_SIMILARITY = float(os.getenv("FACE_MIN_SIMILARITY", "0.5"))
+# Diferença mínima entre o 1º e o 2º candidato; abaixo dela o resultado é ambíguo
+FACE_MIN_MARGIN = float(os.getenv("FACE_MIN_MARGIN", "0.05"))
+# Candidatos abaixo desta similaridade nem aparecem na lista
+FACE_CANDIDATE_MIN_SIMILARITY = float(os.getenv("FACE_CANDIDATE_MIN_SIMILARITY", "0.3"))
+# Calibração da confiança: pacientes amostrados e validade (segundos) antes de recalcular
+FACE_CALIBRATION_SAMPLE = int(os.getenv("FACE_CALIBRATION_SAMPLE", "500"))
+FACE_CALIBRATION_TTL = float(os.getenv("FACE_CALIBRATION_TTL", "600"))
+
+# --- Reconhecimento facial: pacientes duplicados ---
+# Similaridade a partir da qual um rosto é tratado como possível duplicata no cadastro
+FACE_DUPLICATE_SIMILARITY = float(os.getenv("FACE_DUPLICATE_SIMILARITY", "0.6"))
+
+# --- Reconhecimento facial: sessão contínua (WebSocket /reconhecimento/sessao) ---
+# IoU mínimo entre caixas de frames seguidos para continuar na mesma trilha
+FACE_TRACK_IOU = float(os.getenv("FACE_TRACK_IOU", "0.3"))
+# Segundos sem ver o rosto até a trilha ser descartada (a próxima aparição é um visitante novo)
+FACE_TRACK_TTL = float(os.getenv("FACE_TRACK_TTL", "1.5"))
+# Ganho relativo de qualidade (tamanho x frontalidade x nitidez) para gerar de novo o embedding da trilha
+FACE_TRACK_MIN_GAIN = float(os.getenv("FACE_TRACK_MIN_GAIN", "0.2"))
+# Segundos até uma trilha não reconhecida (ambígua, sem cadastro, erro) ser tentada de novo sem ganho de qualidade
+FACE_TRACK_RETRY = float(os.getenv("FACE_TRACK_RETRY", "1.0"))
+# Nitidez (variância do Laplaciano do rosto em 112x112) a partir da qual o rosto conta como nítido
+FACE_TRACK_SHARPNESS = float(os.getenv("FACE_TRACK_SHARPNESS", "100"))
+# Maior frame aceito na sessão, em bytes
+FACE_STREAM_MAX_FRAME = int(os.getenv("FACE_STREAM_MAX_FRAME", str(2 * 1024 * 1024)))
+# Segundos para a sessão receber a mensagem de autenticação ({"tipo": "auth", "token": ...})
+FACE_STREAM_AUTH_TIMEOUT = float(os.getenv("FACE_STREAM_AUTH_TIMEOUT", "10"))
+
+# --- Reconhecimento facial: cadastro em segundo plano ---
+# Threads por processo web que consomem a fila de cadastros faciais, iniciadas com o processo
+# (ver iniciar_segundo_plano em app/__init__.py); 0 = só `flask face cadastros`
+FACE_ENROLL_WORKERS = int(os.getenv("FACE_ENROLL_WORKERS", "1"))
+# Intervalo (s) entre consultas à fila quando nenhum cadastro novo foi avisado
+FACE_ENROLL_POLL = float(os.getenv("FACE_ENROLL_POLL", "2"))
+# Tentativas antes de desistir e espera base (s) do backoff exponencial entre elas
+FACE_ENROLL_MAX_ATTEMPTS = int(os.getenv("FACE_ENROLL_MAX_ATTEMPTS", "5"))
+FACE_ENROLL_BACKOFF = float(os.getenv("FACE_ENROLL_BACKOFF", "5"))
+# Cadastro "processando" há mais que isto (s) volta para a fila (worker caiu no meio)
+FACE_ENROLL_LEASE = float(os.getenv("FACE_ENROLL_LEASE", "300"))
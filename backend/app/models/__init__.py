@@ -3,5 +3,7 @@ from .paciente import Paciente
 from .profissional import Profissional
 from .atendimento import Atendimento
 from .agendamento import Agendamento
+from .paciente_embedding import PacienteEmbedding
+from .cadastro_facial import CadastroFacial
 
 __all__ = ["db", "Paciente"]
@@ -0,0 +1,59 @@
+import json
+from app.database import db
+from sqlalchemy.sql import func
+
+class CadastroFacial(db.Model):
+    """Fila do cadastro facial: uma linha por foto que ainda vai para o índice.
+
+    O paciente é gravado na hora com o cadastro facial "pendente"; os workers
+    de app.utils.face_jobs geram o embedding e levam o status a "concluido",
+    "duplicado" (rosto já cadastrado em outro paciente) ou "falhou". Falhas
+    transitórias voltam para "pendente" com `proximaTentativa` adiada.
+    Excluir o paciente com o cadastro "processando" o marca como "cancelado":
+    o worker desfaz o que gravou no índice e apaga a linha. Horários em UTC,
+    gravados pela aplicação (datetime.utcnow).
+    """
+    __tablename__ = 'cadastro_facial'
+
+    PENDENTE = 'pendente'
+    PROCESSANDO = 'processando'
+    CONCLUIDO = 'concluido'
+    DUPLICADO = 'duplicado'
+    FALHOU = 'falhou'
+    CANCELADO = 'cancelado'
+
+    idCadastro = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    # Sem chave estrangeira: o cadastro cancelado sobrevive à exclusão do paciente
+    # até o worker que o processa terminar (ver app.utils.face_jobs)
+    idPaciente = db.Column(db.Integer, nullable=False)
+    foto = db.Column(db.String(255), nullable=False)
+    ignorarDuplicados = db.Column(db.Boolean, nullable=False, default=False)
+    status = db.Column(db.String(12), nullable=False, default=PENDENTE)
+    tentativas = db.Column(db.SmallInteger, nullable=False, default=0)
+    proximaTentativa = db.Column(db.DateTime, nullable=False)
+    iniciadoEm = db.Column(db.DateTime)
+    # Slot do template já gravado no índice: a retentativa só grava o banco, sem outro template
+    slot = db.Column(db.SmallInteger)
+    erro = db.Column(db.String(255))
+    duplicados = db.Column(db.Text)
+    criadoEm = db.Column(db.DateTime, server_default=func.now())
+    atualizadoEm = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        db.Index('idx_cadastro_facial_fila', 'status', 'proximaTentativa'),
+        db.Index('idx_cadastro_facial_paciente', 'idPaciente'),
+    )
+
+    def to_dict(self):
+        return {
+            "idCadastro": self.idCadastro,
+            "idPaciente": self.idPaciente,
+            "status": self.status,
+            "tentativas": self.tentativas,
+            "proximaTentativa": self.proximaTentativa.isoformat() if self.proximaTentativa else None,
+            "erro": self.erro,
+            "duplicados": json.loads(self.duplicados) if self.duplicados else [],
+        }
+
+    def __repr__(self):
+        return f'<CadastroFacial {self.idCadastro} {self.status}>'
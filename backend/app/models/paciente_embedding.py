@@ -0,0 +1,44 @@
+import numpy as np
+from app.database import db
+from sqlalchemy.sql import func
+
+class PacienteEmbedding(db.Model):
+    """Cópia durável de cada template facial do paciente (float32 em binário).
+
+    O índice em FACE_DATA_DIR pode ser refeito inteiro a partir desta tabela
+    (flask face reconstruir). `slot` é a posição do template (0..15), a mesma
+    usada no id do índice de templates; `modelo`/`versao` dizem com que modelo
+    o vetor foi gerado (durante uma migração o paciente tem as duas versões).
+    """
+    __tablename__ = 'paciente_embedding'
+
+    idEmbedding = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    idPaciente = db.Column(db.Integer, db.ForeignKey('paciente.idPaciente', onupdate='RESTRICT', ondelete='CASCADE'), nullable=False)
+    slot = db.Column(db.SmallInteger, nullable=False)
+    vetor = db.Column(db.LargeBinary, nullable=False)
+    modelo = db.Column(db.String(50), nullable=False)
+    versao = db.Column(db.String(20), nullable=False)
+    criadoEm = db.Column(db.DateTime, server_default=func.now())
+    atualizadoEm = db.Column(db.DateTime, server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('idPaciente', 'slot', 'modelo', 'versao', name='uq_embedding_paciente_slot'),
+        db.Index('idx_embedding_modelo', 'modelo', 'versao'),
+    )
+
+    @property
+    def vector(self):
+        return np.frombuffer(self.vetor, dtype=np.float32)
+
+    @classmethod
+    def salvar(cls, id_paciente, slot, vector, modelo, versao):
+        """Grava (ou substitui) o template do slot; o commit fica com quem chamou."""
+        registro = cls.query.filter_by(idPaciente=id_paciente, slot=slot, modelo=modelo, versao=versao).first()
+        if registro is None:
+            registro = cls(idPaciente=id_paciente, slot=slot, modelo=modelo, versao=versao)
+            db.session.add(registro)
+        registro.vetor = np.ascontiguousarray(vector, dtype=np.float32).tobytes()
+        return registro
+
+    def __repr__(self):
+        return f'<PacienteEmbedding {self.idPaciente}/{self.slot}>'
@@ -4,6 +4,7 @@ from .profissionais import profissionais_bp
 from .agendamentos import agendamentos_bp
 from .atendimentos import atendimentos_bp
 from .auth import auth_bp
+from .reconhecimento import reconhecimento_bp
 from app.utils.jwt_utils import verificar_token
 
 def register_routes(app):
@@ -13,11 +14,14 @@ def register_routes(app):
     app.register_blueprint(profissionais_bp)
     app.register_blueprint(agendamentos_bp)
     app.register_blueprint(atendimentos_bp)
+    app.register_blueprint(reconhecimento_bp)
 
     @app.before_request
     def proteger_rotas():
-        if request.path in ["/auth/login", "/auth/register"]:
-            return  # libera login e registro
+        if request.path in ["/auth/login", "/auth/register", "/reconhecimento/pronto"]:
+            return  # libera login, registro e a checagem de prontidão
+        if request.path == "/reconhecimento/sessao":
+            return  # WebSocket: autenticado pela primeira mensagem da sessão
 
         auth_header = request.headers.get("Authorization")
         if not auth_header:
@@ -1,11 +1,27 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify
 from marshmallow import ValidationError
 from app.models.paciente import Paciente, db
+from app.models.cadastro_facial import CadastroFacial
+from app.models.paciente_embedding import PacienteEmbedding
+from app.config import FACE_REQUEST_DEADLINE_MS
 from app.schemas.paciente import PacienteSchema
-from app.utils.facial_recognition import register_face, recognize_face
+from app.utils.face_admission import FaceOverloadedError
+from app.utils.face_jobs import notify_enrollment
+from app.utils.facial_recognition import (
+    DuplicateFaceError,
+    embedding_model,
+    patient_metadata,
+    register_face,
+    recognize_face,
+    remove_face,
+    restore_template,
+    top_k,
+)
 from app.utils.jwt_utils import login_required, role_required
 from werkzeug.utils import secure_filename
 import os
+import json
+import time
 from datetime import datetime
 import uuid  # Para gerar nomes únicos de arquivo
 
@@ -18,6 +34,121 @@ UPLOAD_FOLDER = "uploads/faces"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
+def _salvar_foto(conteudo, filename):
+    # Só fotos de cadastro que realmente ficam retidas vão para o disco
+    foto_path = os.path.join(UPLOAD_FOLDER, filename)
+    with open(foto_path, "wb") as f:
+        f.write(conteudo)
+    return foto_path
+
+
+def _remover_fotos(paciente_id):
+    prefixo = f"{paciente_id}_"
+    for nome in os.listdir(UPLOAD_FOLDER):
+        if nome.startswith(prefixo):
+            os.remove(os.path.join(UPLOAD_FOLDER, nome))
+
+
+def _guardar_embedding(paciente_id, template):
+    # Cópia durável do template no banco, na mesma transação do paciente
+    slot, vetor = template
+    PacienteEmbedding.salvar(paciente_id, slot, vetor, *embedding_model())
+
+
+def _desfazer_template(paciente_id, slot):
+    # register_face já gravou no índice, mas a transação não foi: o slot volta ao
+    # que o banco ainda guarda (o template anterior, ou nenhum)
+    modelo, versao = embedding_model()
+    anterior = PacienteEmbedding.query.filter_by(
+        idPaciente=paciente_id, slot=slot, modelo=modelo, versao=versao
+    ).first()
+    try:
+        restore_template(paciente_id, slot, anterior.vector if anterior else None)
+    except Exception as e:
+        print("Erro ao desfazer o template facial do paciente:", str(e))
+
+
+def _resumo(paciente):
+    # Mesmo formato da tabela lateral do reconhecimento (PatientMetadata.get)
+    data_nasc = paciente.dataNasc
+    return {
+        "idPaciente": paciente.idPaciente,
+        "nomeComp": paciente.nomeComp,
+        "status": paciente.status,
+        "dataNasc": data_nasc.isoformat() if hasattr(data_nasc, "isoformat") else data_nasc,
+    }
+
+
+def _atualizar_resumo(paciente):
+    # Mantém a tabela lateral do reconhecimento em dia; falha aqui não desfaz o cadastro
+    # (a busca cai para o banco quando o paciente não está na tabela)
+    try:
+        patient_metadata().put(paciente.idPaciente, paciente.nomeComp, paciente.status, paciente.dataNasc)
+    except Exception as e:
+        print("Erro ao atualizar metadados faciais do paciente:", str(e))
+
+
+def _ler_dica_rosto(form):
+    # Caixa/landmarks calculados pelo face-api no navegador (opcionais).
+    # Dica malformada é ignorada: o backend volta para a detecção completa.
+    dica = {}
+    for campo in ("caixa", "pontos"):
+        if form.get(campo):
+            try:
+                dica[campo] = json.loads(form[campo])
+            except ValueError:
+                return None
+    if form.get("recorte") in ("1", "true"):
+        dica["recorte"] = True
+    return dica or None
+
+
+def _prazo():
+    # Prazo (time.monotonic) da parte facial da requisição; o cliente pode pedir menos
+    ms = FACE_REQUEST_DEADLINE_MS
+    pedido = request.headers.get("X-Request-Timeout-Ms", type=float)
+    if pedido and pedido > 0:
+        ms = min(ms, pedido)
+    return time.monotonic() + ms / 1000
+
+
+def _resposta_sobrecarga(erro):
+    # Recusa rápida: nada de inferência para quem não vai ser atendido a tempo
+    resposta = jsonify({"erro": str(erro), "motivo": erro.reason, "tentar_em": erro.retry_after})
+    resposta.headers["Retry-After"] = str(erro.retry_after)
+    return resposta, 503
+
+
+def _ignorar_duplicados(dados):
+    # Campo de controle do formulário, não é coluna do paciente
+    return dados.pop("ignorar_duplicados", "") in ("1", "true")
+
+
+def _resposta_duplicados(erro):
+    ids = [c["idPaciente"] for c in erro.candidates]
+    pacientes = {p.idPaciente: p for p in Paciente.query.filter(Paciente.idPaciente.in_(ids)).all()}
+    duplicados = [
+        {
+            "idPaciente": c["idPaciente"],
+            "nomeComp": pacientes[c["idPaciente"]].nomeComp,
+            "cpf": pacientes[c["idPaciente"]].cpf,
+            "similaridade": c["similaridade"],
+        }
+        for c in erro.candidates
+        if c["idPaciente"] in pacientes
+    ]
+    return (
+        jsonify(
+            {
+                "erro": "Este rosto parece já estar cadastrado para outro paciente. "
+                        "Envie ignorar_duplicados=1 para cadastrar mesmo assim.",
+                "duplicados": duplicados,
+            }
+        ),
+        409,
+    )
+
+
 # ---------- LISTAR TODOS ----------
 @pacientes_bp.route("", methods=["GET"])
 @login_required
@@ -42,23 +173,17 @@ def get_paciente(id):
         return jsonify({"erro": f"Erro ao buscar paciente: {str(e)}"}), 500
 
 
-# ---------- CRIAR (com reconhecimento facial, apenas admin) ----------
+# ---------- CRIAR (cadastro facial em segundo plano, apenas admin) ----------
 @pacientes_bp.route("", methods=["POST"])
 @login_required
 @role_required("admin")
 def criar_paciente():
     try:
-        print("Dados do formulário:", dict(request.form))
-        print("Arquivos recebidos:", dict(request.files))
-
         dados = dict(request.form)
-        print("Dados recebidos:", dados)
-
+        ignorar_duplicados = _ignorar_duplicados(dados)
         paciente_data = dados
-        print("Dados que serão usados:", paciente_data)
-
     except Exception as e:
-        print("Erro geral:", str(e))
+        current_app.logger.exception("Erro ao processar o cadastro de paciente")
         return jsonify({"erro": f"Erro ao processar requisição: {str(e)}"}), 500
 
     foto = request.files.get("foto")
@@ -71,49 +196,113 @@ def criar_paciente():
             400,
         )
 
+    foto_path = None
     try:
-        print("Criando objeto Paciente com dados:", paciente_data)
         novo = Paciente(**paciente_data)
-        print("Objeto Paciente criado:", novo)
-
         db.session.add(novo)
-        print("Paciente adicionado à sessão")
-
-        db.session.flush()  
-        print("Flush realizado, ID do paciente:", novo.idPaciente)
+        db.session.flush()
 
         unique_id = uuid.uuid4().hex
         filename = secure_filename(f"{novo.idPaciente}_{unique_id}_{foto.filename}")
-        foto_path = os.path.join(UPLOAD_FOLDER, filename)
 
-        foto.save(foto_path)
-        print("Foto salva em:", foto_path)
-
-        try:
-            print("Registrando rosto...")
-            register_face(foto_path, novo.idPaciente)
-            print("Rosto registrado com sucesso")
-
-            db.session.commit()
-            print("Commit realizado com sucesso!")
-
-            return jsonify(paciente_schema.dump(novo)), 201
+        # O rosto entra no índice em segundo plano (app.utils.face_jobs): a transação
+        # só grava o paciente e o pedido de cadastro facial, sem esperar a inferência
+        foto_path = _salvar_foto(foto.read(), filename)
+        cadastro = CadastroFacial(
+            idPaciente=novo.idPaciente,
+            foto=filename,
+            ignorarDuplicados=ignorar_duplicados,
+            proximaTentativa=datetime.utcnow(),
+        )
+        db.session.add(cadastro)
 
-        except Exception as e:
-            print("Erro no reconhecimento facial:", str(e))
-            db.session.rollback()
-            if os.path.exists(foto_path):
-                os.remove(foto_path)
-            return (
-                jsonify({"erro": f"Erro ao processar reconhecimento facial: {str(e)}"}),
-                400,
-            )
+        db.session.commit()
 
     except Exception as e:
-        print("Erro ao criar paciente:", str(e))
+        current_app.logger.exception("Erro ao criar paciente")
         db.session.rollback()
+        if foto_path and os.path.exists(foto_path):
+            os.remove(foto_path)
         return jsonify({"erro": f"Erro ao criar paciente: {str(e)}"}), 500
 
+    _atualizar_resumo(novo)
+    notify_enrollment()
+
+    resposta = paciente_schema.dump(novo)
+    resposta["cadastroFacial"] = cadastro.to_dict()
+    return jsonify(resposta), 202
+
+
+# ---------- STATUS DO CADASTRO FACIAL ----------
+@pacientes_bp.route("/<int:id>/cadastro-facial", methods=["GET"])
+@login_required
+@role_required("admin", "atendente")
+def status_cadastro_facial(id):
+    cadastro = (
+        CadastroFacial.query.filter_by(idPaciente=id)
+        .order_by(CadastroFacial.idCadastro.desc())
+        .first()
+    )
+    if not cadastro:
+        return jsonify({"erro": "Nenhum cadastro facial para este paciente"}), 404
+    return jsonify(cadastro.to_dict()), 200
+
+
+def resposta_reconhecimento(resultado, completo=False):
+    """(corpo, código HTTP) da resposta do reconhecimento; usado também pela sessão contínua."""
+    # Resumo dos candidatos direto da tabela lateral do reconhecimento; o banco só é
+    # consultado para o cadastro completo (completo=1) ou para quem ainda não está nela
+    ids = [c["idPaciente"] for c in resultado["candidatos"]]
+    pacientes = {} if completo else patient_metadata().get_many(ids)
+    faltando = [i for i in ids if i not in pacientes]
+    if faltando:
+        for p in Paciente.query.filter(Paciente.idPaciente.in_(faltando)).all():
+            if completo:
+                pacientes[p.idPaciente] = paciente_schema.dump(p)
+            else:
+                pacientes[p.idPaciente] = _resumo(p)
+                _atualizar_resumo(p)
+    candidatos = [
+        {
+            "paciente": pacientes[c["idPaciente"]],
+            "similaridade": c["similaridade"],
+            "confianca": c["confianca"],
+        }
+        for c in resultado["candidatos"]
+        if c["idPaciente"] in pacientes
+    ]
+
+    if resultado["status"] == "nao_encontrado" or not candidatos:
+        return {
+            "status": "not_found",
+            "mensagem": "Nenhum paciente correspondente encontrado",
+            "candidatos": candidatos,
+        }, 404
+
+    if resultado["status"] == "ambiguo":
+        # 1º e 2º candidatos parecidos demais: a recepção confirma qual é o paciente
+        return {
+            "status": "ambiguous",
+            "mensagem": "Confirme o paciente entre os candidatos",
+            "margem": resultado["margem"],
+            "candidatos": candidatos,
+        }, 200
+
+    paciente = pacientes.get(resultado["idPaciente"])
+    if not paciente:
+        return {
+            "status": "error",
+            "mensagem": "Paciente não encontrado no banco de dados",
+        }, 404
+
+    return {
+        "status": "success",
+        "paciente": paciente,
+        "similaridade": candidatos[0]["similaridade"],
+        "confianca": candidatos[0]["confianca"],
+        "margem": resultado["margem"],
+        "candidatos": candidatos,
+    }, 200
 
 
 # ---------- ENCONTRAR PACIENTE POR ROSTO ----------
@@ -121,6 +310,7 @@ def criar_paciente():
 @login_required
 @role_required("admin", "atendente")  
 def encontrar_paciente():
+    prazo = _prazo()
     foto = request.files.get("foto")
     if not foto:
         return jsonify({"erro": "Foto é obrigatória"}), 400
@@ -131,60 +321,22 @@ def encontrar_paciente():
             400,
         )
 
-    unique_id = uuid.uuid4().hex
-    filename = secure_filename(f"buscar_{unique_id}_{foto.filename}")
-    foto_path = os.path.join(UPLOAD_FOLDER, filename)
-
     try:
-        foto.save(foto_path)
-
-        paciente_id, distancia = recognize_face(foto_path)
-
-        if os.path.exists(foto_path):
-            os.remove(foto_path)
-
-        if not paciente_id:
-            return (
-                jsonify(
-                    {
-                        "status": "not_found",
-                        "mensagem": "Nenhum paciente correspondente encontrado",
-                    }
-                ),
-                404,
-            )
-
-        paciente = Paciente.query.get(paciente_id)
-        if not paciente:
-            return (
-                jsonify(
-                    {
-                        "status": "error",
-                        "mensagem": "Paciente não encontrado no banco de dados",
-                    }
-                ),
-                404,
-            )
+        # A busca só lê dados: a imagem é decodificada em memória, sem tocar o disco.
+        # Com caixa/landmarks (ou recorte) do cliente a detecção é pulada ou restrita à região
+        try:
+            k = top_k(request.form.get("k", type=int))
+        except ValueError as e:
+            return jsonify({"erro": str(e)}), 400
+        completo = request.form.get("completo") in ("1", "true")
+        resultado = recognize_face(foto.read(), k=k, hint=_ler_dica_rosto(request.form), deadline=prazo)
 
-        return (
-            jsonify(
-                {
-                    "status": "success",
-                    "paciente": paciente_schema.dump(paciente),
-                    "distancia": float(distancia) if distancia else 0.0,
-                    "confianca": (
-                        f"{(1 - (float(distancia) if distancia else 0.0)) * 100:.2f}%"
-                        if distancia
-                        else "N/A"
-                    ),
-                }
-            ),
-            200,
-        )
+        corpo, codigo = resposta_reconhecimento(resultado, completo)
+        return jsonify(corpo), codigo
 
+    except FaceOverloadedError as e:
+        return _resposta_sobrecarga(e)
     except Exception as e:
-        if os.path.exists(foto_path):
-            os.remove(foto_path)
         return jsonify({"erro": f"Erro no reconhecimento facial: {str(e)}"}), 400
 
 
@@ -193,6 +345,7 @@ def encontrar_paciente():
 @login_required
 @role_required("admin")
 def atualizar_paciente(id):
+    prazo = _prazo()
     try:
         paciente = Paciente.query.get(id)
         if not paciente:
@@ -200,6 +353,7 @@ def atualizar_paciente(id):
 
         dados = dict(request.form)
         print("Dados recebidos para edição:", dados)
+        ignorar_duplicados = _ignorar_duplicados(dados)
 
         paciente_data = paciente_schema.load(dados, partial=True)
 
@@ -207,9 +361,11 @@ def atualizar_paciente(id):
             if hasattr(paciente, campo) and valor is not None:
                 setattr(paciente, campo, valor)
 
+        template = foto_path = None
         foto = request.files.get("foto")
         if foto:
             if not foto.filename.lower().endswith((".png", ".jpg", ".jpeg")):
+                db.session.rollback()
                 return (
                     jsonify(
                         {
@@ -224,22 +380,38 @@ def atualizar_paciente(id):
             filename = secure_filename(
                 f"{paciente.idPaciente}_{unique_id}_{foto.filename}"
             )
-            foto_path = os.path.join(UPLOAD_FOLDER, filename)
-
-            # Salvar nova foto
-            foto.save(foto_path)
+            conteudo = foto.read()
 
             try:
-                # Atualizar reconhecimento facial
-                register_face(foto_path, paciente.idPaciente)
+                # Mais um template do paciente (o índice guarda o centróide)
+                template = register_face(
+                    conteudo, paciente.idPaciente, check_duplicates=not ignorar_duplicados, deadline=prazo
+                )
+            except FaceOverloadedError as e:
+                db.session.rollback()
+                return _resposta_sobrecarga(e)
+            except DuplicateFaceError as e:
+                db.session.rollback()
+                return _resposta_duplicados(e)
             except Exception as e:
-                # Remover arquivo se houver erro no reconhecimento
-                if os.path.exists(foto_path):
-                    os.remove(foto_path)
+                db.session.rollback()
                 return jsonify({"erro": f"Erro ao processar nova foto: {str(e)}"}), 400
 
-        paciente.atualizadoEm = datetime.utcnow()
-        db.session.commit()
+        try:
+            if template is not None:
+                # Salvar nova foto só depois que o rosto foi aceito
+                foto_path = _salvar_foto(conteudo, filename)
+                _guardar_embedding(paciente.idPaciente, template)
+            paciente.atualizadoEm = datetime.utcnow()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            if template is not None:
+                _desfazer_template(paciente.idPaciente, template[0])
+            if foto_path and os.path.exists(foto_path):
+                os.remove(foto_path)
+            raise
+        _atualizar_resumo(paciente)
 
         return jsonify(paciente_schema.dump(paciente)), 200
 
@@ -262,12 +434,26 @@ def deletar_paciente(id):
         if not paciente:
             return jsonify({"erro": "Paciente não encontrado"}), 404
 
-        # TODO: Adicionar lógica para remover arquivos de face associados
-        # Isso depende de como você está gerenciando os arquivos de reconhecimento facial
-
+        PacienteEmbedding.query.filter_by(idPaciente=id).delete()
+        # Cadastro facial em andamento fica marcado: o worker desfaz o template que
+        # gravar depois daqui e apaga a linha; os demais saem já
+        CadastroFacial.query.filter_by(idPaciente=id, status=CadastroFacial.PROCESSANDO).update(
+            {CadastroFacial.status: CadastroFacial.CANCELADO}, synchronize_session=False
+        )
+        CadastroFacial.query.filter(
+            CadastroFacial.idPaciente == id, CadastroFacial.status != CadastroFacial.CANCELADO
+        ).delete(synchronize_session=False)
         db.session.delete(paciente)
         db.session.commit()
 
+        # Tira o embedding do índice e apaga as fotos de cadastro retidas
+        try:
+            patient_metadata().remove(id)
+            remove_face(id)
+            _remover_fotos(id)
+        except Exception as e:
+            print("Erro ao remover dados faciais do paciente:", str(e))
+
         return (
             jsonify({"mensagem": f"Paciente {id} deletado com sucesso", "id": id}),
             200,
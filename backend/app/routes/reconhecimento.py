@@ -0,0 +1,153 @@
+import json
+import struct
+import time
+
+from flask import Blueprint, jsonify, request
+from flask_sock import Sock
+
+from app.config import FACE_REQUEST_DEADLINE_MS, FACE_STREAM_AUTH_TIMEOUT, FACE_STREAM_MAX_FRAME
+from app.database import db
+from app.utils.face_admission import FaceOverloadedError
+from app.utils.face_jobs import queue_status
+from app.utils.face_tracking import FaceTracker, sharpness
+from app.utils.facial_recognition import metrics, recognize_face, status, top_k
+from app.utils.jwt_utils import login_required, role_required, verificar_token
+
+reconhecimento_bp = Blueprint("reconhecimento", __name__, url_prefix="/reconhecimento")
+sock = Sock()
+
+
+# ---------- MÉTRICAS DO RECONHECIMENTO FACIAL (apenas admin) ----------
+@reconhecimento_bp.route("/metricas", methods=["GET"])
+@login_required
+@role_required("admin")
+def metricas():
+    dados = metrics()
+    dados["cadastros"] = queue_status()
+    return jsonify(dados), 200
+
+
+# ---------- PRONTIDÃO DO MODELO (pública, para load balancer / frontend) ----------
+@reconhecimento_bp.route("/pronto", methods=["GET"])
+def pronto():
+    estado = status()
+    return jsonify(estado), 200 if estado["pronto"] else 503
+
+
+# ---------- SESSÃO CONTÍNUA (WebSocket) ----------
+def _ler_frame(mensagem):
+    # Frame binário: [tamanho do cabeçalho, uint32 big-endian][cabeçalho JSON][imagem]
+    # Cabeçalho: {"caixa": [x1, y1, x2, y2], "pontos": [[x, y] * 5], "origem": [x, y]},
+    # caixa/pontos nas coordenadas do vídeo; origem = canto do recorte enviado no vídeo
+    if not isinstance(mensagem, (bytes, bytearray)) or len(mensagem) < 4:
+        raise ValueError("Frame inválido")
+    if len(mensagem) > FACE_STREAM_MAX_FRAME:
+        raise ValueError("Frame grande demais")
+    (tamanho,) = struct.unpack(">I", mensagem[:4])
+    cabecalho = json.loads(mensagem[4:4 + tamanho])
+    if not isinstance(cabecalho, dict):
+        raise ValueError("Cabeçalho do frame não é um objeto JSON")
+    imagem = bytes(mensagem[4 + tamanho:])
+    if not imagem or not cabecalho.get("caixa"):
+        raise ValueError("Frame sem imagem ou sem caixa do rosto")
+    return cabecalho, imagem
+
+
+def _dica_no_recorte(cabecalho):
+    # Caixa/landmarks do vídeo levados para as coordenadas da imagem enviada
+    ox, oy = cabecalho.get("origem") or (0, 0)
+    dica = {"caixa": [v - o for v, o in zip(cabecalho["caixa"], (ox, oy, ox, oy))]}
+    if cabecalho.get("pontos"):
+        dica["pontos"] = [[x - ox, y - oy] for x, y in cabecalho["pontos"]]
+    if cabecalho.get("origem"):
+        dica["recorte"] = True
+    return dica
+
+
+def _autenticar(ws):
+    # Primeira mensagem da sessão: {"tipo": "auth", "token": "<JWT>"}. O token não vai
+    # na URL do handshake, que acaba em logs de acesso e de proxy
+    mensagem = ws.receive(timeout=FACE_STREAM_AUTH_TIMEOUT)
+    if not isinstance(mensagem, str):
+        return None
+    try:
+        controle = json.loads(mensagem)
+    except ValueError:
+        return None
+    if not isinstance(controle, dict) or controle.get("tipo") != "auth" or not controle.get("token"):
+        return None
+    return verificar_token(str(controle["token"]))
+
+
+@sock.route("/sessao", bp=reconhecimento_bp)
+def sessao(ws):
+    """Reconhecimento contínuo do quiosque numa conexão só.
+
+    O cliente manda frames (ou recortes) com a caixa/landmarks do face-api; o
+    rosto é acompanhado entre frames e embedding + busca só rodam quando
+    aparece uma trilha nova ou a qualidade melhora (ver FaceTracker). O
+    resultado, no mesmo formato de /pacientes/encontrar, volta pela conexão.
+    A primeira mensagem autentica a sessão ({"tipo": "auth", "token": ...});
+    {"tipo": "reiniciar"} descarta as trilhas (nova busca).
+    """
+    from app.routes.pacientes import resposta_reconhecimento
+
+    # Rota liberada em proteger_rotas: o navegador não envia cabeçalhos no handshake
+    usuario = _autenticar(ws)
+    if not usuario:
+        ws.close(reason=1008, message="Token não fornecido, inválido ou expirado")
+        return
+    if usuario["role"] not in ("admin", "atendente"):
+        ws.close(reason=1008, message="Acesso negado")
+        return
+    request.usuario_id = usuario["id"]
+    request.usuario_role = usuario["role"]
+
+    try:
+        k = top_k(request.args.get("k", type=int))
+    except ValueError as e:
+        ws.close(reason=1008, message=str(e))
+        return
+
+    tracker = FaceTracker()
+    completo = request.args.get("completo") in ("1", "true")
+    pausa_ate = 0.0  # sobrecarga: frames ignorados até o Retry-After sugerido
+
+    while True:
+        mensagem = ws.receive()
+        if isinstance(mensagem, str):
+            try:
+                controle = json.loads(mensagem)
+            except ValueError:
+                controle = {}
+            if controle.get("tipo") == "reiniciar":
+                tracker.reset()
+            continue
+
+        try:
+            cabecalho, imagem = _ler_frame(mensagem)
+            dica = _dica_no_recorte(cabecalho)
+            nitidez = sharpness(imagem, dica["caixa"])
+            trilha, processar = tracker.observe(cabecalho["caixa"], cabecalho.get("pontos"), sharp=nitidez)
+        except (ValueError, TypeError) as e:
+            ws.send(json.dumps({"tipo": "erro", "erro": str(e)}))
+            continue
+        if not processar or time.monotonic() < pausa_ate:
+            continue
+
+        try:
+            prazo = time.monotonic() + FACE_REQUEST_DEADLINE_MS / 1000
+            resultado = recognize_face(imagem, k=k, hint=dica, deadline=prazo)
+            corpo, _ = resposta_reconhecimento(resultado, completo)
+            tracker.record(trilha, resultado["status"])
+        except FaceOverloadedError as e:
+            # Não conta como tentativa da trilha: ela é processada de novo depois da pausa
+            pausa_ate = time.monotonic() + e.retry_after
+            corpo = {"erro": str(e), "motivo": e.reason, "tentar_em": e.retry_after}
+        except Exception as e:
+            tracker.record(trilha, "erro")
+            corpo = {"erro": f"Erro no reconhecimento facial: {str(e)}"}
+        finally:
+            # Conexão longa: cada frame processado é uma transação curta
+            db.session.remove()
+        ws.send(json.dumps({"tipo": "resultado", "trilha": trilha.id, **corpo, "sessao": tracker.metrics()}))
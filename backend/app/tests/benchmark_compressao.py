@@ -0,0 +1,102 @@
+"""Benchmark do armazenamento comprimido (SQ fp16/8bit, PQ) contra o IndexFlatL2.
+
+Gera embeddings sintéticos normalizados (512D) e mede, para cada variante:
+  - memória do índice (bytes por paciente, pelo índice serializado)
+  - recall@1 contra a busca exata
+  - latência p50/p99 de uma busca individual
+com e sem a reordenação exata dos top-k sobre os vetores float32 crus
+(arquivo mapeado em memória, como no snapshot do FaceStore).
+
+Uso (a partir de backend/):
+    python -m app.tests.benchmark_compressao
+    python -m app.tests.benchmark_compressao --tamanhos 100000 --pq-m 32 64 --fator 4 8 16
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from app.tests.benchmark_indices import DIMENSAO, gerar_consultas, gerar_embeddings
+from app.utils.face_index import build_index, exact_rerank
+
+
+def medir(buscar, consultas):
+    latencias = np.empty(len(consultas))
+    resultados = np.empty(len(consultas), dtype=np.int64)
+    for i in range(len(consultas)):
+        inicio = time.perf_counter()
+        _, indices = buscar(consultas[i:i + 1])
+        latencias[i] = (time.perf_counter() - inicio) * 1000
+        resultados[i] = indices[0][0]
+    return resultados, latencias
+
+
+def imprimir(n, nome, bytes_por_vetor, recall, latencias):
+    print(
+        f"{n:>9} {nome:>16} {bytes_por_vetor:>8.0f} {recall:>9.4f} "
+        f"{np.percentile(latencias, 50):>8.3f} {np.percentile(latencias, 99):>8.3f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--sq", nargs="+", default=["fp16", "8bit"])
+    parser.add_argument("--pq-m", type=int, nargs="+", default=[64])
+    parser.add_argument("--fator", type=int, nargs="+", default=[8], help="candidatos = k * fator na reordenação")
+    parser.add_argument("--consultas", type=int, default=1000)
+    parser.add_argument("--ruido", type=float, default=0.03)
+    parser.add_argument("--threads", type=int, default=1)
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    rng = np.random.default_rng(42)
+
+    print(f"{'N':>9} {'variante':>16} {'B/vetor':>8} {'recall@1':>9} {'p50(ms)':>8} {'p99(ms)':>8}")
+    for n in args.tamanhos:
+        base = gerar_embeddings(n, rng)
+        ids = np.arange(n, dtype=np.int64)
+        consultas = gerar_consultas(base, min(args.consultas, n), rng, args.ruido)
+
+        # Vetores crus num arquivo mapeado em memória, como vectors.g.f32 do snapshot
+        with tempfile.TemporaryDirectory() as tmp:
+            caminho = os.path.join(tmp, "vectors.f32")
+            base.tofile(caminho)
+            crus = np.memmap(caminho, dtype=np.float32, mode="r").reshape(n, DIMENSAO)
+
+            flat = build_index("flat", base, ids, DIMENSAO)
+            referencia, latencias = medir(lambda q, flat=flat: flat.search(q, 1), consultas)
+            imprimir(n, "flat", len(faiss.serialize_index(flat)) / n, 1.0, latencias)
+            del flat
+
+            variantes = [(f"sq-{t}", dict(kind="sq", sq_type=t)) for t in args.sq]
+            variantes += [(f"pq-{m}", dict(kind="pq", pq_m=m)) for m in args.pq_m]
+            for nome, parametros in variantes:
+                index = build_index(vectors=base, ids=ids, dimension=DIMENSAO, **parametros)
+                bytes_por_vetor = len(faiss.serialize_index(index)) / n
+
+                resultados, latencias = medir(lambda q, index=index: index.search(q, 1), consultas)
+                imprimir(n, nome, bytes_por_vetor, float(np.mean(resultados == referencia)), latencias)
+
+                for fator in args.fator:
+                    # Padrões prendem os objetos desta volta (o `del` abaixo libera a memória)
+                    def buscar(q, fator=fator, index=index, crus=crus):
+                        _, candidatos = index.search(q, fator)
+                        return exact_rerank(q, candidatos, ids, crus, 1)
+
+                    resultados, latencias = medir(buscar, consultas)
+                    imprimir(
+                        n, f"{nome}+rr{fator}", bytes_por_vetor,
+                        float(np.mean(resultados == referencia)), latencias,
+                    )
+                    del buscar
+                del index
+            del crus
+        del base
+
+
+if __name__ == "__main__":
+    main()
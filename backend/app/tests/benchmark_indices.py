@@ -0,0 +1,91 @@
+"""Benchmark dos backends de índice facial (flat x IVF-Flat x HNSW).
+
+Gera embeddings sintéticos normalizados (512D), monta cada backend com os
+parâmetros de app/config.py e mede, contra a busca exata (IndexFlatL2):
+  - recall@1
+  - latência p50/p99 de uma busca individual (como no totem da recepção)
+  - tempo de construção/treino
+
+Uso (a partir de backend/):
+    python -m app.tests.benchmark_indices
+    python -m app.tests.benchmark_indices --tamanhos 10000 100000 --consultas 500
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from app.utils.face_index import build_index
+
+DIMENSAO = 512
+
+
+def gerar_embeddings(n, rng, bloco=100_000):
+    dados = np.empty((n, DIMENSAO), dtype=np.float32)
+    for inicio in range(0, n, bloco):
+        fim = min(inicio + bloco, n)
+        parte = rng.standard_normal((fim - inicio, DIMENSAO), dtype=np.float32)
+        parte /= np.linalg.norm(parte, axis=1, keepdims=True)
+        dados[inicio:fim] = parte
+    return dados
+
+
+def gerar_consultas(base, n, rng, ruido):
+    # Consulta = foto nova de um paciente já cadastrado (embedding + ruído)
+    alvo = rng.choice(len(base), n, replace=False)
+    consultas = base[alvo] + ruido * rng.standard_normal((n, DIMENSAO), dtype=np.float32)
+    consultas /= np.linalg.norm(consultas, axis=1, keepdims=True)
+    return consultas
+
+
+def medir(index, consultas):
+    latencias = np.empty(len(consultas))
+    resultados = np.empty(len(consultas), dtype=np.int64)
+    for i in range(len(consultas)):
+        inicio = time.perf_counter()
+        _, indices = index.search(consultas[i:i + 1], 1)
+        latencias[i] = (time.perf_counter() - inicio) * 1000
+        resultados[i] = indices[0][0]
+    return resultados, latencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--backends", nargs="+", default=["flat", "ivf", "hnsw"])
+    parser.add_argument("--consultas", type=int, default=1000)
+    parser.add_argument("--ruido", type=float, default=0.03)
+    parser.add_argument("--threads", type=int, default=1, help="threads do FAISS (1 = latência por requisição)")
+    args = parser.parse_args()
+
+    faiss.omp_set_num_threads(args.threads)
+    rng = np.random.default_rng(42)
+
+    print(f"{'N':>9} {'backend':>7} {'build(s)':>9} {'recall@1':>9} {'p50(ms)':>8} {'p99(ms)':>8}")
+    for n in args.tamanhos:
+        base = gerar_embeddings(n, rng)
+        consultas = gerar_consultas(base, min(args.consultas, n), rng, args.ruido)
+
+        referencia = None
+        for backend in ["flat"] + [b for b in args.backends if b != "flat"]:
+            inicio = time.perf_counter()
+            index = build_index(backend, base, dimension=DIMENSAO)
+            tempo_build = time.perf_counter() - inicio
+
+            resultados, latencias = medir(index, consultas)
+            if referencia is None:
+                referencia = resultados
+            recall = float(np.mean(resultados == referencia))
+
+            if backend in args.backends:
+                print(
+                    f"{n:>9} {backend:>7} {tempo_build:>9.2f} {recall:>9.4f} "
+                    f"{np.percentile(latencias, 50):>8.3f} {np.percentile(latencias, 99):>8.3f}"
+                )
+            del index
+        del base
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Benchmark dos perfis de modelo facial (FACE_MODEL_PROFILES) em CPU.
+
+Para cada perfil, num processo separado (para medir memória isolada):
+  - tempo de carga do modelo e RSS antes/depois da carga
+  - latência p50/p99 por etapa: decodificação, detecção, alinhamento, embedding
+  - RSS máximo do processo ao final
+
+Uso (a partir de backend/):
+    python -m app.tests.benchmark_perfis --imagens uploads/faces
+    python -m app.tests.benchmark_perfis --perfis padrao leve --threads 1 2 4
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+
+ETAPAS = ("decodificacao", "deteccao", "alinhamento", "embedding")
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def _medir_perfil(perfil, threads, arquivos, repeticoes, saida):
+    import cv2
+    from app.utils.face_model import align, build_model, decode_image, detect, embed_batch, model_profile
+
+    rss_inicial = _rss_mb()
+    inicio = time.perf_counter()
+    model = build_model(model_profile(perfil, intra_op_threads=threads, ctx_id=-1))
+    carga = time.perf_counter() - inicio
+    rss_modelo = _rss_mb()
+
+    conteudos = []
+    for arquivo in arquivos:
+        with open(arquivo, "rb") as f:
+            conteudos.append(f.read())
+
+    tempos = {etapa: [] for etapa in ETAPAS}
+    sem_rosto = 0
+    for _ in range(repeticoes):
+        for conteudo in conteudos:
+            t0 = time.perf_counter()
+            img = cv2.cvtColor(decode_image(conteudo), cv2.COLOR_BGR2RGB)
+            t1 = time.perf_counter()
+            try:
+                _, kps = detect(model, img)
+            except ValueError:
+                sem_rosto += 1
+                continue
+            t2 = time.perf_counter()
+            crop = align(model, img, kps)
+            t3 = time.perf_counter()
+            embed_batch(model, [crop])
+            t4 = time.perf_counter()
+            for etapa, (a, b) in zip(ETAPAS, ((t0, t1), (t1, t2), (t2, t3), (t3, t4))):
+                tempos[etapa].append((b - a) * 1000)
+
+    saida.put({
+        "perfil": perfil,
+        "threads": threads,
+        "carga_s": carga,
+        "rss_modelo_mb": rss_modelo - rss_inicial,
+        "rss_max_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "sem_rosto": sem_rosto,
+        "tempos": {
+            etapa: (np.percentile(v, 50), np.percentile(v, 99)) if v else (float("nan"), float("nan"))
+            for etapa, v in tempos.items()
+        },
+    })
+
+
+def main():
+    from app.config import FACE_MODEL_PROFILES
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--imagens", default="uploads/faces", help="diretório com fotos de rosto (jpg/png)")
+    parser.add_argument("--perfis", nargs="+", default=list(FACE_MODEL_PROFILES))
+    parser.add_argument("--threads", type=int, nargs="+", default=[1], help="intra_op_num_threads do ONNX")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--max-imagens", type=int, default=50)
+    args = parser.parse_args()
+
+    arquivos = sorted(
+        f for ext in ("*.jpg", "*.jpeg", "*.png")
+        for f in glob.glob(os.path.join(args.imagens, ext))
+    )[:args.max_imagens]
+    if not arquivos:
+        parser.error(f"Nenhuma imagem encontrada em {args.imagens}")
+
+    contexto = multiprocessing.get_context("spawn")
+    cabecalho = f"{'perfil':>10} {'thr':>3} {'carga(s)':>8} {'RSS mod':>8} {'RSS max':>8}"
+    cabecalho += "".join(f" {etapa[:6] + ' p50/p99 ms':>17}" for etapa in ETAPAS)
+    print(cabecalho)
+
+    for perfil in args.perfis:
+        for threads in args.threads:
+            saida = contexto.Queue()
+            processo = contexto.Process(
+                target=_medir_perfil,
+                args=(perfil, threads, arquivos, args.repeticoes, saida),
+            )
+            processo.start()
+            resultado = saida.get()
+            processo.join()
+
+            linha = (
+                f"{perfil:>10} {threads:>3} {resultado['carga_s']:>8.2f} "
+                f"{resultado['rss_modelo_mb']:>7.0f}M {resultado['rss_max_mb']:>7.0f}M"
+            )
+            for etapa in ETAPAS:
+                p50, p99 = resultado["tempos"][etapa]
+                linha += f" {p50:>8.2f}/{p99:<8.2f}"
+            print(linha)
+            if resultado["sem_rosto"]:
+                print(f"{'':>10} (imagens sem rosto detectado: {resultado['sem_rosto']})")
+
+
+if __name__ == "__main__":
+    main()
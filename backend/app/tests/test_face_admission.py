@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+from app.utils.face_admission import AdmissionGate, FaceOverloadedError
+
+
+def test_admite_e_conta():
+    gate = AdmissionGate(max_concurrent=2, max_queue=0)
+    with gate.admit():
+        assert gate.running == 1
+    assert gate.running == 0 and gate.admitted == 1
+
+
+def test_recusa_com_a_fila_cheia():
+    gate = AdmissionGate(max_concurrent=1, max_queue=0)
+    with gate.admit():
+        with pytest.raises(FaceOverloadedError) as erro:
+            with gate.admit():
+                pass
+    assert erro.value.reason == "fila_cheia"
+    assert erro.value.retry_after >= 1
+    assert gate.shed_full == 1
+
+
+def test_recusa_quando_o_prazo_vence_na_fila():
+    gate = AdmissionGate(max_concurrent=1, max_queue=1)
+    liberar = threading.Event()
+
+    def ocupar():
+        with gate.admit():
+            liberar.wait(1)
+
+    thread = threading.Thread(target=ocupar)
+    thread.start()
+    while gate.running == 0:
+        time.sleep(0.001)
+    try:
+        with pytest.raises(FaceOverloadedError) as erro:
+            with gate.admit(deadline=time.monotonic() + 0.02):
+                pass
+    finally:
+        liberar.set()
+        thread.join()
+    assert erro.value.reason == "prazo"
+    assert gate.shed_timeout == 1 and gate.waiting == 0
+
+
+def test_prazo_ja_vencido_nao_executa():
+    gate = AdmissionGate(max_concurrent=1, max_queue=0)
+    with pytest.raises(FaceOverloadedError):
+        with gate.admit(deadline=time.monotonic() - 1):
+            pytest.fail("não deveria executar")
+    assert gate.shed_expired == 1 and gate.admitted == 0
+
+
+def test_timeout_na_inferencia_vira_recusa_e_libera_a_vaga():
+    gate = AdmissionGate(max_concurrent=1, max_queue=0)
+    with pytest.raises(FaceOverloadedError) as erro:
+        with gate.admit():
+            raise TimeoutError("Prazo esgotado na fila de inferência")
+    assert erro.value.reason == "prazo"
+    with gate.admit():  # a vaga voltou
+        pass
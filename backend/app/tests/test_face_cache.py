@@ -0,0 +1,71 @@
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+
+from app.utils.face_cache import LRUCache, RecognitionCache, dhash, face_dhash
+
+
+def test_lru_descarta_o_menos_usado():
+    cache = LRUCache(2, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # "a" passa a ser o mais recente
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_lru_expira_pelo_ttl():
+    cache = LRUCache(4, ttl=0.01)
+    cache.put("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert cache.expirations == 1
+
+
+def test_resultados_valem_so_para_a_versao_do_indice():
+    cache = RecognitionCache(8, ttl=60)
+    cache.sync((1, 0))
+    cache.put_match(b"foto", 3, {"status": "reconhecido"}, (1, 0))
+    assert cache.match(b"foto", 3) == {"status": "reconhecido"}
+    assert cache.match(b"foto", 5) is None  # outro k, outra entrada
+
+    cache.sync((1, 1))  # cadastro novo no índice
+    assert cache.match(b"foto", 3) is None
+    assert cache.invalidations == 1
+
+    # Resultado calculado na versão que já ficou para trás não entra
+    cache.put_match(b"foto", 3, {"status": "reconhecido"}, (1, 0))
+    assert cache.match(b"foto", 3) is None
+
+
+def test_embedding_pelo_dhash_mais_proximo():
+    cache = RecognitionCache(8, ttl=60, dhash_bits=4)
+    embedding = np.ones(4, dtype=np.float32)
+    cache.put_embedding(b"frame-1", embedding, phash=0b1011)
+
+    assert cache.embedding(b"frame-2", phash=0b1010) is embedding  # 1 bit de diferença
+    assert cache.embedding(b"frame-3", phash=0b1011 ^ 0xFF) is None  # 8 bits
+    assert cache.embedding(b"frame-4") is None  # sem dHash, só o hash exato
+    assert cache.near_hits == 1
+
+
+def test_face_dhash_usa_so_a_regiao_do_rosto():
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    outro_fundo = frame.copy()
+    outro_fundo[:, 100:] = rng.integers(0, 255, (120, 60, 3), dtype=np.uint8)
+    caixa = [10, 10, 90, 100]
+
+    # Mesmo rosto, fundo diferente: o hash da região não muda, o do frame inteiro sim
+    assert face_dhash(frame, caixa) == face_dhash(outro_fundo, caixa)
+    assert dhash(frame) != dhash(outro_fundo)
+
+    assert face_dhash(frame, [0, 0, 4, 4]) is None
+    assert face_dhash(frame, ["x", 0, 1, 1]) is None
+    assert face_dhash(b"nao e imagem") is None
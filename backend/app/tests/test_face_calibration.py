@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from app.utils.face_calibration import equal_error_rate, error_rates, score_distributions, threshold_for_far
+
+
+def _pacientes(n_pacientes=12, por_paciente=3, semente=0):
+    rng = np.random.default_rng(semente)
+    centros = rng.standard_normal((n_pacientes, 16))
+    vetores = np.repeat(centros, por_paciente, axis=0) + 0.3 * rng.standard_normal((n_pacientes * por_paciente, 16))
+    vetores /= np.linalg.norm(vetores, axis=1, keepdims=True)
+    return np.repeat(np.arange(n_pacientes), por_paciente), vetores.astype(np.float32)
+
+
+def test_blocos_contam_cada_par_uma_vez():
+    labels, vetores = _pacientes()
+    # Blocos de 5 não alinham com os 3 vetores por paciente: pares cruzam blocos
+    genuinos, impostores, melhor_genuino, melhor_impostor = score_distributions(labels, vetores, block_size=5)
+
+    n = len(labels)
+    assert genuinos.sum() == 12 * 3  # 3 pares por paciente
+    assert genuinos.sum() + impostores.sum() == n * (n - 1) // 2
+
+    sims = vetores @ vetores.T
+    np.fill_diagonal(sims, -np.inf)
+    mesmo = labels[:, None] == labels[None, :]
+    np.testing.assert_allclose(melhor_genuino, np.where(mesmo, sims, -np.inf).max(axis=1), rtol=1e-5)
+    np.testing.assert_allclose(melhor_impostor, np.where(mesmo, -np.inf, sims).max(axis=1), rtol=1e-5)
+
+
+def test_far_frr_eer_e_limiar_para_far_alvo():
+    bins = 20
+    genuinos = np.zeros(bins, dtype=np.int64)
+    impostores = np.zeros(bins, dtype=np.int64)
+    genuinos[[14, 15, 16, 17]] = 25   # similaridades 0.4 .. 0.7
+    impostores[[8, 9, 10, 15]] = [40, 30, 20, 10]  # 10% dos impostores em 0.5
+
+    limiares, far, frr = error_rates(genuinos, impostores)
+    assert far[0] == 1.0 and frr[0] == 0.0
+    i = int(np.searchsorted(limiares, 0.5 - 1e-9))
+    assert far[i] == pytest.approx(0.1) and frr[i] == pytest.approx(0.25)
+
+    eer, _ = equal_error_rate(limiares, far, frr)
+    assert 0.0 <= eer <= 0.25
+    assert threshold_for_far(limiares, far, 0.0) == pytest.approx(0.6)
+    assert threshold_for_far(limiares, far, 0.1) == pytest.approx(0.1)  # logo acima do bloco de impostores em 0.0
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from app.utils import facial_recognition
+from app.utils.face_calibration import ConfidenceCalibrator, similarity_from_distance
+from app.utils.facial_recognition import _decide, top_k
+
+
+@pytest.fixture(autouse=True)
+def limiares(monkeypatch):
+    monkeypatch.setattr(facial_recognition, "FACE_MIN_SIMILARITY", 0.5)
+    monkeypatch.setattr(facial_recognition, "FACE_MIN_MARGIN", 0.05)
+    monkeypatch.setattr(facial_recognition, "FACE_CANDIDATE_MIN_SIMILARITY", 0.3)
+
+
+def _decidir(similaridades, ids, k=3):
+    distancias = 2 * (1 - np.asarray(similaridades, dtype=np.float32))
+    return _decide(distancias, np.asarray(ids, dtype=np.int64), k, ConfidenceCalibrator(center=0.5))
+
+
+def test_similaridade_a_partir_da_distancia():
+    np.testing.assert_allclose(similarity_from_distance([0.0, 1.0, 2.0]), [1.0, 0.5, 0.0])
+
+
+def test_reconhece_com_margem_folgada():
+    resultado = _decidir([0.8, 0.6, 0.2], [4, 9, 2])
+    assert resultado["status"] == "reconhecido" and resultado["idPaciente"] == 4
+    assert resultado["margem"] == pytest.approx(0.2, abs=1e-4)
+    # Candidato abaixo de FACE_CANDIDATE_MIN_SIMILARITY não aparece
+    assert [c["idPaciente"] for c in resultado["candidatos"]] == [4, 9]
+
+
+def test_margem_pequena_e_ambigua():
+    resultado = _decidir([0.8, 0.78], [4, 9])
+    assert resultado["status"] == "ambiguo" and resultado["idPaciente"] is None
+    assert len(resultado["candidatos"]) == 2
+
+
+def test_candidato_unico_mede_a_margem_contra_o_limiar():
+    resultado = _decidir([0.52, 0.0], [4, -1])
+    assert resultado["status"] == "reconhecido"
+    assert resultado["margem"] == pytest.approx(0.07, abs=1e-4)  # 0.52 - (0.5 - 0.05)
+    assert _decidir([0.48, 0.0], [4, -1])["status"] == "nao_encontrado"
+
+
+def test_abaixo_do_limiar_ou_sem_candidato_nao_encontrado():
+    assert _decidir([0.45, 0.2], [4, 9])["status"] == "nao_encontrado"
+    resultado = _decidir([0.0, 0.0], [-1, -1])
+    assert resultado == {"status": "nao_encontrado", "idPaciente": None, "margem": None, "candidatos": []}
+
+
+def test_k_fora_da_faixa(monkeypatch):
+    monkeypatch.setattr(facial_recognition, "FACE_MAX_TOP_K", 20)
+    assert top_k(None) == facial_recognition.FACE_TOP_K and top_k(20) == 20
+    for k in (0, -1, 21):
+        with pytest.raises(ValueError):
+            top_k(k)
+
+
+def test_calibrador_ajustado_separa_genuinos_de_impostores():
+    rng = np.random.default_rng(0)
+    genuinos = np.clip(rng.normal(0.7, 0.05, 200), -1, 1)
+    impostores = np.clip(rng.normal(0.2, 0.05, 200), -1, 1)
+
+    calibrador = ConfidenceCalibrator.fit(genuinos, impostores)
+    assert calibrador.calibrated and calibrador.slope > 0
+    baixa, meio, alta = calibrador([0.2, 0.45, 0.7])
+    assert baixa < 0.05 and alta > 0.95 and 0.05 < meio < 0.95
+
+
+def test_poucos_escores_ficam_com_a_curva_padrao():
+    calibrador = ConfidenceCalibrator.fit([0.9] * 5, [0.1] * 50, center=0.5)
+    assert not calibrador.calibrated
+    assert calibrador(0.5) == pytest.approx(0.5)
+    assert calibrador.metrics()["pares_genuinos"] == 5
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+faiss = pytest.importorskip("faiss")
+
+from app.utils.face_index import MmapFlatIndex, exact_rerank
+from app.utils.face_store import FaceStore, SharedFaceIndex
+
+DIM = 64  # múltiplo de FACE_PQ_M
+
+
+def _vetores(n, semente=0):
+    return np.random.default_rng(semente).standard_normal((n, DIM)).astype(np.float32)
+
+
+def test_busca_no_memmap_igual_ao_faiss_flat(tmp_path):
+    vetores = _vetores(300)
+    ids = np.arange(1000, 1300, dtype=np.int64)
+    arquivo = tmp_path / "vectors.f32"
+    vetores.tofile(arquivo)
+    mapeados = np.memmap(arquivo, dtype=np.float32, mode="r").reshape(-1, DIM)
+
+    consultas = _vetores(5, semente=1)
+    referencia = faiss.IndexFlatL2(DIM)
+    referencia.add(vetores)
+    esperado_d, esperado_i = referencia.search(consultas, 4)
+
+    # Blocos pequenos: o top-k atravessa a fronteira entre eles
+    distancias, encontrados = MmapFlatIndex(ids, mapeados, block_size=64).search(consultas, 4)
+    np.testing.assert_array_equal(encontrados, ids[esperado_i])
+    np.testing.assert_allclose(distancias, esperado_d, rtol=1e-4, atol=1e-4)
+
+
+def test_memmap_respeita_exclusao_e_completa_com_menos_um():
+    vetores = _vetores(3)
+    indice = MmapFlatIndex(np.array([1, 2, 3], dtype=np.int64), vetores)
+    distancias, ids = indice.search(vetores[[0]], 3, exclude={1})
+    assert sorted(ids[0, :2].tolist()) == [2, 3] and ids[0, 2] == -1
+    assert np.isinf(distancias[0, 2])
+
+
+def test_rerank_usa_a_distancia_exata_e_ignora_ids_desconhecidos():
+    vetores = _vetores(6)
+    ids = np.array([2, 4, 6, 8, 10, 12], dtype=np.int64)
+    consulta = vetores[[3]] + 0.01
+    # Candidatos fora de ordem, com id inexistente e lacuna (-1) do índice comprimido
+    candidatos = np.array([[12, 8, 7, -1, 2]], dtype=np.int64)
+
+    distancias, escolhidos = exact_rerank(consulta, candidatos, ids, vetores, 4)
+    assert escolhidos[0, 0] == 8 and escolhidos[0, 3] == -1
+    assert sorted(escolhidos[0, :3].tolist()) == [2, 8, 12]
+    exata = np.sum((vetores[3] - consulta[0]) ** 2)
+    assert distancias[0, 0] == pytest.approx(exata, rel=1e-5)
+
+
+@pytest.mark.parametrize("tipo", ["sq", "pq"])
+def test_snapshot_comprimido_reordena_pelos_vetores_crus(tmp_path, tipo):
+    vetores = _vetores(400)
+    indice = SharedFaceIndex(FaceStore(str(tmp_path), DIM), kind=tipo, threshold=100)
+    indice.add_many(np.arange(1, 401), vetores)
+    assert indice.snapshot.backend == tipo
+
+    distancias, ids = indice.search(vetores[[7, 250]], 1)
+    assert ids[:, 0].tolist() == [8, 251]
+    np.testing.assert_allclose(distancias[:, 0], 0, atol=1e-5)
@@ -0,0 +1,150 @@
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+
+pytest.importorskip("flask_sqlalchemy")
+pytest.importorskip("flask_sock")
+pytest.importorskip("jwt")
+
+from flask import Flask
+
+from app.database import db
+from app.models.cadastro_facial import CadastroFacial
+from app.models.paciente import Paciente
+from app.models.paciente_embedding import PacienteEmbedding
+from app.routes import pacientes
+from app.utils import face_jobs, facial_recognition
+from app.utils.face_admission import FaceOverloadedError
+from app.utils.facial_recognition import DuplicateFaceError
+
+VETOR = np.ones(8, dtype=np.float32)
+
+
+class _Indice:
+    """O que o worker grava no índice facial, sem modelo nem FAISS."""
+
+    def __init__(self, pasta):
+        self.pasta = pasta
+        self.templates = {}
+        self.erro = None
+        self.durante = None  # roda dentro do register_face (exclusão concorrente etc.)
+
+    def register_face(self, conteudo, db_id, check_duplicates=False):
+        if self.erro is not None:
+            raise self.erro
+        if self.durante is not None:
+            self.durante()
+        slot = len([s for i, s in self.templates if i == db_id])
+        self.templates[(db_id, slot)] = VETOR
+        return slot, VETOR
+
+    def stored_template(self, db_id, slot):
+        return self.templates.get((db_id, slot))
+
+    def remove_face(self, db_id):
+        self.templates = {chave: v for chave, v in self.templates.items() if chave[0] != db_id}
+
+
+class _Resumos:
+    def put(self, *args):
+        pass
+
+    def remove(self, db_id):
+        pass
+
+
+@pytest.fixture
+def indice(tmp_path, monkeypatch):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp_path / 'banco.db'}"
+    db.init_app(app)
+
+    falso = _Indice(tmp_path)
+    monkeypatch.setattr(pacientes, "UPLOAD_FOLDER", str(tmp_path))
+    monkeypatch.setattr(facial_recognition, "register_face", falso.register_face)
+    monkeypatch.setattr(facial_recognition, "stored_template", falso.stored_template)
+    monkeypatch.setattr(facial_recognition, "remove_face", falso.remove_face)
+    monkeypatch.setattr(facial_recognition, "embedding_model", lambda: ("teste", "1"))
+    monkeypatch.setattr(facial_recognition, "patient_metadata", lambda: _Resumos())
+    with app.app_context():
+        db.create_all()
+        yield falso
+        db.session.remove()
+
+
+def _cadastro(indice, id_paciente=1):
+    db.session.add(Paciente(
+        idPaciente=id_paciente, nomeComp="Ana", cpf=f"{id_paciente:011d}", dataNasc=date(1990, 1, 1),
+        sexo="F", logradouro="Rua", numero="1", bairro="Centro", estado="SP", cep="01000000",
+        codiPais="055", codiCidade="11", telefone="11999999999", email="ana@exemplo.com", status="A",
+    ))
+    foto = f"{id_paciente}_abc_rosto.jpg"
+    (indice.pasta / foto).write_bytes(b"jpeg")
+    db.session.add(CadastroFacial(idPaciente=id_paciente, foto=foto, proximaTentativa=datetime.utcnow() - timedelta(seconds=1)))
+    db.session.commit()
+    return face_jobs._claim()
+
+
+def test_concluido_grava_o_template_no_banco(indice):
+    job = _cadastro(indice)
+    assert face_jobs.process(job) == CadastroFacial.CONCLUIDO
+    assert job.slot == 0 and (indice.pasta / job.foto).exists()
+    assert PacienteEmbedding.query.filter_by(idPaciente=1, slot=0).count() == 1
+
+
+def test_retentativa_reaproveita_o_slot_ja_gravado(indice):
+    job = _cadastro(indice)
+    indice.templates[(1, 0)] = VETOR
+    job.slot = 0  # commit anterior ao banco falhou depois do índice
+    indice.erro = AssertionError("register_face não devia rodar de novo")
+    assert face_jobs.process(job) == CadastroFacial.CONCLUIDO
+    assert len(indice.templates) == 1
+
+
+@pytest.mark.parametrize("erro, status", [
+    (DuplicateFaceError([{"idPaciente": 9}]), CadastroFacial.DUPLICADO),
+    (ValueError("Nenhum rosto detectado"), CadastroFacial.FALHOU),
+])
+def test_desfecho_definitivo_descarta_a_foto(indice, erro, status):
+    job = _cadastro(indice)
+    indice.erro = erro
+    assert face_jobs.process(job) == status
+    assert not (indice.pasta / job.foto).exists()
+    assert PacienteEmbedding.query.count() == 0
+
+
+def test_sobrecarga_reagenda_sem_gastar_tentativa(indice):
+    job = _cadastro(indice)
+    indice.erro = FaceOverloadedError("ocupado", 3, "fila")
+    assert face_jobs.process(job) == CadastroFacial.PENDENTE
+    assert job.tentativas == 0 and job.proximaTentativa > datetime.utcnow()
+
+
+def test_erro_transitorio_volta_com_backoff_ate_o_limite(indice, monkeypatch):
+    monkeypatch.setattr(face_jobs, "FACE_ENROLL_MAX_ATTEMPTS", 2)
+    job = _cadastro(indice)
+    indice.erro = OSError("disco")
+    assert face_jobs.process(job) == CadastroFacial.PENDENTE and job.erro == "disco"
+
+    job.proximaTentativa = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    job = face_jobs._claim()
+    assert face_jobs.process(job) == CadastroFacial.FALHOU
+
+
+def test_paciente_excluido_durante_o_cadastro_cancela(indice):
+    job = _cadastro(indice)
+    foto = indice.pasta / job.foto
+
+    def excluir():
+        # O que deletar_paciente faz em outra requisição, com o cadastro em andamento
+        CadastroFacial.query.filter_by(idPaciente=1).update({CadastroFacial.status: CadastroFacial.CANCELADO})
+        Paciente.query.filter_by(idPaciente=1).delete()
+        db.session.commit()
+
+    indice.durante = excluir
+    assert face_jobs.process(job) == CadastroFacial.CANCELADO
+    assert indice.templates == {}
+    assert CadastroFacial.query.count() == 0 and PacienteEmbedding.query.count() == 0
+    assert not foto.exists()
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from app.utils.face_store import OP_ADD, OP_REMOVE, EmbeddingJournal
+
+
+def _vetor(semente, dimension=8):
+    return np.random.default_rng(semente).standard_normal(dimension).astype(np.float32)
+
+
+def test_registros_voltam_na_ordem(tmp_path):
+    journal = EmbeddingJournal(str(tmp_path / "journal.1.log"), 8)
+    journal.append(OP_ADD, 7, _vetor(1))
+    journal.append(OP_REMOVE, 3, np.zeros(8, dtype=np.float32))
+    journal.close()
+
+    records, offset = journal.read_from(0)
+    assert [(op, db_id) for op, db_id, _ in records] == [(OP_ADD, 7), (OP_REMOVE, 3)]
+    np.testing.assert_array_equal(records[0][2], _vetor(1))
+    assert offset == 2 * journal.record_size
+
+    # Leitor que já estava em dia não relê nada
+    assert journal.read_from(offset) == ([], offset)
+
+
+def test_cauda_incompleta_e_ignorada_e_cortada(tmp_path):
+    path = tmp_path / "journal.1.log"
+    journal = EmbeddingJournal(str(path), 8)
+    journal.append(OP_ADD, 1, _vetor(1))
+    journal.close()
+    with open(path, "ab") as f:
+        f.write(b"\x01\x02\x03")  # queda no meio da escrita do próximo registro
+
+    records, offset = journal.read_from(0)
+    assert len(records) == 1 and offset == journal.record_size
+
+    journal.truncate(offset)
+    journal.append(OP_ADD, 2, _vetor(2))
+    journal.close()
+    assert [db_id for _, db_id, _ in journal.read_from(0)[0]] == [1, 2]
+
+
+def test_crc_invalido_para_a_leitura(tmp_path):
+    path = tmp_path / "journal.1.log"
+    journal = EmbeddingJournal(str(path), 8)
+    for db_id in (1, 2, 3):
+        journal.append(OP_ADD, db_id, _vetor(db_id))
+    journal.close()
+
+    # Um byte trocado no embedding do segundo registro
+    dados = bytearray(path.read_bytes())
+    dados[journal.record_size + 12] ^= 0xFF
+    path.write_bytes(bytes(dados))
+
+    records, offset = journal.read_from(0)
+    assert [db_id for _, db_id, _ in records] == [1]
+    assert offset == journal.record_size
@@ -0,0 +1,39 @@
+from datetime import date
+
+from app.utils.face_metadata import PatientMetadata
+
+
+def test_grava_le_e_remove(tmp_path):
+    tabela = PatientMetadata(str(tmp_path / "resumos.bin"))
+    tabela.put(3, "Ana Souza", "A", date(1990, 5, 17))
+    tabela.put(5000, "José", "I", "2001-01-02")  # além do primeiro bloco: o arquivo cresce
+
+    assert tabela.get(3) == {"idPaciente": 3, "nomeComp": "Ana Souza", "status": "A", "dataNasc": "1990-05-17"}
+    assert tabela.get(5000)["nomeComp"] == "José"
+    assert tabela.get(4) is None and tabela.get(-1) is None and tabela.get(10 ** 6) is None
+    assert len(tabela) == 2
+
+    tabela.remove(3)
+    assert tabela.get(3) is None
+    assert tabela.get_many([3, 5000, 7]) == {5000: tabela.get(5000)}
+
+
+def test_outro_worker_ve_a_escrita_e_a_reconstrucao(tmp_path):
+    caminho = str(tmp_path / "resumos.bin")
+    escritor, leitor = PatientMetadata(caminho), PatientMetadata(caminho)
+    escritor.put(1, "Ana", "A", None)
+    assert leitor.get(1)["dataNasc"] is None
+
+    escritor.put(1, "Ana Maria", "A", None)
+    assert leitor.get(1)["nomeComp"] == "Ana Maria"  # mesmo mapeamento, sem remapear
+
+    assert escritor.rebuild([(2, "Bia", "A", date(2000, 1, 1))]) == 1
+    assert leitor.get(1) is None and leitor.get(2)["nomeComp"] == "Bia"  # arquivo trocado
+
+
+def test_escrita_pela_metade_nao_e_devolvida(tmp_path):
+    tabela = PatientMetadata(str(tmp_path / "resumos.bin"))
+    tabela.put(1, "Ana", "A", None)
+    registros = tabela._records()
+    registros["seq"][1] += 1  # escritor parado no meio do registro
+    assert tabela.get(1) is None
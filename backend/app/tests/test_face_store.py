@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from app.utils.face_store import FaceStore, ShardedFaceIndex, SharedFaceIndex, shard_directories
+
+DIM = 8
+
+
+def _vetores(n, semente=0):
+    return np.random.default_rng(semente).standard_normal((n, DIM)).astype(np.float32)
+
+
+def _indice(diretorio, **kwargs):
+    return SharedFaceIndex(FaceStore(str(diretorio), DIM), kind="flat", **kwargs)
+
+
+def _mais_proximo(indice, vetor):
+    return int(indice.search(vetor[None, :], 1)[1][0, 0])
+
+
+def test_outro_worker_ve_o_journal_sem_reiniciar(tmp_path):
+    a, b = _indice(tmp_path), _indice(tmp_path)
+    vetores = _vetores(2)
+    a.add(10, vetores[0])
+    b.refresh()
+    assert b.contains(10) and _mais_proximo(b, vetores[0]) == 10
+
+    a.add(11, vetores[1])
+    assert _mais_proximo(b, vetores[1]) == 11  # a busca confere o journal antes
+    assert b.pending == 2
+
+
+def test_compactacao_publica_geracao_nova(tmp_path):
+    a, b = _indice(tmp_path), _indice(tmp_path)
+    vetores = _vetores(3)
+    for i, vetor in enumerate(vetores):
+        a.add(i + 1, vetor)
+    a.remove(2)
+    a.compact()
+
+    b.refresh()
+    assert b.generation == a.generation == 1 and b.pending == 0
+    assert sorted(b.items()[0].tolist()) == [1, 3]
+    assert not b.contains(2)
+
+    # Remoção depois do snapshot só oculta a linha dele
+    a.remove(3)
+    assert _mais_proximo(b, vetores[2]) == 1
+    assert sorted(b.items()[0].tolist()) == [1]
+
+
+def test_add_substitui_o_vetor_do_snapshot(tmp_path):
+    indice = _indice(tmp_path)
+    antigo, novo = _vetores(2)
+    indice.add_many([5, 6], np.stack([antigo, -antigo]))
+    indice.add(5, novo)
+
+    ids, vetores = indice.vectors_between(5, 6)
+    assert ids.tolist() == [5]
+    np.testing.assert_array_equal(vetores[0], novo)
+
+
+def test_guard_cancela_a_escrita(tmp_path):
+    def recusar():
+        raise RuntimeError("índice aposentado")
+
+    indice = _indice(tmp_path, guard=recusar)
+    with pytest.raises(RuntimeError):
+        indice.add(1, _vetores(1)[0])
+    assert not _indice(tmp_path).contains(1)
+
+
+def _sharded(diretorio, shards=3):
+    stores = [FaceStore(d, DIM) for d in shard_directories(str(diretorio), shards)]
+    return ShardedFaceIndex(stores, kind="flat")
+
+
+def test_shards_dividem_por_id_e_a_busca_junta_os_top_k(tmp_path):
+    indice = _sharded(tmp_path)
+    try:
+        vetores = _vetores(9)
+        indice.add_many(np.arange(1, 10), vetores)
+        assert [sorted(s.items()[0].tolist()) for s in indice.shards] == [[3, 6, 9], [1, 4, 7], [2, 5, 8]]
+
+        distancias, ids = indice.search(vetores[[0, 4]], 3)
+        assert ids[:, 0].tolist() == [1, 5]
+        assert np.all(np.diff(distancias, axis=1) >= 0)
+
+        # Busca dirigida: só o shard pedido responde
+        assert indice.search(vetores[[0]], 9, shards=[1])[1][0, 3:].tolist() == [-1] * 6
+    finally:
+        indice.close()
+
+
+def test_compacta_so_shards_com_journal_acumulado(tmp_path):
+    indice = _sharded(tmp_path)
+    try:
+        vetores = _vetores(4)
+        for db_id in (3, 6, 9):
+            indice.add(db_id, vetores[db_id // 3])
+        indice.add(1, vetores[0])
+
+        assert indice.compact(min_pending=2) == 1
+        assert indice.pending == [0, 1, 0]
+        assert indice.generation == (1, 0, 0)
+
+        indice.close()  # depois de fechar a busca segue shard a shard
+        assert int(indice.search(vetores[[2]], 1)[1][0, 0]) == 6
+    finally:
+        indice.close()
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+
+from app.utils import facial_recognition
+from app.utils.face_store import FaceStore, ShardedFaceIndex, SharedFaceIndex
+from app.utils.facial_recognition import TEMPLATE_SLOTS, FaceEngine
+
+DIM = 8
+
+
+def _unitarios(n, semente=0):
+    vetores = np.random.default_rng(semente).standard_normal((n, DIM)).astype(np.float32)
+    return vetores / np.linalg.norm(vetores, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def motor(tmp_path, monkeypatch):
+    # Só os índices do motor: modelo, pool e agendador não entram nestes testes
+    monkeypatch.setattr(facial_recognition, "dimension", DIM)
+    monkeypatch.setattr(facial_recognition, "FACE_MAX_TEMPLATES", 3)
+    engine = FaceEngine.__new__(FaceEngine)
+    engine.index = ShardedFaceIndex([FaceStore(str(tmp_path / "centroides"), DIM)], kind="flat")
+    engine.templates = SharedFaceIndex(FaceStore(str(tmp_path / "templates"), DIM), kind="flat")
+    return engine
+
+
+def _centroide(motor, db_id):
+    ids, vetores = motor.index.vectors_between(db_id, db_id + 1)
+    return vetores[0] if len(ids) else None
+
+
+def test_templates_ocupam_slots_e_o_indice_guarda_o_centroide(motor):
+    vetores = _unitarios(2)
+    assert [motor.add_template(7, v) for v in vetores] == [7 * TEMPLATE_SLOTS, 7 * TEMPLATE_SLOTS + 1]
+
+    esperado = vetores.mean(axis=0)
+    np.testing.assert_allclose(_centroide(motor, 7), esperado / np.linalg.norm(esperado), rtol=1e-5)
+
+
+def test_conjunto_cheio_substitui_o_template_mais_parecido(motor):
+    vetores = _unitarios(3)
+    for vetor in vetores:
+        motor.add_template(7, vetor)
+
+    parecido_com_o_segundo = vetores[1] + 0.05 * vetores[0]
+    parecido_com_o_segundo /= np.linalg.norm(parecido_com_o_segundo)
+    assert motor.add_template(7, parecido_com_o_segundo) == 7 * TEMPLATE_SLOTS + 1
+    assert len(motor.patient_templates(7)[0]) == 3
+
+
+def test_vetor_unico_antigo_vira_o_primeiro_template(motor):
+    antigo, novo = _unitarios(2)
+    motor.index.add(7, antigo)  # paciente de antes dos templates
+
+    assert motor.add_template(7, novo) == 7 * TEMPLATE_SLOTS + 1
+    ids, vetores = motor.patient_templates(7)
+    assert sorted(ids.tolist()) == [7 * TEMPLATE_SLOTS, 7 * TEMPLATE_SLOTS + 1]
+
+
+def test_restaurar_slot_refaz_o_centroide(motor):
+    primeiro, segundo = _unitarios(2)
+    motor.add_template(7, primeiro)
+    motor.add_template(7, segundo)
+
+    motor.restore_template(7, 1)
+    np.testing.assert_allclose(_centroide(motor, 7), primeiro, rtol=1e-5)
+    motor.restore_template(7, 0)
+    assert _centroide(motor, 7) is None
+
+
+def test_busca_reordena_os_candidatos_pelos_templates(motor, monkeypatch):
+    monkeypatch.setattr(facial_recognition, "FACE_TEMPLATE_CANDIDATES", 2)
+    e0, e1 = np.eye(DIM, dtype=np.float32)[:2]
+    # Centróide de 1 fica longe da consulta, mas um dos templates dele é a própria consulta
+    motor.add_template(1, e0)
+    motor.add_template(1, e1)
+    motor.add_template(2, (3 * e0 + e1) / np.sqrt(10))
+    assert motor.index.search(e0[None, :], 2)[1][0].tolist() == [2, 1]
+
+    distancias, ids = motor.search(e0[None, :], 2)
+    assert ids[0].tolist() == [1, 2]
+    assert distancias[0, 0] == pytest.approx(0, abs=1e-5)
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("cv2")
+
+from app.utils.face_tracking import FaceTracker, face_quality, iou, sharpness
+
+CAIXA = [100, 100, 200, 200]
+
+
+def test_iou():
+    assert iou(CAIXA, CAIXA) == 1.0
+    assert iou(CAIXA, [300, 300, 400, 400]) == 0.0
+    assert iou(CAIXA, [150, 100, 250, 200]) == pytest.approx(1 / 3)
+
+
+def test_qualidade_pesa_frontalidade_e_nitidez():
+    frontal = np.array([[130, 140], [170, 140], [150, 160], [135, 180], [165, 180]], dtype=np.float32)
+    de_lado = frontal.copy()
+    de_lado[2, 0] = 165  # nariz deslocado para um dos olhos
+
+    assert face_quality(CAIXA, frontal) == 100
+    assert face_quality(CAIXA, de_lado) < face_quality(CAIXA, frontal)
+    assert face_quality(CAIXA, frontal, sharp=50, sharp_ref=100) == 50
+    assert face_quality(CAIXA, frontal, sharp=500, sharp_ref=100) == 100
+
+
+def test_nitidez_cai_com_o_borrao():
+    import cv2
+
+    img = np.random.default_rng(0).integers(0, 255, (300, 300, 3), dtype=np.uint8)
+    borrada = cv2.GaussianBlur(img, (15, 15), 5)
+    assert sharpness(borrada, CAIXA) < sharpness(img, CAIXA)
+    assert sharpness(img, [400, 400, 500, 500]) is None
+
+
+def test_trilha_reconhecida_nao_e_reprocessada():
+    tracker = FaceTracker(iou_threshold=0.3, ttl=2, min_gain=0.2, retry=1)
+    trilha, processar = tracker.observe(CAIXA, now=0)
+    assert processar
+    tracker.record(trilha, "reconhecido")
+
+    mesma, processar = tracker.observe([102, 101, 202, 201], now=0.5)
+    assert mesma is trilha and not processar
+    assert not tracker.observe([90, 90, 230, 230], now=1.5)[1]  # nem com ganho de qualidade
+
+
+def test_trilha_nao_reconhecida_volta_por_qualidade_ou_tempo():
+    tracker = FaceTracker(iou_threshold=0.3, ttl=5, min_gain=0.2, retry=1)
+    trilha, _ = tracker.observe(CAIXA, now=0)
+    tracker.record(trilha, "ambiguo")
+
+    assert not tracker.observe(CAIXA, now=0.2)[1]
+    assert tracker.observe([90, 90, 230, 230], now=0.4)[1]  # rosto maior: 40% de ganho
+    tracker.record(trilha, "ambiguo")
+    assert not tracker.observe([90, 90, 230, 230], now=0.8)[1]
+    assert tracker.observe([90, 90, 230, 230], now=1.5)[1]  # `retry` depois da última tentativa
+
+
+def test_trilha_expira_e_o_rosto_vira_visitante_novo():
+    tracker = FaceTracker(iou_threshold=0.3, ttl=1, min_gain=0.2, retry=1)
+    trilha, _ = tracker.observe(CAIXA, now=0)
+    tracker.record(trilha, "reconhecido")
+
+    nova, processar = tracker.observe(CAIXA, now=2)
+    assert nova is not trilha and processar
+    assert tracker.metrics()["trilhas_ativas"] == 1
+
+
+def test_frame_sem_desfecho_nao_gasta_a_tentativa():
+    # Frame liberado mas não processado (pausa por sobrecarga): nada de record
+    tracker = FaceTracker(iou_threshold=0.3, ttl=5, min_gain=0.2, retry=1)
+    trilha, _ = tracker.observe(CAIXA, now=0)
+    tracker.record(trilha, "ambiguo")
+
+    assert tracker.observe([90, 90, 230, 230], now=0.4)[1]
+    assert tracker.observe([90, 90, 230, 230], now=0.6)[1]  # o ganho continua valendo
+    assert tracker.observe(CAIXA, now=1.2)[1]  # e a espera conta da última tentativa, em 0
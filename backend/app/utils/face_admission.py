@@ -0,0 +1,110 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from app.utils.face_batching import Histogram
+
+
+class FaceOverloadedError(Exception):
+    """Requisição facial recusada por sobrecarga; `retry_after` em segundos."""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionGate:
+    """Limita o trabalho facial em andamento e descarta o que não vai dar tempo.
+
+    Até `max_concurrent` requisições executam ao mesmo tempo e até `max_queue`
+    esperam por uma vaga, no máximo até o próprio prazo; acima disso a recusa
+    é imediata. Quem consegue a vaga com o prazo já vencido é descartado antes
+    da inferência, e um TimeoutError lá dentro (item vencido na fila de
+    micro-lotes) também vira recusa. O Retry-After sugerido vem do tempo médio
+    de execução (média móvel) e de quantas requisições estão à frente.
+    """
+
+    def __init__(self, max_concurrent, max_queue):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max(0, max_queue)
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._lock = threading.Lock()
+        self._service_seconds = 0.1
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed_full = 0
+        self.shed_timeout = 0
+        self.shed_expired = 0
+        self.wait_ms = Histogram([1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500])
+
+    def retry_after(self):
+        ahead = self.running + self.waiting + 1
+        return max(1, min(30, math.ceil(self._service_seconds * ahead / self.max_concurrent)))
+
+    def _shed(self, counter, message, reason):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        return FaceOverloadedError(message, self.retry_after(), reason)
+
+    def _acquire(self, deadline):
+        if self._slots.acquire(blocking=False):
+            return
+        with self._lock:
+            if self.waiting >= self.max_queue:
+                full = True
+            else:
+                full = False
+                self.waiting += 1
+        if full:
+            raise self._shed("shed_full", "Reconhecimento facial sobrecarregado; tente novamente", "fila_cheia")
+
+        start = time.monotonic()
+        timeout = None if deadline is None else max(0.0, deadline - start)
+        try:
+            acquired = self._slots.acquire(timeout=timeout)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        self.wait_ms.observe((time.monotonic() - start) * 1000)
+        if not acquired:
+            raise self._shed("shed_timeout", "Prazo esgotado esperando o reconhecimento facial", "prazo")
+
+    @contextmanager
+    def admit(self, deadline=None):
+        """Vaga para uma requisição facial; deadline em time.monotonic() (None = sem prazo)."""
+        self._acquire(deadline)
+        start = time.monotonic()
+        try:
+            if deadline is not None and start >= deadline:
+                raise self._shed("shed_expired", "Prazo esgotado antes do reconhecimento facial", "prazo")
+            with self._lock:
+                self.running += 1
+                self.admitted += 1
+            try:
+                yield
+            except TimeoutError as e:
+                raise self._shed("shed_expired", str(e) or "Prazo esgotado na fila de inferência", "prazo") from e
+            finally:
+                elapsed = time.monotonic() - start
+                with self._lock:
+                    self.running -= 1
+                    self._service_seconds += 0.2 * (elapsed - self._service_seconds)
+        finally:
+            self._slots.release()
+
+    def metrics(self):
+        return {
+            "concorrencia_maxima": self.max_concurrent,
+            "fila_maxima": self.max_queue,
+            "executando": self.running,
+            "esperando": self.waiting,
+            "admitidas": self.admitted,
+            "recusadas_fila_cheia": self.shed_full,
+            "recusadas_prazo_na_fila": self.shed_timeout,
+            "descartadas_prazo_vencido": self.shed_expired,
+            "tempo_medio_s": round(self._service_seconds, 4),
+            "espera_ms": self.wait_ms.snapshot(),
+        }
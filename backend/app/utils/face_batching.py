@@ -0,0 +1,174 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class Histogram:
+    """Histograma simples de buckets fixos (limite superior inclusivo)."""
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bound in enumerate(self.bounds):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            else:
+                self.counts[-1] += 1
+            self.total += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            buckets = {f"<={b}": c for b, c in zip(self.bounds, self.counts)}
+            buckets[f">{self.bounds[-1]}"] = self.counts[-1]
+            return {
+                "buckets": buckets,
+                "total": self.total,
+                "media": self.sum / self.total if self.total else 0.0,
+            }
+
+
+class InferenceScheduler:
+    """Agrupa requisições de reconhecimento que chegam juntas em micro-lotes.
+
+    Uma thread dedicada pega a primeira requisição da fila e espera até
+    `window_ms` por outras (no máximo `max_batch`); o lote inteiro é entregue
+    a `run_batch`, que devolve um resultado (ou exceção) por item. Com uma
+    thread só o ONNX runtime nunca é disputado por requisições concorrentes;
+    com `workers` > 1 (inferência num pool de processos) há um lote em voo
+    por worker do pool. Itens com prazo (time.monotonic) já vencido quando o
+    lote é montado saem com TimeoutError sem passar pela inferência. `close`
+    encerra as threads depois do que já está na fila; itens enviados depois
+    disso rodam direto na thread de quem chamou.
+    """
+
+    def __init__(self, run_batch, window_ms=10, max_batch=8, workers=1, name="face-batching"):
+        self.run_batch = run_batch
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._loop, name=f"{name}-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        self._started = False
+        self._closed = False
+        self._start_lock = threading.Lock()
+
+        self.expired = 0
+        self.queue_depth = Histogram([0, 1, 2, 4, 8, 16, 32, 64])
+        self.batch_size = Histogram(range(1, max_batch + 1))
+        self.latency_ms = Histogram([5, 10, 25, 50, 100, 250, 500, 1000, 2500])
+
+    def _ensure_started(self):
+        if not self._started:
+            with self._start_lock:
+                if not self._started and not self._closed:
+                    for thread in self._threads:
+                        thread.start()
+                    self._started = True
+
+    def submit(self, item, deadline=None):
+        """Enfileira um item e devolve um Future com o resultado."""
+        self._ensure_started()
+        future = Future()
+        entry = (item, future, time.perf_counter(), deadline)
+        with self._start_lock:
+            if not self._closed:
+                self.queue_depth.observe(self._queue.qsize())
+                self._queue.put(entry)
+                return future
+        # Agendador encerrado (motor substituído): lote de um item aqui mesmo
+        self._complete([entry])
+        return future
+
+    def run(self, item, timeout=None, deadline=None):
+        return self.submit(item, deadline).result(timeout)
+
+    def _drop_expired(self, batch):
+        now = time.monotonic()
+        live = []
+        for entry in batch:
+            deadline = entry[3]
+            if deadline is not None and now >= deadline:
+                self.expired += 1
+                entry[1].set_exception(TimeoutError("Prazo esgotado na fila de inferência"))
+            else:
+                live.append(entry)
+        return live
+
+    def close(self):
+        """Encerra as threads depois de esvaziar a fila (um marcador None por thread)."""
+        with self._start_lock:
+            if self._closed:
+                return
+            self._closed = True
+            started = self._started
+        if started:
+            for _ in self._threads:
+                self._queue.put(None)
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)  # marcador de fim fica para a próxima volta
+                break
+            batch.append(entry)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            self._complete(batch)
+
+    def _complete(self, batch):
+        batch = self._drop_expired(batch)
+        if not batch:
+            return
+        self.batch_size.observe(len(batch))
+        items = [item for item, _, _, _ in batch]
+        try:
+            results = self.run_batch(items)
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future, enqueued, _), result in zip(batch, results):
+            self.latency_ms.observe((time.perf_counter() - enqueued) * 1000)
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def metrics(self):
+        return {
+            "janela_ms": self.window * 1000,
+            "lote_maximo": self.max_batch,
+            "lotes_simultaneos": len(self._threads),
+            "fila_atual": self._queue.qsize(),
+            "descartados_por_prazo": self.expired,
+            "profundidade_fila": self.queue_depth.snapshot(),
+            "tamanho_lote": self.batch_size.snapshot(),
+            "latencia_ms": self.latency_ms.snapshot(),
+        }
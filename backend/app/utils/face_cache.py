@@ -0,0 +1,176 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+
+def content_hash(data):
+    """Hash exato do upload (bytes ou imagem já decodificada)."""
+    if isinstance(data, np.ndarray):
+        data = np.ascontiguousarray(data)
+    return hashlib.blake2b(memoryview(data), digest_size=16).digest()
+
+
+def dhash(img, size=8):
+    """Hash perceptual de diferença (64 bits): frames quase iguais diferem em poucos bits."""
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def face_dhash(data, box=None, size=8):
+    """dHash só da região do rosto: caixa [x1, y1, x2, y2] da imagem, ou ela inteira (recorte).
+
+    Upload em bytes é decodificado já reduzido à metade e em tons de cinza,
+    bem mais barato que a imagem inteira. None se a imagem não decodificar
+    ou a caixa não deixar região suficiente.
+    """
+    if isinstance(data, np.ndarray) and data.ndim >= 2:
+        img, scale = data, 1.0
+    else:
+        img = cv2.imdecode(np.frombuffer(memoryview(data), dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+        scale = 2.0
+    if img is None:
+        return None
+    if box is not None:
+        try:
+            x1, y1, x2, y2 = (int(round(float(v) / scale)) for v in box)
+        except (TypeError, ValueError):
+            return None
+        h, w = img.shape[:2]
+        img = img[max(y1, 0):min(y2, h), max(x1, 0):min(x2, w)]
+    if img.shape[0] < size or img.shape[1] < size + 1:
+        return None
+    return dhash(img, size)
+
+
+class LRUCache:
+    """Cache LRU limitado por tamanho, com expiração por TTL e contadores."""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def values(self):
+        """Entradas ainda válidas (sem mexer na ordem do LRU nem nos contadores)."""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value) for key, (expires, value) in self._data.items() if expires >= now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def metrics(self):
+        total = self.hits + self.misses
+        return {
+            "tamanho": len(self._data),
+            "capacidade": self.max_size,
+            "acertos": self.hits,
+            "faltas": self.misses,
+            "taxa_acerto": self.hits / total if total else 0.0,
+            "descartes": self.evictions,
+            "expirados": self.expirations,
+        }
+
+
+class RecognitionCache:
+    """Cache do reconhecimento: embeddings por conteúdo e resultados por versão do índice.
+
+    - Embeddings não dependem do índice: valem até o TTL, pelo hash exato do
+      upload ou, com `dhash_bits` > 0, pelo dHash mais próximo da região do
+      rosto (frames quase idênticos do quiosque reaproveitam o embedding).
+    - Resultados de busca (paciente, distância) valem só para a versão do
+      índice em que foram calculados: qualquer cadastro, remoção ou geração
+      nova limpa essa parte (ver `sync`).
+    """
+
+    def __init__(self, max_size=256, ttl=30.0, dhash_bits=0):
+        self.dhash_bits = dhash_bits
+        self.embeddings = LRUCache(max_size, ttl)
+        self.matches = LRUCache(max_size, ttl)
+        self.near_hits = 0
+        self.invalidations = 0
+        self._version = None
+        self._lock = threading.Lock()
+
+    def sync(self, version):
+        """Descarta os resultados de busca se o índice mudou desde que foram guardados."""
+        with self._lock:
+            if version != self._version:
+                if self._version is not None:
+                    self.invalidations += 1
+                self.matches.clear()
+                self._version = version
+
+    def match(self, key, k):
+        return self.matches.get((key, k, self._version))
+
+    def put_match(self, key, k, result, version):
+        # Resultado calculado numa versão que já ficou para trás não entra
+        if version == self._version:
+            self.matches.put((key, k, version), result)
+
+    def embedding(self, key, phash=None):
+        """Embedding pelo hash exato; sem ele, pelo dHash mais próximo dentro do limite."""
+        entry = self.embeddings.get(key)
+        if entry is not None or phash is None or not self.dhash_bits:
+            return entry[1] if entry is not None else None
+
+        best, best_bits = None, self.dhash_bits + 1
+        for _, (other, embedding) in self.embeddings.values():
+            if other is None:
+                continue
+            bits = bin(phash ^ other).count("1")
+            if bits < best_bits:
+                best, best_bits = embedding, bits
+        if best is not None:
+            self.near_hits += 1
+        return best
+
+    def put_embedding(self, key, embedding, phash=None):
+        self.embeddings.put(key, (phash, embedding))
+
+    def metrics(self):
+        return {
+            "embeddings": self.embeddings.metrics(),
+            "resultados": self.matches.metrics(),
+            "acertos_por_dhash": self.near_hits,
+            "invalidacoes_por_versao": self.invalidations,
+            "dhash_bits": self.dhash_bits,
+        }
@@ -0,0 +1,143 @@
+import numpy as np
+
+
+def similarity_from_distance(distances):
+    """Similaridade de cosseno a partir da L2 ao quadrado entre vetores normalizados."""
+    return 1.0 - np.asarray(distances, dtype=np.float32) / 2.0
+
+
+class ConfidenceCalibrator:
+    """Converte a similaridade de cosseno em probabilidade de ser a mesma pessoa.
+
+    Ajusta uma logística p = 1 / (1 + exp(-(a * s + b))) sobre escores genuínos
+    (um template contra os outros templates do mesmo paciente) e impostores
+    (o mesmo template contra o melhor candidato de outro paciente), com as
+    duas classes pesadas igualmente. Sem dados suficientes usa a curva padrão,
+    centrada no limiar de aceitação.
+    """
+
+    MIN_SCORES = 10
+
+    def __init__(self, slope=20.0, intercept=None, center=0.5, genuine=0, impostor=0):
+        self.slope = slope
+        self.intercept = -slope * center if intercept is None else intercept
+        self.genuine = genuine
+        self.impostor = impostor
+
+    @property
+    def calibrated(self):
+        return self.genuine >= self.MIN_SCORES and self.impostor >= self.MIN_SCORES
+
+    @classmethod
+    def fit(cls, genuine, impostor, center=0.5, l2=1e-3, iterations=50):
+        genuine = np.asarray(genuine, dtype=np.float64)
+        impostor = np.asarray(impostor, dtype=np.float64)
+        if len(genuine) < cls.MIN_SCORES or len(impostor) < cls.MIN_SCORES:
+            return cls(center=center, genuine=len(genuine), impostor=len(impostor))
+
+        x = np.concatenate([genuine, impostor])
+        y = np.concatenate([np.ones(len(genuine)), np.zeros(len(impostor))])
+        weights = np.where(y == 1, 0.5 / len(genuine), 0.5 / len(impostor))
+        X = np.column_stack([x, np.ones_like(x)])
+
+        # Newton (IRLS) com um pouco de L2: classes separáveis não fazem a inclinação divergir
+        theta = np.array([20.0, -20.0 * center])
+        for _ in range(iterations):
+            p = 1.0 / (1.0 + np.exp(-(X @ theta)))
+            gradient = X.T @ (weights * (p - y)) + l2 * np.array([theta[0], 0.0])
+            hessian = (X * (weights * p * (1 - p))[:, None]).T @ X + l2 * np.diag([1.0, 0.0])
+            step = np.linalg.solve(hessian + 1e-9 * np.eye(2), gradient)
+            theta -= step
+            if np.abs(step).max() < 1e-6:
+                break
+        return cls(float(theta[0]), float(theta[1]), genuine=len(genuine), impostor=len(impostor))
+
+    def __call__(self, similarities):
+        z = self.slope * np.asarray(similarities, dtype=np.float64) + self.intercept
+        return 1.0 / (1.0 + np.exp(-np.clip(z, -50, 50)))
+
+    def metrics(self):
+        return {
+            "calibrado": self.calibrated,
+            "inclinacao": round(self.slope, 4),
+            "intercepto": round(self.intercept, 4),
+            "pares_genuinos": self.genuine,
+            "pares_impostores": self.impostor,
+        }
+
+
+def score_distributions(labels, vectors, block_size=4096, bins=2000):
+    """Histogramas genuíno/impostor de todos os pares, em blocos de produto matricial.
+
+    `labels` diz a que paciente pertence cada vetor (normalizado). Cada par
+    (i < j) é contado uma vez; a memória fica limitada a um bloco
+    block_size x block_size de similaridades. Também devolve, por vetor, a
+    maior similaridade genuína e a maior impostora (para a acurácia de
+    identificação leave-one-out); -inf onde não houver par.
+    """
+    labels = np.asarray(labels)
+    n = len(labels)
+    genuine = np.zeros(bins, dtype=np.int64)
+    impostor = np.zeros(bins, dtype=np.int64)
+    best_genuine = np.full(n, -np.inf, dtype=np.float32)
+    best_impostor = np.full(n, -np.inf, dtype=np.float32)
+
+    def histogram(values):
+        positions = ((values + 1.0) * (bins / 2.0)).astype(np.int64)
+        return np.bincount(np.clip(positions, 0, bins - 1), minlength=bins)
+
+    for a in range(0, n, block_size):
+        rows = np.ascontiguousarray(vectors[a:a + block_size], dtype=np.float32)
+        row_labels = labels[a:a + block_size]
+        for b in range(a, n, block_size):
+            cols = rows if b == a else np.ascontiguousarray(vectors[b:b + block_size], dtype=np.float32)
+            col_labels = labels[b:b + block_size]
+            sims = rows @ cols.T
+            same = row_labels[:, None] == col_labels[None, :]
+
+            if b == a:
+                # Bloco da diagonal: só o triângulo superior (sem o par do vetor com ele mesmo)
+                upper = np.triu(np.ones(sims.shape, dtype=bool), k=1)
+                genuine += histogram(sims[same & upper])
+                impostor += histogram(sims[~same & upper])
+                np.fill_diagonal(sims, -np.inf)
+            else:
+                genuine += histogram(sims[same])
+                impostor += histogram(sims[~same])
+
+            masked_same = np.where(same, sims, -np.inf)
+            masked_other = np.where(same, -np.inf, sims)
+            rows_slice = slice(a, a + len(rows))
+            cols_slice = slice(b, b + len(cols))
+            best_genuine[rows_slice] = np.maximum(best_genuine[rows_slice], masked_same.max(axis=1))
+            best_impostor[rows_slice] = np.maximum(best_impostor[rows_slice], masked_other.max(axis=1))
+            if b != a:
+                best_genuine[cols_slice] = np.maximum(best_genuine[cols_slice], masked_same.max(axis=0))
+                best_impostor[cols_slice] = np.maximum(best_impostor[cols_slice], masked_other.max(axis=0))
+
+    return genuine, impostor, best_genuine, best_impostor
+
+
+def error_rates(genuine, impostor):
+    """Curvas FAR/FRR por limiar de similaridade a partir dos histogramas.
+
+    FAR(t): fração dos pares impostores com similaridade >= t.
+    FRR(t): fração dos pares genuínos com similaridade < t.
+    """
+    bins = len(genuine)
+    thresholds = np.linspace(-1.0, 1.0, bins, endpoint=False)
+    far = np.cumsum(impostor[::-1])[::-1] / max(impostor.sum(), 1)
+    frr = np.concatenate([[0], np.cumsum(genuine)[:-1]]) / max(genuine.sum(), 1)
+    return thresholds, far, frr
+
+
+def equal_error_rate(thresholds, far, frr):
+    """(EER, limiar) no ponto em que FAR e FRR se cruzam."""
+    i = int(np.argmin(np.abs(far - frr)))
+    return float((far[i] + frr[i]) / 2), float(thresholds[i])
+
+
+def threshold_for_far(thresholds, far, target):
+    """Menor limiar com FAR <= alvo (o que menos rejeita genuínos)."""
+    ok = np.flatnonzero(far <= target)
+    return float(thresholds[ok[0]]) if len(ok) else float(thresholds[-1])
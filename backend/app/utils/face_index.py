@@ -0,0 +1,325 @@
+import math
+import faiss
+import numpy as np
+
+from app.config import (
+    FACE_IVF_NLIST,
+    FACE_IVF_NPROBE,
+    FACE_HNSW_M,
+    FACE_HNSW_EF_CONSTRUCTION,
+    FACE_HNSW_EF_SEARCH,
+    FACE_SQ_TYPE,
+    FACE_PQ_M,
+)
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "sq", "pq")
+# Backends que guardam códigos com perda: a busca final é refeita sobre os float32 crus
+COMPRESSED_TYPES = ("sq", "pq")
+
+_SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "8bit": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def _auto_nlist(n):
+    # Regra usual do FAISS: ~4*sqrt(N) listas, com pelo menos 39 pontos de treino por lista
+    return max(1, min(int(4 * math.sqrt(n)), n // 39))
+
+
+def target_kind(kind, threshold, ntotal, current):
+    """Backend que um índice com `ntotal` vetores deveria usar agora."""
+    if kind == "flat":
+        return "flat"
+    if ntotal >= threshold:
+        return kind
+    # Histerese: só volta para a busca exata bem abaixo do limiar
+    if current == kind and ntotal >= threshold // 2:
+        return kind
+    return "flat"
+
+
+def index_type_of(index):
+    """Descobre qual backend um índice FAISS (já carregado) usa."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq"
+    if isinstance(index, faiss.IndexPQ):
+        return "pq"
+    return "flat"
+
+
+def _inner(index):
+    # Índice "de verdade" por baixo do IndexIDMap2 (o IVF guarda os ids sozinho)
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def configure_index(index):
+    """Aplica os parâmetros de busca da configuração (nprobe/efSearch)."""
+    inner = _inner(index)
+    if isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = FACE_IVF_NPROBE
+    elif isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = FACE_HNSW_EF_SEARCH
+    return index
+
+
+def _training_sample(vectors, size):
+    if len(vectors) <= size:
+        return vectors
+    rng = np.random.default_rng(0)
+    return vectors[rng.choice(len(vectors), size, replace=False)]
+
+
+def build_index(kind, vectors, ids=None, dimension=512, nlist=None, sq_type=None, pq_m=None):
+    """Cria um índice do tipo pedido já populado com os vetores.
+
+    O índice é endereçado pelo id do paciente: flat, HNSW, SQ e PQ ficam dentro
+    de um IndexIDMap2, e o IVF usa os ids nativamente (o IndexIDMap não é
+    compatível com o remove_ids do IVF). IVF, SQ 8bit e PQ são treinados sobre
+    uma amostra dos vetores.
+    """
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconhecido: {kind}")
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n = len(vectors)
+    ids = np.arange(n, dtype=np.int64) if ids is None else np.ascontiguousarray(ids, dtype=np.int64)
+
+    if kind == "flat" or n == 0:
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+    elif kind == "ivf":
+        nlist = nlist or FACE_IVF_NLIST or _auto_nlist(n)
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_L2)
+        # Mapa direto por hashtable: reconstrução e remoção por id do paciente
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        index.train(_training_sample(vectors, 256 * nlist))
+    elif kind == "sq":
+        sq = faiss.IndexScalarQuantizer(dimension, _SQ_TYPES[sq_type or FACE_SQ_TYPE], faiss.METRIC_L2)
+        if not sq.is_trained:
+            sq.train(_training_sample(vectors, 65536))
+        index = faiss.IndexIDMap2(sq)
+    elif kind == "pq":
+        # 8 bits por subquantizador: 256 centróides, treinados com ~100 pontos cada
+        pq = faiss.IndexPQ(dimension, pq_m or FACE_PQ_M, 8, faiss.METRIC_L2)
+        pq.train(_training_sample(vectors, 256 * 100))
+        index = faiss.IndexIDMap2(pq)
+    else:
+        hnsw = faiss.IndexHNSWFlat(dimension, FACE_HNSW_M)
+        hnsw.hnsw.efConstruction = FACE_HNSW_EF_CONSTRUCTION
+        index = faiss.IndexIDMap2(hnsw)
+
+    if n:
+        index.add_with_ids(vectors, ids)
+    return configure_index(index)
+
+
+def positional_to_ids(index, id_map):
+    """Converte um índice posicional antigo (+ lista id_map) para (ids, vetores).
+
+    No formato antigo uma foto nova virava outra linha para o mesmo paciente;
+    aqui só a última linha de cada paciente é mantida.
+    """
+    n = min(index.ntotal, len(id_map))
+    if n == 0:
+        return np.empty(0, dtype=np.int64), np.empty((0, index.d), dtype=np.float32)
+    vectors = index.reconstruct_n(0, n)
+    ids = np.asarray(id_map[:n], dtype=np.int64)
+    _, last = np.unique(ids[::-1], return_index=True)
+    keep = np.sort(n - 1 - last)
+    return ids[keep], vectors[keep]
+
+
+class FaceIndex:
+    """Índice de embeddings faciais endereçado pelo idPaciente.
+
+    Envolve um índice FAISS de qualquer backend (flat, IVF-Flat, HNSW, SQ ou
+    PQ). O backend é escolhido quando o snapshot é publicado (ver
+    SharedFaceIndex._publish e target_kind); depois disso só o delta do
+    journal, sempre flat, recebe `add` (que substitui o vetor de um paciente
+    já cadastrado) e `remove`.
+    """
+
+    def __init__(self, dimension=512, index=None):
+        self.dimension = dimension
+        self.index = configure_index(index) if index is not None else build_index("flat", [], dimension=dimension)
+        self._position_ids = None
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def backend(self):
+        return index_type_of(self.index)
+
+    def _ids_by_position(self):
+        if self._position_ids is None:
+            self._position_ids = faiss.vector_to_array(faiss.downcast_index(self.index).id_map)
+        return self._position_ids
+
+    def items(self):
+        """Retorna (ids, vetores) de todos os pacientes no índice."""
+        if self.index.ntotal == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dimension), dtype=np.float32)
+
+        inner = _inner(self.index)
+        if isinstance(inner, faiss.IndexIVF):
+            # No IVF-Flat os códigos das listas invertidas já são os float32 crus
+            invlists = inner.invlists
+            ids, vectors = [], []
+            for list_no in range(inner.nlist):
+                size = invlists.list_size(list_no)
+                if not size:
+                    continue
+                ids.append(faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy())
+                codes = faiss.rev_swig_ptr(invlists.get_codes(list_no), size * invlists.code_size)
+                vectors.append(codes.view(np.float32).reshape(size, self.dimension).copy())
+            return np.concatenate(ids), np.concatenate(vectors)
+
+        return self._ids_by_position().copy(), inner.reconstruct_n(0, self.index.ntotal)
+
+    def add(self, ids, vectors):
+        """Insere ou substitui os vetores dos pacientes informados."""
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        self.remove(ids)
+        self.index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), ids)
+        self._position_ids = None
+
+    def remove(self, ids):
+        ids = np.ascontiguousarray(ids, dtype=np.int64)
+        if self.index.ntotal == 0:
+            return 0
+        removed = self.index.remove_ids(ids)
+        self._position_ids = None
+        return removed
+
+    def _search_params(self, selector):
+        inner = _inner(self.index)
+        if isinstance(inner, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=selector, nprobe=inner.nprobe)
+        if isinstance(inner, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=inner.hnsw.efSearch)
+        return faiss.SearchParameters(sel=selector)
+
+    def search(self, queries, k=1, exclude=None):
+        """Retorna (distâncias, ids de paciente); -1 onde não houver candidato.
+
+        `exclude` é um conjunto de ids de paciente a ignorar na busca.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        if not exclude:
+            return self.index.search(queries, k)
+
+        if self.backend == "pq":
+            # O IndexPQ não aceita IDSelector: busca a mais e filtra os excluídos
+            distances, ids = self.index.search(queries, k + len(exclude))
+            distances = np.where(np.isin(ids, np.fromiter(exclude, dtype=np.int64)), np.inf, distances)
+            return merge_results([(distances, ids)], k)
+
+        selector = faiss.IDSelectorBatch(np.fromiter(exclude, dtype=np.int64))
+        not_selector = faiss.IDSelectorNot(selector)
+        return self.index.search(queries, k, params=self._search_params(not_selector))
+
+
+class MmapFlatIndex:
+    """Busca exata, somente leitura, sobre vetores float32 num np.memmap.
+
+    Vários processos que mapeiam o mesmo arquivo compartilham as páginas no
+    page cache, então N workers custam a memória de um. As distâncias são as
+    mesmas do IndexFlatL2 (L2 ao quadrado).
+    """
+
+    backend = "flat"
+
+    def __init__(self, ids, vectors, block_size=65536):
+        self.ids = ids
+        self.vectors = vectors
+        self.block_size = block_size
+        # Normas ficam em memória privada: 4 bytes por paciente
+        self._norms = np.einsum("ij,ij->i", vectors, vectors) if len(vectors) else np.empty(0, dtype=np.float32)
+
+    @property
+    def ntotal(self):
+        return len(self.ids)
+
+    def items(self):
+        return self.ids, self.vectors
+
+    def search(self, queries, k=1, exclude=None):
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        nq = len(queries)
+        best_d = np.full((nq, k), np.inf, dtype=np.float32)
+        best_i = np.full((nq, k), -1, dtype=np.int64)
+        excluded = np.fromiter(exclude, dtype=np.int64) if exclude else None
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+
+        for start in range(0, self.ntotal, self.block_size):
+            block = self.vectors[start:start + self.block_size]
+            ids = np.asarray(self.ids[start:start + self.block_size])
+            distances = self._norms[start:start + len(block)][None, :] + q_norms[:, None] - 2 * queries @ block.T
+            if excluded is not None:
+                distances[:, np.isin(ids, excluded)] = np.inf
+
+            merged_d = np.concatenate([best_d, distances], axis=1)
+            merged_i = np.concatenate([best_i, np.broadcast_to(ids, distances.shape)], axis=1)
+            top = np.argpartition(merged_d, k - 1, axis=1)[:, :k]
+            best_d = np.take_along_axis(merged_d, top, axis=1)
+            best_i = np.take_along_axis(merged_i, top, axis=1)
+
+        order = np.argsort(best_d, axis=1)
+        best_d = np.take_along_axis(best_d, order, axis=1)
+        best_i = np.take_along_axis(best_i, order, axis=1)
+        best_i[np.isinf(best_d)] = -1
+        return np.maximum(best_d, 0), best_i
+
+
+def exact_rerank(queries, candidates, ids, vectors, k):
+    """Reordena candidatos pela L2 exata sobre os vetores float32 crus.
+
+    `ids` é o arquivo de ids do snapshot (ordenado) e `vectors` o memmap
+    alinhado a ele; só as linhas dos candidatos são lidas do disco.
+    """
+    nq = len(queries)
+    best_d = np.full((nq, k), np.inf, dtype=np.float32)
+    best_i = np.full((nq, k), -1, dtype=np.int64)
+    if not len(ids):
+        return best_d, best_i
+
+    for row in range(nq):
+        found = candidates[row][candidates[row] >= 0]
+        rows = np.minimum(np.searchsorted(ids, found), len(ids) - 1)
+        valid = np.asarray(ids[rows]) == found
+        found, rows = found[valid], rows[valid]
+        if not len(found):
+            continue
+        diff = np.asarray(vectors[np.sort(rows)]) - queries[row]
+        order = np.argsort(rows)
+        distances = np.empty(len(rows), dtype=np.float32)
+        distances[order] = np.einsum("ij,ij->i", diff, diff)
+        top = np.argsort(distances)[:k]
+        best_d[row, :len(top)] = distances[top]
+        best_i[row, :len(top)] = found[top]
+    return best_d, best_i
+
+
+def merge_results(results, k):
+    """Junta resultados (distâncias, ids) de várias buscas mantendo os k melhores."""
+    distances = np.concatenate([d for d, _ in results], axis=1)
+    ids = np.concatenate([i for _, i in results], axis=1)
+    distances = np.where(ids < 0, np.inf, distances)
+    order = np.argsort(distances, axis=1)[:, :k]
+    distances = np.take_along_axis(distances, order, axis=1)
+    ids = np.take_along_axis(ids, order, axis=1)
+    ids[np.isinf(distances)] = -1
+    return distances, ids
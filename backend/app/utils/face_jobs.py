@@ -0,0 +1,258 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+from app.config import (
+    FACE_ENROLL_BACKOFF,
+    FACE_ENROLL_LEASE,
+    FACE_ENROLL_MAX_ATTEMPTS,
+    FACE_ENROLL_POLL,
+    FACE_ENROLL_WORKERS,
+)
+from app.database import db
+from app.models.cadastro_facial import CadastroFacial
+
+
+def _claim():
+    # Reivindica o próximo cadastro vencido com um UPDATE condicional: se outro
+    # worker (deste ou de outro processo) pegou antes, o UPDATE não altera nada
+    now = datetime.utcnow()
+    ids = [
+        id_cadastro
+        for (id_cadastro,) in db.session.query(CadastroFacial.idCadastro)
+        .filter(CadastroFacial.status == CadastroFacial.PENDENTE, CadastroFacial.proximaTentativa <= now)
+        .order_by(CadastroFacial.proximaTentativa)
+        .limit(8)
+    ]
+    for id_cadastro in ids:
+        claimed = CadastroFacial.query.filter_by(idCadastro=id_cadastro, status=CadastroFacial.PENDENTE).update(
+            {
+                CadastroFacial.status: CadastroFacial.PROCESSANDO,
+                CadastroFacial.iniciadoEm: now,
+                CadastroFacial.tentativas: CadastroFacial.tentativas + 1,
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if claimed:
+            return db.session.get(CadastroFacial, id_cadastro)
+    db.session.commit()
+    return None
+
+
+def _release_stale():
+    # Cadastro "processando" há mais que o lease: o worker caiu no meio, volta para a fila.
+    # Cancelado há mais que o lease: o worker caiu antes de apagá-lo
+    limit = datetime.utcnow() - timedelta(seconds=FACE_ENROLL_LEASE)
+    released = CadastroFacial.query.filter(
+        CadastroFacial.status == CadastroFacial.PROCESSANDO, CadastroFacial.iniciadoEm < limit
+    ).update({CadastroFacial.status: CadastroFacial.PENDENTE}, synchronize_session=False)
+    CadastroFacial.query.filter(
+        CadastroFacial.status == CadastroFacial.CANCELADO, CadastroFacial.iniciadoEm < limit
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return released
+
+
+def _discard_photo(job):
+    # Foto que não virou template não fica retida (migrar/reconstruir não a reprocessam)
+    from app.routes.pacientes import UPLOAD_FOLDER
+
+    path = os.path.join(UPLOAD_FOLDER, job.foto)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _cancelled(job):
+    # Paciente excluído durante o cadastro: deletar_paciente marca o cadastro como
+    # cancelado (ou o apaga, se ainda não estava em andamento). Consulta sem autoflush
+    # para não gravar antes da hora o desfecho que está na sessão; a trava de leitura
+    # no paciente segura a exclusão até o commit do desfecho
+    from app.models.paciente import Paciente
+
+    with db.session.no_autoflush:
+        status = db.session.query(CadastroFacial.status).filter_by(idCadastro=job.idCadastro).scalar()
+        exists = db.session.query(Paciente.idPaciente).filter_by(
+            idPaciente=job.idPaciente
+        ).with_for_update(read=True).first() is not None
+    return status in (None, CadastroFacial.CANCELADO) or not exists
+
+
+def _cancel(job):
+    # O template pode ter entrado no índice depois da remoção feita na exclusão
+    from app.routes.pacientes import UPLOAD_FOLDER
+    from app.utils.facial_recognition import patient_metadata, remove_face
+
+    db.session.rollback()
+    try:
+        remove_face(job.idPaciente)
+        patient_metadata().remove(job.idPaciente)
+    except Exception as e:
+        print("Erro ao desfazer o cadastro facial do paciente excluído:", str(e))
+    path = os.path.join(UPLOAD_FOLDER, job.foto)
+    if os.path.exists(path):
+        os.remove(path)
+    CadastroFacial.query.filter_by(idCadastro=job.idCadastro).delete(synchronize_session=False)
+    db.session.commit()
+    return CadastroFacial.CANCELADO
+
+
+def process(job):
+    """Gera o template da foto do cadastro e grava o desfecho; devolve o status final.
+
+    Uma retentativa depois de o template ter entrado no índice reaproveita o
+    slot registrado no cadastro em vez de gerar outro. Se o paciente foi
+    excluído no meio, o template gravado é retirado do índice e o cadastro some.
+
+    Rosto duplicado, sem rosto ou de qualidade ruim encerram o cadastro (outra
+    tentativa daria o mesmo resultado); sobrecarga reagenda sem gastar
+    tentativa; qualquer outro erro volta para a fila com backoff exponencial
+    até FACE_ENROLL_MAX_ATTEMPTS.
+    """
+    from app.models.paciente import Paciente
+    from app.models.paciente_embedding import PacienteEmbedding
+    from app.routes.pacientes import UPLOAD_FOLDER
+    from app.utils.face_admission import FaceOverloadedError
+    from app.utils.facial_recognition import DuplicateFaceError, embedding_model, register_face, stored_template
+
+    paciente = db.session.get(Paciente, job.idPaciente)
+    if paciente is None:
+        return _cancel(job)
+
+    discard = False
+    try:
+        embedding = stored_template(job.idPaciente, job.slot) if job.slot is not None else None
+        if embedding is None:
+            with open(os.path.join(UPLOAD_FOLDER, job.foto), "rb") as f:
+                conteudo = f.read()
+            job.slot, embedding = register_face(conteudo, job.idPaciente, check_duplicates=not job.ignorarDuplicados)
+            # O template já está no índice: o slot é gravado antes do resto, para que uma
+            # retentativa (commit abaixo falhou) não cadastre o mesmo rosto em outro slot
+            db.session.commit()
+        if _cancelled(job):
+            return _cancel(job)
+        PacienteEmbedding.salvar(job.idPaciente, job.slot, embedding, *embedding_model())
+        job.status, job.erro = CadastroFacial.CONCLUIDO, None
+    except DuplicateFaceError as e:
+        db.session.rollback()
+        job.status, job.erro = CadastroFacial.DUPLICADO, str(e)
+        job.duplicados = json.dumps(e.candidates)
+        discard = True
+    except FaceOverloadedError as e:
+        db.session.rollback()
+        job.status, job.tentativas = CadastroFacial.PENDENTE, job.tentativas - 1
+        job.proximaTentativa = datetime.utcnow() + timedelta(seconds=e.retry_after)
+    except ValueError as e:
+        # Sem rosto detectado, rosto pequeno/borrado/de perfil, imagem inválida
+        db.session.rollback()
+        job.status, job.erro = CadastroFacial.FALHOU, str(e)[:255]
+        discard = True
+    except Exception as e:
+        db.session.rollback()
+        job.erro = str(e)[:255]
+        if job.tentativas >= FACE_ENROLL_MAX_ATTEMPTS:
+            job.status = CadastroFacial.FALHOU
+        else:
+            job.status = CadastroFacial.PENDENTE
+            delay = FACE_ENROLL_BACKOFF * 2 ** (job.tentativas - 1)
+            job.proximaTentativa = datetime.utcnow() + timedelta(seconds=delay)
+    if _cancelled(job):
+        return _cancel(job)
+    if discard:
+        _discard_photo(job)
+    db.session.commit()
+    return job.status
+
+
+class EnrollmentWorkers:
+    """Threads que consomem a fila de cadastros faciais (tabela cadastro_facial).
+
+    A fila é a própria tabela: vários processos web e o `flask face
+    cadastros` podem consumi-la juntos, cada cadastro é reivindicado por um
+    UPDATE condicional. Entre consultas os workers esperam `poll` segundos ou
+    até `notify` (cadastro novo neste processo).
+    """
+
+    def __init__(self, app, workers, poll=FACE_ENROLL_POLL):
+        self.app = app
+        self.size = max(1, workers)
+        self.poll = poll
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_release = 0.0
+        self._lock = threading.Lock()
+        self.done = {}
+
+    def start(self):
+        for i in range(self.size):
+            thread = threading.Thread(target=self._loop, name=f"face-enroll-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def notify(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run_once(self):
+        """Processa um cadastro, se houver algum vencido; devolve se processou."""
+        now = datetime.utcnow().timestamp()
+        with self._lock:
+            release = now - self._last_release >= FACE_ENROLL_LEASE / 4
+            if release:
+                self._last_release = now
+        if release:
+            _release_stale()
+
+        job = _claim()
+        if job is None:
+            return False
+        status = process(job)
+        with self._lock:
+            self.done[status] = self.done.get(status, 0) + 1
+        return True
+
+    def _loop(self):
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    worked = self.run_once()
+                except Exception as e:
+                    print("Erro na fila de cadastros faciais:", str(e))
+                    db.session.rollback()
+                    worked = False
+                finally:
+                    db.session.remove()
+                if not worked:
+                    self._wake.wait(self.poll)
+                    self._wake.clear()
+
+
+_workers = None
+
+
+def start_enrollment_workers(app, workers=FACE_ENROLL_WORKERS):
+    """Sobe os workers da fila de cadastros neste processo (0 = nenhum)."""
+    global _workers
+    if _workers is None and workers > 0:
+        _workers = EnrollmentWorkers(app, workers).start()
+    return _workers
+
+
+def notify_enrollment():
+    # Acorda os workers deste processo; sem eles o cadastro espera outro consumidor
+    if _workers is not None:
+        _workers.notify()
+
+
+def queue_status():
+    """Quantidade de cadastros por status."""
+    counts = db.session.query(CadastroFacial.status, db.func.count()).group_by(CadastroFacial.status).all()
+    return {status: total for status, total in counts}
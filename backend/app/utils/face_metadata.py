@@ -0,0 +1,144 @@
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from datetime import date
+
+import numpy as np
+
+# Registro de tamanho fixo; a linha do arquivo é o próprio idPaciente
+RECORD = np.dtype([
+    ("seq", "<u4"),         # seqlock: ímpar enquanto a linha está sendo escrita
+    ("ativo", "u1"),        # 1 = linha preenchida
+    ("status", "S1"),
+    ("data_nasc", "<i4"),   # date.toordinal(); 0 = sem data
+    ("nome", "S100"),       # nomeComp em UTF-8 (mesmo tamanho da coluna do banco)
+])
+
+
+class PatientMetadata:
+    """Tabela lateral compacta dos pacientes (nome, status, nascimento).
+
+    Fica num arquivo de registros de tamanho fixo ao lado do índice, com uma
+    linha por idPaciente, mapeado em memória e compartilhado entre os workers.
+    Depois do reconhecimento o resumo do paciente sai de um acesso ao array,
+    sem ida ao banco. As escritas são serializadas por flock e cada registro
+    tem um contador (seqlock): o leitor nunca devolve uma linha pela metade.
+    O arquivo cresce em blocos de GROW linhas; quem lê remapeia quando o
+    arquivo muda de tamanho ou é trocado por `rebuild`.
+    """
+
+    GROW = 4096
+
+    def __init__(self, path):
+        self.path = path
+        self._lock_path = f"{path}.lock"
+        self._array = np.zeros(0, dtype=RECORD)
+        self._stamp = None
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    @contextmanager
+    def _file_lock(self):
+        with self._lock, open(self._lock_path, "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _records(self):
+        try:
+            st = os.stat(self.path)
+            stamp = st.st_ino, st.st_size
+        except FileNotFoundError:
+            stamp = None
+        if stamp != self._stamp:
+            if stamp is None or stamp[1] < RECORD.itemsize:
+                self._array = np.zeros(0, dtype=RECORD)
+            else:
+                self._array = np.memmap(self.path, dtype=RECORD, mode="r+")
+            self._stamp = stamp
+        return self._array
+
+    def _grow(self, db_id):
+        # Chamar com o lock: estende o arquivo (zerado) até cobrir a linha db_id
+        rows = (db_id // self.GROW + 1) * self.GROW
+        with open(self.path, "ab") as f:
+            if f.tell() < rows * RECORD.itemsize:
+                f.truncate(rows * RECORD.itemsize)
+        return self._records()
+
+    @staticmethod
+    def _fill(records, db_id, nome, status, data_nasc):
+        if isinstance(data_nasc, str):
+            data_nasc = date.fromisoformat(data_nasc)
+        records["seq"][db_id] += 1
+        records["ativo"][db_id] = 1
+        records["status"][db_id] = (status or "").encode()[:1]
+        records["data_nasc"][db_id] = data_nasc.toordinal() if data_nasc else 0
+        records["nome"][db_id] = (nome or "").encode()[:100]
+        records["seq"][db_id] += 1
+
+    def put(self, db_id, nome, status, data_nasc):
+        """Grava o resumo do paciente."""
+        with self._file_lock():
+            records = self._records()
+            if db_id >= len(records):
+                records = self._grow(db_id)
+            self._fill(records, db_id, nome, status, data_nasc)
+
+    def remove(self, db_id):
+        with self._file_lock():
+            records = self._records()
+            if db_id < len(records):
+                records["seq"][db_id] += 1
+                records["ativo"][db_id] = 0
+                records["seq"][db_id] += 1
+
+    def rebuild(self, rows):
+        """Troca o arquivo inteiro: rows = [(idPaciente, nome, status, dataNasc)]."""
+        size = (max((row[0] for row in rows), default=0) // self.GROW + 1) * self.GROW
+        records = np.zeros(size, dtype=RECORD)
+        for db_id, nome, status, data_nasc in rows:
+            self._fill(records, db_id, nome, status, data_nasc)
+        with self._file_lock():
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(records.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        return len(rows)
+
+    def get(self, db_id):
+        records = self._records()
+        if db_id < 0 or db_id >= len(records):
+            return None
+        for _ in range(3):
+            seq = records["seq"][db_id]
+            record = records[db_id].copy()
+            if seq % 2 == 0 and records["seq"][db_id] == seq:
+                break
+        else:
+            return None  # escrita em andamento: quem chamou cai para o banco
+        if not record["ativo"]:
+            return None
+        return {
+            "idPaciente": int(db_id),
+            "nomeComp": record["nome"].decode("utf-8", "ignore"),
+            "status": record["status"].decode(),
+            "dataNasc": date.fromordinal(int(record["data_nasc"])).isoformat() if record["data_nasc"] else None,
+        }
+
+    def get_many(self, ids):
+        """{idPaciente: resumo} dos ids que estão na tabela."""
+        found = {}
+        for db_id in ids:
+            summary = self.get(int(db_id))
+            if summary is not None:
+                found[int(db_id)] = summary
+        return found
+
+    def __len__(self):
+        return int(np.count_nonzero(self._records()["ativo"]))
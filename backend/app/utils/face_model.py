@@ -0,0 +1,306 @@
+import glob
+import os
+
+import cv2
+import numpy as np
+import onnxruntime
+from insightface.app import FaceAnalysis
+from insightface.model_zoo.model_zoo import ModelRouter
+from insightface.utils import ensure_available, face_align
+
+from app.config import (
+    FACE_MODEL_PROFILES,
+    FACE_PROFILE,
+    FACE_MODEL_PACK,
+    FACE_MODEL_ROOT,
+    FACE_DET_SIZE,
+    FACE_ALLOWED_MODULES,
+    FACE_CTX_ID,
+    FACE_ORT_PROVIDERS,
+    FACE_ORT_INTRA_OP_THREADS,
+    FACE_ORT_INTER_OP_THREADS,
+    FACE_ORT_GRAPH_OPTIMIZATION,
+    FACE_ORT_EXECUTION_MODE,
+    FACE_MIN_SIZE,
+    FACE_MIN_SHARPNESS,
+    FACE_MAX_YAW,
+    FACE_MAX_PITCH,
+    FACE_ROI_DET_SIZE,
+    FACE_ROI_MARGIN,
+    FACE_TRUST_CLIENT_LANDMARKS,
+)
+
+_GRAPH_OPTIMIZATION = {
+    "disabled": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+_EXECUTION_MODE = {
+    "sequential": onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def model_profile(name=None, **overrides):
+    """Configuração completa do modelo: perfil de FACE_MODEL_PROFILES + variáveis de ambiente."""
+    name = name or FACE_PROFILE
+    if name not in FACE_MODEL_PROFILES:
+        raise ValueError(f"Perfil de modelo desconhecido: {name}")
+
+    profile = {
+        "pack": "buffalo_l",
+        "root": FACE_MODEL_ROOT,
+        "det_size": 640,
+        "allowed_modules": FACE_ALLOWED_MODULES,
+        "ctx_id": FACE_CTX_ID,
+        "providers": FACE_ORT_PROVIDERS,
+        "intra_op_threads": FACE_ORT_INTRA_OP_THREADS,
+        "inter_op_threads": FACE_ORT_INTER_OP_THREADS,
+        "graph_optimization": FACE_ORT_GRAPH_OPTIMIZATION,
+        "execution_mode": FACE_ORT_EXECUTION_MODE,
+    }
+    profile.update(FACE_MODEL_PROFILES[name])
+    # Variáveis explícitas valem só para o perfil ativo
+    if name == FACE_PROFILE:
+        if FACE_MODEL_PACK:
+            profile["pack"] = FACE_MODEL_PACK
+        if FACE_DET_SIZE:
+            profile["det_size"] = int(FACE_DET_SIZE)
+    profile.update({k: v for k, v in overrides.items() if v is not None})
+    profile["name"] = name
+    return profile
+
+
+def session_options(profile):
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = profile["intra_op_threads"]
+    options.inter_op_num_threads = profile["inter_op_threads"]
+    options.graph_optimization_level = _GRAPH_OPTIMIZATION[profile["graph_optimization"]]
+    options.execution_mode = _EXECUTION_MODE[profile["execution_mode"]]
+    return options
+
+
+def build_model(profile=None, **overrides):
+    """Carrega o pacote de modelos do InsightFace conforme o perfil.
+
+    Faz o mesmo que FaceAnalysis.__init__, mas repassa as SessionOptions ao
+    ONNX runtime (o model_zoo do insightface descarta esse parâmetro) e só
+    mantém as sessões dos módulos permitidos.
+    """
+    profile = profile or model_profile(**overrides)
+    options = session_options(profile)
+    providers = profile["providers"] or onnxruntime.get_available_providers()
+
+    model = FaceAnalysis.__new__(FaceAnalysis)
+    model.model_dir = ensure_available("models", profile["pack"], root=profile["root"])
+    model.models = {}
+    for onnx_file in sorted(glob.glob(os.path.join(model.model_dir, "*.onnx"))):
+        loaded = ModelRouter(onnx_file).get_model(sess_options=options, providers=providers)
+        if loaded is None or loaded.taskname not in profile["allowed_modules"]:
+            continue
+        model.models.setdefault(loaded.taskname, loaded)
+
+    if "detection" not in model.models or "recognition" not in model.models:
+        raise RuntimeError(f"Pacote {profile['pack']} sem modelo de detecção ou reconhecimento")
+    model.det_model = model.models["detection"]
+
+    det_size = profile["det_size"]
+    model.prepare(ctx_id=profile["ctx_id"], det_size=(det_size, det_size))
+    return model
+
+
+def warm_up(model):
+    """Roda detector e reconhecimento uma vez: a 1ª execução do ONNX é a mais lenta."""
+    det_size = model.det_model.input_size or (640, 640)
+    model.det_model.detect(np.zeros((det_size[1], det_size[0], 3), dtype=np.uint8), max_num=0, metric='default')
+    size = model.models['recognition'].input_size[0]
+    embed_batch(model, [np.zeros((size, size, 3), dtype=np.uint8)])
+
+
+def decode_image(data):
+    # Decodifica a imagem direto da memória (bytes, memoryview ou buffer numpy).
+    # np.frombuffer sobre o memoryview não copia os dados do upload.
+    if isinstance(data, np.ndarray) and data.ndim == 3:
+        return data  # já é uma imagem decodificada (BGR)
+
+    buffer = np.frombuffer(memoryview(data), dtype=np.uint8)
+    img = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("Não foi possível decodificar a imagem enviada")
+    return img
+
+
+def load_image(image):
+    # Caminho em disco só faz sentido para fotos de cadastro já retidas em uploads/faces
+    if isinstance(image, (str, os.PathLike)):
+        img = cv2.imread(os.fspath(image))
+        if img is None:
+            raise ValueError(f"Não foi possível carregar a imagem: {image}")
+        return img
+    return decode_image(image)
+
+
+def prepare(image):
+    img = load_image(image)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+class FaceQualityError(ValueError):
+    """Rosto detectado, mas pequeno, borrado ou de perfil demais para reconhecer."""
+
+
+def primary_face(bboxes, kpss):
+    # Rosto dominante: maior caixa ponderada pela confiança do detector
+    areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+    best = int(np.argmax(areas * bboxes[:, 4]))
+    return bboxes[best], kpss[best]
+
+
+def detect(model, img_rgb):
+    # Só o detector: os modelos de atributos (gênero/idade) não são executados
+    bboxes, kpss = model.det_model.detect(img_rgb, max_num=0, metric='default')
+    if bboxes.shape[0] == 0:
+        raise ValueError("Nenhum rosto detectado")
+    return primary_face(bboxes, kpss)
+
+
+def _hint_box(hint, shape):
+    # Caixa [x1, y1, x2, y2] do cliente, recortada à imagem; None se não fizer sentido
+    try:
+        x1, y1, x2, y2 = (float(v) for v in hint["caixa"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    h, w = shape[:2]
+    x1, y1, x2, y2 = max(x1, 0), max(y1, 0), min(x2, w), min(y2, h)
+    if x2 - x1 < 8 or y2 - y1 < 8:
+        return None
+    return np.array([x1, y1, x2, y2], dtype=np.float32)
+
+
+def _hint_landmarks(hint, box):
+    # 5 pontos no padrão do SCRFD: olhos, nariz, cantos da boca (esquerda da imagem primeiro)
+    try:
+        kps = np.asarray(hint["pontos"], dtype=np.float32).reshape(5, 2)
+    except (KeyError, TypeError, ValueError):
+        return None
+    width = box[2] - box[0]
+    pad = 0.1 * width
+    inside = (
+        (kps[:, 0] >= box[0] - pad) & (kps[:, 0] <= box[2] + pad)
+        & (kps[:, 1] >= box[1] - pad) & (kps[:, 1] <= box[3] + pad)
+    )
+    eyes_y = (kps[0, 1] + kps[1, 1]) / 2
+    mouth_y = (kps[3, 1] + kps[4, 1]) / 2
+    if (
+        not inside.all()
+        or kps[0, 0] >= kps[1, 0]
+        or kps[3, 0] >= kps[4, 0]
+        or eyes_y >= mouth_y
+        or kps[1, 0] - kps[0, 0] < 0.2 * width
+    ):
+        return None
+    return kps
+
+
+def _detect_in_region(model, img_rgb, box):
+    # Detector só na região da dica (com margem), numa entrada bem menor que a padrão
+    h, w = img_rgb.shape[:2]
+    margin = FACE_ROI_MARGIN * max(box[2] - box[0], box[3] - box[1])
+    x1, y1 = int(max(box[0] - margin, 0)), int(max(box[1] - margin, 0))
+    x2, y2 = int(min(box[2] + margin, w)), int(min(box[3] + margin, h))
+    size = (FACE_ROI_DET_SIZE, FACE_ROI_DET_SIZE)
+    bboxes, kpss = model.det_model.detect(img_rgb[y1:y2, x1:x2], input_size=size, max_num=0, metric='default')
+    if bboxes.shape[0] == 0:
+        return None
+    bbox, kps = primary_face(bboxes, kpss)
+    offset = np.array([x1, y1], dtype=np.float32)
+    bbox = bbox.copy()
+    bbox[:4] += np.tile(offset, 2)
+    return bbox, kps + offset
+
+
+def locate_face(model, img_rgb, hint=None):
+    """Caixa e landmarks do rosto, aproveitando a dica do cliente quando ela é válida.
+
+    hint: {"caixa": [x1, y1, x2, y2], "pontos": [[x, y] * 5]} nas coordenadas da
+    imagem enviada. Landmarks coerentes dispensam o detector; só a caixa restringe
+    a detecção à região; dica inválida (ou sem rosto na região) cai na detecção completa.
+    """
+    if hint:
+        box = _hint_box(hint, img_rgb.shape)
+        if box is not None:
+            kps = _hint_landmarks(hint, box) if FACE_TRUST_CLIENT_LANDMARKS else None
+            if kps is not None:
+                return np.append(box, 1.0), kps
+            found = _detect_in_region(model, img_rgb, box)
+            if found is not None:
+                return found
+        elif hint.get("recorte"):
+            # Recorte do rosto feito no cliente: a imagem inteira é a região
+            h, w = img_rgb.shape[:2]
+            found = _detect_in_region(model, img_rgb, np.array([0, 0, w, h], dtype=np.float32))
+            if found is not None:
+                return found
+    return detect(model, img_rgb)
+
+
+def check_quality(img_rgb, bbox, kps):
+    """Rejeita o rosto antes do embedding; levanta FaceQualityError."""
+    x1, y1, x2, y2 = bbox[:4]
+    if FACE_MIN_SIZE and min(x2 - x1, y2 - y1) < FACE_MIN_SIZE:
+        raise FaceQualityError("Rosto muito pequeno na imagem; aproxime a câmera")
+
+    # Pose pelos 5 pontos: olhos (0, 1), nariz (2), cantos da boca (3, 4)
+    eyes = (kps[0] + kps[1]) / 2
+    mouth = (kps[3] + kps[4]) / 2
+    eye_distance = np.linalg.norm(kps[1] - kps[0])
+    if FACE_MAX_YAW and eye_distance > 0:
+        if abs(kps[2][0] - eyes[0]) / eye_distance > FACE_MAX_YAW:
+            raise FaceQualityError("Rosto muito de lado; olhe para a câmera")
+    face_height = mouth[1] - eyes[1]
+    if FACE_MAX_PITCH and face_height > 0:
+        if abs((kps[2][1] - eyes[1]) / face_height - 0.5) > FACE_MAX_PITCH:
+            raise FaceQualityError("Rosto muito inclinado para cima ou para baixo")
+
+    if FACE_MIN_SHARPNESS:
+        h, w = img_rgb.shape[:2]
+        region = img_rgb[max(int(y1), 0):min(int(y2), h), max(int(x1), 0):min(int(x2), w)]
+        if region.size:
+            gray = cv2.cvtColor(cv2.resize(region, (112, 112)), cv2.COLOR_RGB2GRAY)
+            if cv2.Laplacian(gray, cv2.CV_64F).var() < FACE_MIN_SHARPNESS:
+                raise FaceQualityError("Imagem do rosto borrada; tente novamente")
+
+
+def align(model, img_rgb, kps):
+    recognition = model.models['recognition']
+    return face_align.norm_crop(img_rgb, landmark=kps, image_size=recognition.input_size[0])
+
+
+def embed_batch(model, crops):
+    # ArcFace aceita vários rostos alinhados numa única chamada ONNX
+    embeddings = model.models['recognition'].get_feat(crops).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+
+def embed_images(model, images, hints=None):
+    """Embeddings de várias imagens; devolve um vetor ou uma exceção por imagem."""
+    results = [None] * len(images)
+    hints = hints or [None] * len(images)
+    crops, owners = [], []
+    for i, (image, hint) in enumerate(zip(images, hints)):
+        try:
+            img_rgb = prepare(image)
+            bbox, kps = locate_face(model, img_rgb, hint)
+            check_quality(img_rgb, bbox, kps)
+            # Só o rosto dominante é alinhado e vai para o ArcFace
+            crops.append(align(model, img_rgb, kps))
+            owners.append(i)
+        except Exception as e:
+            results[i] = e
+
+    if crops:
+        for row, embedding in zip(owners, embed_batch(model, crops)):
+            results[row] = embedding
+    return results
@@ -0,0 +1,81 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from app.utils.face_model import build_model, embed_images, model_profile, warm_up
+
+# Modelo carregado uma única vez em cada processo do pool
+_worker_model = None
+
+
+def _init_worker(intra_op_threads, inter_op_threads, profile=None, overrides=None):
+    global _worker_model
+    # Evita que o OpenMP de cada worker abra uma thread por núcleo da máquina
+    os.environ["OMP_NUM_THREADS"] = str(intra_op_threads or 1)
+    # Mesmo perfil do processo web (ou o pedido, numa migração), com as threads próprias do pool
+    _worker_model = build_model(model_profile(
+        profile,
+        intra_op_threads=intra_op_threads,
+        inter_op_threads=inter_op_threads,
+        **(overrides or {}),
+    ))
+    warm_up(_worker_model)
+
+
+def _embed_in_worker(images, hints=None):
+    return embed_images(_worker_model, images, hints)
+
+
+def _ping_worker():
+    return os.getpid()
+
+
+class InferencePool:
+    """Pool de processos dedicados à inferência facial (CPU-bound).
+
+    Cada processo carrega o InsightFace uma vez no initializer; as rotas só
+    enviam as imagens (bytes) e esperam o Future, sem segurar o GIL do worker
+    Flask enquanto o ONNX roda. O pool é criado no primeiro uso.
+    """
+
+    def __init__(self, size, intra_op_threads=1, inter_op_threads=1, profile=None, overrides=None):
+        self.size = size
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.profile = profile
+        self.overrides = overrides
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.size,
+                        # spawn: não herda sessões ONNX/threads do processo pai
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker,
+                        initargs=(self.intra_op_threads, self.inter_op_threads, self.profile, self.overrides),
+                    )
+                    atexit.register(self.shutdown)
+        return self._executor
+
+    def submit(self, images, hints=None):
+        """Future com um embedding (ou exceção) por imagem."""
+        return self._get_executor().submit(_embed_in_worker, list(images), hints)
+
+    def embed_images(self, images, hints=None, timeout=None):
+        return self.submit(images, hints).result(timeout)
+
+    def warm_up(self, timeout=None):
+        """Sobe os processos do pool (cada um carrega e aquece o modelo)."""
+        futures = [self._get_executor().submit(_ping_worker) for _ in range(self.size)]
+        return {future.result(timeout) for future in futures}
+
+    def shutdown(self, cancel_futures=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=cancel_futures)
+            self._executor = None
@@ -0,0 +1,576 @@
+import fcntl
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+from app.config import FACE_INDEX_TYPE, FACE_INDEX_TRAIN_THRESHOLD, FACE_RERANK_FACTOR
+from app.utils.face_index import (
+    COMPRESSED_TYPES,
+    FaceIndex,
+    MmapFlatIndex,
+    build_index,
+    exact_rerank,
+    merge_results,
+    target_kind,
+)
+
+OP_ADD = 1  # insere ou substitui o vetor do paciente
+OP_REMOVE = 2  # o embedding do registro vem zerado
+
+# Registro do journal: op (u8), id do paciente (i64), embedding float32[dim], crc32
+_HEADER = struct.Struct("<Bq")
+_CRC = struct.Struct("<I")
+
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(path, write):
+    # Grava em arquivo temporário e troca com os.replace: ou o arquivo antigo ou o novo, nunca meio-termo
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _memmap(path, dtype):
+    # np.memmap não aceita arquivo vazio
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+class EmbeddingJournal:
+    """Journal append-only de registros (op, id do paciente, embedding).
+
+    Cada registro tem tamanho fixo e termina com um CRC32. Leitores acompanham
+    o arquivo a partir de um offset e param no primeiro registro incompleto;
+    só o escritor (com o lock do diretório) corta uma cauda corrompida por
+    queda no meio da escrita. O fsync é feito em lote: a cada `fsync_every`
+    registros ou `fsync_interval` segundos, o que vier primeiro.
+    """
+
+    def __init__(self, path, dimension, fsync_every=16, fsync_interval=1.0):
+        self.path = path
+        self.dimension = dimension
+        self.record_size = _HEADER.size + 4 * dimension + _CRC.size
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._file = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def read_from(self, offset):
+        """Lê os registros válidos a partir de `offset`; retorna (registros, novo offset)."""
+        records = []
+        if self.size() <= offset:
+            return records, offset
+
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            while True:
+                raw = f.read(self.record_size)
+                if len(raw) < self.record_size:
+                    break
+                body, (crc,) = raw[:-_CRC.size], _CRC.unpack(raw[-_CRC.size:])
+                if zlib.crc32(body) != crc:
+                    break
+                op, patient_id = _HEADER.unpack_from(body)
+                embedding = np.frombuffer(body, dtype=np.float32, offset=_HEADER.size)
+                records.append((op, patient_id, embedding))
+                offset += self.record_size
+        return records, offset
+
+    def truncate(self, size):
+        """Corta uma cauda inválida (chamar só com o lock do diretório)."""
+        if self.size() > size:
+            with open(self.path, "r+b") as f:
+                f.truncate(size)
+
+    def append(self, op, patient_id, embedding):
+        if self._file is None:
+            self._file = open(self.path, "ab")
+
+        body = _HEADER.pack(op, int(patient_id)) + np.ascontiguousarray(embedding, dtype=np.float32).tobytes()
+        self._file.write(body + _CRC.pack(zlib.crc32(body)))
+        self._file.flush()
+        self._unsynced += 1
+
+        if (self._unsynced >= self.fsync_every
+                or time.monotonic() - self._last_sync >= self.fsync_interval):
+            self.sync()
+
+    def sync(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+
+class Snapshot:
+    """Geração publicada do índice, aberta somente leitura e mapeada em memória.
+
+    Toda geração grava os vetores crus (`vectors.g.f32`) e os ids
+    (`ids.g.i64`), que são lidos com np.memmap. No backend flat a busca é feita
+    direto sobre esse memmap; nos outros o índice FAISS (`index.g.faiss`) é
+    aberto com IO_FLAG_MMAP, que mapeia as listas invertidas do IVF. O grafo
+    do HNSW não é mapeável e fica em memória privada de cada processo. Com SQ/PQ
+    só os códigos comprimidos ficam em memória; os vetores crus servem para
+    reordenar os candidatos pela distância exata.
+    """
+
+    def __init__(self, directory, generation, dimension):
+        self.generation = generation
+        self.dimension = dimension
+        if generation == 0:
+            self.ids = np.empty(0, dtype=np.int64)
+            self.vectors = np.empty((0, dimension), dtype=np.float32)
+        else:
+            self.ids = _memmap(os.path.join(directory, f"ids.{generation}.i64"), np.int64)
+            self.vectors = _memmap(
+                os.path.join(directory, f"vectors.{generation}.f32"), np.float32
+            ).reshape(-1, dimension)
+
+        index_path = os.path.join(directory, f"index.{generation}.faiss")
+        if generation and os.path.exists(index_path):
+            self.index = FaceIndex(
+                dimension=dimension,
+                index=faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY),
+            )
+        else:
+            self.index = MmapFlatIndex(self.ids, self.vectors)
+        # Gerações novas gravam os ids em ordem crescente (ver FaceStore.publish)
+        self._sorted = bool(np.all(self.ids[1:] >= self.ids[:-1]))
+
+    @property
+    def backend(self):
+        return self.index.backend
+
+    def items(self):
+        return self.ids, self.vectors
+
+    def search(self, queries, k=1, exclude=None):
+        if self.backend not in COMPRESSED_TYPES:
+            return self.index.search(queries, k, exclude=exclude)
+        # Índice comprimido só escolhe os candidatos; a ordem final vem dos float32 crus
+        _, candidates = self.index.search(queries, k * FACE_RERANK_FACTOR, exclude=exclude)
+        return exact_rerank(queries, candidates, self.ids, self.vectors, k)
+
+    def rows_between(self, lo, hi):
+        """Posições das linhas com lo <= id < hi (busca binária quando os ids estão ordenados)."""
+        if self._sorted:
+            start, end = np.searchsorted(self.ids, [lo, hi])
+            return np.arange(start, end)
+        return np.flatnonzero((self.ids >= lo) & (self.ids < hi))
+
+
+class FaceStore:
+    """Arquivos do índice facial em FACE_DATA_DIR, compartilhados entre processos.
+
+    Cada geração `g` é um snapshot imutável (ver Snapshot) mais um journal
+    (`journal.g.log`) com o que foi cadastrado/removido depois dele. O arquivo
+    CURRENT aponta para a geração vigente e só é trocado (atomicamente) depois
+    que o snapshot novo está inteiro em disco; uma queda durante a compactação
+    deixa a geração anterior + seu journal intactos. Escritas no journal e
+    publicação de gerações são serializadas entre processos por um flock.
+    """
+
+    def __init__(self, directory, dimension, fsync_every=16, fsync_interval=1.0):
+        self.directory = directory
+        self.dimension = dimension
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        os.makedirs(directory, exist_ok=True)
+        self._current_path = os.path.join(directory, "CURRENT")
+        self._lock_path = os.path.join(directory, "LOCK")
+        self._journals = {}
+
+    @contextmanager
+    def lock(self):
+        with open(self._lock_path, "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def current_generation(self):
+        try:
+            with open(self._current_path) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def current_stamp(self):
+        """Identifica a versão de CURRENT sem abrir o arquivo (os.replace troca o inode)."""
+        try:
+            st = os.stat(self._current_path)
+            return st.st_ino, st.st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def journal(self, generation):
+        if generation not in self._journals:
+            for old in list(self._journals):
+                self._journals.pop(old).close()
+            self._journals[generation] = EmbeddingJournal(
+                os.path.join(self.directory, f"journal.{generation}.log"),
+                self.dimension,
+                self.fsync_every,
+                self.fsync_interval,
+            )
+        return self._journals[generation]
+
+    def open_snapshot(self, generation):
+        return Snapshot(self.directory, generation, self.dimension)
+
+    def sync(self):
+        for journal in self._journals.values():
+            journal.sync()
+
+    def publish(self, face_index, items=None):
+        """Grava o índice como nova geração e aponta CURRENT para ela (com o lock).
+
+        `items` são os (ids, vetores) exatos; índices comprimidos (SQ/PQ) só
+        devolvem vetores aproximados, e o arquivo de vetores crus precisa ser exato.
+        """
+        generation = self.current_generation() + 1
+        ids, vectors = items if items is not None else face_index.items()
+        # Ids ordenados permitem buscar as linhas de um paciente sem varrer o arquivo
+        order = np.argsort(ids, kind="stable")
+        ids, vectors = np.asarray(ids)[order], np.asarray(vectors)[order]
+        path = lambda name: os.path.join(self.directory, name)
+
+        _atomic_write(path(f"ids.{generation}.i64"), lambda f: f.write(np.ascontiguousarray(ids, dtype=np.int64).tobytes()))
+        _atomic_write(path(f"vectors.{generation}.f32"), lambda f: f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes()))
+        if face_index.backend != "flat":
+            _atomic_write(path(f"index.{generation}.faiss"), lambda f: f.write(faiss.serialize_index(face_index.index).tobytes()))
+        _atomic_write(self._current_path, lambda f: f.write(str(generation).encode()))
+        _fsync_dir(self.directory)
+
+        # Mantém a geração anterior para leitores que ainda estão trocando de snapshot
+        self._remove_generation(generation - 2)
+        return generation
+
+    def _remove_generation(self, generation):
+        if generation < 0:
+            return
+        for name in (f"ids.{generation}.i64", f"vectors.{generation}.f32",
+                     f"index.{generation}.faiss", f"journal.{generation}.log"):
+            path = os.path.join(self.directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SharedFaceIndex:
+    """Visão de um processo sobre o índice compartilhado em FACE_DATA_DIR.
+
+    O snapshot da geração vigente é mapeado em memória (compartilhado entre
+    os workers); o que foi gravado no journal depois dele fica num índice
+    delta pequeno e privado, e os ids removidos/substituídos são ocultados do
+    snapshot na busca. Antes de cada operação o processo confere CURRENT e o
+    tamanho do journal: uma geração nova publicada por outro worker é trocada
+    atomicamente, sem reiniciar. `guard`, se dado, roda com o lock do store já
+    adquirido antes de cada escrita no journal; uma exceção dele cancela a escrita.
+    """
+
+    def __init__(self, store, kind=FACE_INDEX_TYPE, threshold=FACE_INDEX_TRAIN_THRESHOLD, guard=None):
+        self.store = store
+        self.dimension = store.dimension
+        self.kind = kind
+        self.threshold = threshold
+        self.guard = guard
+        self._lock = threading.RLock()
+        self._stamp = None
+        self.snapshot = None
+        self.delta = None
+        self.hidden = set()
+        self._offset = 0
+
+    @property
+    def generation(self):
+        return self.snapshot.generation if self.snapshot else 0
+
+    @property
+    def pending(self):
+        """Registros no journal desde o último snapshot."""
+        return self._offset // self.store.journal(self.generation).record_size
+
+    @property
+    def version(self):
+        """Muda a cada cadastro, remoção ou geração nova (útil para invalidar caches)."""
+        return self.generation, self._offset
+
+    def _new_delta(self):
+        return FaceIndex(dimension=self.dimension)
+
+    def refresh(self):
+        with self._lock:
+            stamp = self.store.current_stamp()
+            if self.snapshot is None or stamp != self._stamp:
+                for _ in range(3):
+                    generation = self.store.current_generation()
+                    try:
+                        snapshot = self.store.open_snapshot(generation)
+                        break
+                    except FileNotFoundError:
+                        # Geração trocada no meio da abertura: tenta de novo
+                        continue
+                else:
+                    raise RuntimeError("Não foi possível abrir o snapshot do índice facial")
+                self.snapshot, self._stamp = snapshot, stamp
+                self.delta, self.hidden, self._offset = self._new_delta(), set(), 0
+
+            records, self._offset = self.store.journal(self.generation).read_from(self._offset)
+            self._apply(records)
+
+    def _apply(self, records):
+        # Agrupa inserções consecutivas num único add
+        batch = {}
+        for op, db_id, embedding in records:
+            self.hidden.add(db_id)
+            if op == OP_ADD:
+                batch.pop(db_id, None)
+                batch[db_id] = embedding
+                continue
+            if batch:
+                self.delta.add(list(batch), np.stack(list(batch.values())))
+                batch = {}
+            self.delta.remove([db_id])
+        if batch:
+            self.delta.add(list(batch), np.stack(list(batch.values())))
+
+    def _write(self, op, db_id, embedding):
+        with self._lock, self.store.lock():
+            if self.guard is not None:
+                self.guard()
+            self.refresh()
+            journal = self.store.journal(self.generation)
+            journal.truncate(self._offset)  # cauda de uma escrita interrompida
+            journal.append(op, db_id, embedding)
+            self.refresh()
+
+    def add(self, db_id, embedding):
+        self._write(OP_ADD, db_id, embedding)
+
+    def remove(self, db_id):
+        existed = self.contains(db_id)
+        self._write(OP_REMOVE, db_id, np.zeros(self.dimension, dtype=np.float32))
+        return existed
+
+    def contains(self, db_id):
+        with self._lock:
+            self.refresh()
+            if db_id in self.hidden:
+                return db_id in set(self.delta.items()[0].tolist())
+            return bool(np.any(np.asarray(self.snapshot.ids) == db_id))
+
+    def search(self, queries, k=1):
+        with self._lock:
+            self.refresh()
+            results = [self.snapshot.search(queries, k, exclude=self.hidden)]
+            if self.delta.ntotal:
+                results.append(self.delta.search(queries, k))
+            return merge_results(results, k)
+
+    def items(self):
+        """(ids, vetores) de todos os pacientes vivos: snapshot menos ocultos, mais o delta."""
+        with self._lock:
+            self.refresh()
+            ids, vectors = self.snapshot.items()
+            if self.hidden:
+                keep = ~np.isin(ids, np.fromiter(self.hidden, dtype=np.int64))
+                ids, vectors = ids[keep], vectors[keep]
+            delta_ids, delta_vectors = self.delta.items()
+            return (
+                np.concatenate([np.asarray(ids), delta_ids]),
+                np.concatenate([np.asarray(vectors), delta_vectors]),
+            )
+
+    def vectors_between(self, lo, hi):
+        """(ids, vetores) vivos com lo <= id < hi, sem reconstruir o índice inteiro."""
+        with self._lock:
+            self.refresh()
+            rows = self.snapshot.rows_between(lo, hi)
+            ids = np.asarray(self.snapshot.ids[rows])
+            vectors = np.asarray(self.snapshot.vectors[rows])
+            if self.hidden and len(ids):
+                keep = ~np.isin(ids, np.fromiter(self.hidden, dtype=np.int64))
+                ids, vectors = ids[keep], vectors[keep]
+            if self.delta.ntotal:
+                delta_ids, delta_vectors = self.delta.items()
+                keep = (delta_ids >= lo) & (delta_ids < hi)
+                ids = np.concatenate([ids, delta_ids[keep]])
+                vectors = np.concatenate([vectors, delta_vectors[keep]])
+            return ids, vectors
+
+    def needs_rebuild(self):
+        """A configuração (FACE_INDEX_TYPE/limiar) pede outro backend para o snapshot atual."""
+        with self._lock:
+            self.refresh()
+            n = self.snapshot.index.ntotal
+            return target_kind(self.kind, self.threshold, n, self.snapshot.backend) != self.snapshot.backend
+
+    def _publish(self, ids, vectors):
+        # Chamar com os dois locks: monta o índice inteiro uma vez e publica uma geração nova
+        kind = target_kind(self.kind, self.threshold, len(ids), self.snapshot.backend)
+        merged = FaceIndex(dimension=self.dimension, index=build_index(kind, vectors, ids, self.dimension))
+        self.store.publish(merged, items=(ids, vectors))
+        self.refresh()
+
+    def compact(self):
+        """Consolida snapshot + journal numa geração nova e a publica para todos os workers."""
+        with self._lock, self.store.lock():
+            self.refresh()
+            self._publish(*self.items())
+
+    def add_many(self, ids, vectors):
+        """Cadastro em massa: um único build e uma única publicação, sem um registro de journal por id."""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        with self._lock, self.store.lock():
+            self.refresh()
+            current_ids, current_vectors = self.items()
+            keep = ~np.isin(current_ids, ids)
+            self._publish(
+                np.concatenate([current_ids[keep], ids]),
+                np.concatenate([current_vectors[keep], vectors]),
+            )
+
+
+def shard_directories(directory, shards):
+    """Diretório de cada shard; com um shard só, o próprio `directory` (layout sem shards)."""
+    if shards <= 1:
+        return [directory]
+    return [os.path.join(directory, f"shard-{i}") for i in range(shards)]
+
+
+def shard_of(ids, shards):
+    """Shard de cada idPaciente (hash simples: resto da divisão)."""
+    return np.asarray(ids, dtype=np.int64) % shards
+
+
+class ShardedFaceIndex:
+    """Índice de pacientes dividido em shards independentes (idPaciente % N).
+
+    Cada shard é um SharedFaceIndex com o seu FaceStore: snapshot, journal,
+    lock e compactação próprios, então cadastrar num shard não espera a
+    reconstrução de outro. A busca pode mirar shards específicos ou consultar
+    todos em paralelo numa pool de threads (o FAISS e o numpy soltam o GIL) e
+    juntar os top-k. Com um shard só tudo passa direto para ele.
+    """
+
+    def __init__(self, stores, kind=FACE_INDEX_TYPE, threshold=FACE_INDEX_TRAIN_THRESHOLD, workers=0, guard=None):
+        self.shards = [SharedFaceIndex(store, kind=kind, threshold=threshold, guard=guard) for store in stores]
+        self.dimension = self.shards[0].dimension
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or len(self.shards), thread_name_prefix="face-shard",
+        ) if len(self.shards) > 1 else None
+
+    def shard(self, db_id):
+        return self.shards[int(db_id) % len(self.shards)]
+
+    @property
+    def generation(self):
+        return tuple(shard.generation for shard in self.shards)
+
+    @property
+    def pending(self):
+        return [shard.pending for shard in self.shards]
+
+    @property
+    def version(self):
+        return tuple(shard.version for shard in self.shards)
+
+    def _map(self, function, shards):
+        executor = self._executor
+        if executor is not None and len(shards) > 1:
+            try:
+                futures = [executor.submit(function, shard) for shard in shards]
+            except RuntimeError:
+                futures = None  # pool já fechada (motor substituído): segue sem paralelismo
+            if futures is not None:
+                return [future.result() for future in futures]
+        return [function(shard) for shard in shards]
+
+    def close(self):
+        """Solta as threads da busca paralela; chamadas depois disso rodam shard a shard."""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def refresh(self):
+        self._map(lambda shard: shard.refresh(), self.shards)
+
+    def sync(self):
+        for shard in self.shards:
+            shard.store.sync()
+
+    def add(self, db_id, embedding):
+        self.shard(db_id).add(db_id, embedding)
+
+    def remove(self, db_id):
+        return self.shard(db_id).remove(db_id)
+
+    def contains(self, db_id):
+        return self.shard(db_id).contains(db_id)
+
+    def search(self, queries, k=1, shards=None):
+        """Top-k dos shards pedidos (todos por padrão), consultados em paralelo."""
+        targets = self.shards if shards is None else [self.shards[i] for i in shards]
+        return merge_results(self._map(lambda shard: shard.search(queries, k), targets), k)
+
+    def items(self):
+        parts = self._map(lambda shard: shard.items(), self.shards)
+        return np.concatenate([ids for ids, _ in parts]), np.concatenate([vectors for _, vectors in parts])
+
+    def vectors_between(self, lo, hi):
+        if hi - lo == 1:
+            return self.shard(lo).vectors_between(lo, hi)
+        parts = [shard.vectors_between(lo, hi) for shard in self.shards]
+        return np.concatenate([ids for ids, _ in parts]), np.concatenate([vectors for _, vectors in parts])
+
+    def needs_rebuild(self):
+        return [shard for shard in self.shards if shard.needs_rebuild()]
+
+    def compact(self, min_pending=0):
+        """Compacta (em paralelo) os shards com pelo menos `min_pending` registros no journal."""
+        targets = [shard for shard in self.shards if shard.pending >= min_pending]
+        self._map(lambda shard: shard.compact(), targets)
+        return len(targets)
+
+    def add_many(self, ids, vectors):
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        owners = shard_of(ids, len(self.shards))
+        targets = [i for i in range(len(self.shards)) if np.any(owners == i)]
+        self._map(
+            lambda i: self.shards[i].add_many(ids[owners == i], vectors[owners == i]),
+            targets,
+        )
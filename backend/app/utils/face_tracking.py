@@ -0,0 +1,165 @@
+import itertools
+import time
+
+import cv2
+import numpy as np
+
+from app.config import (
+    FACE_TRACK_IOU,
+    FACE_TRACK_MIN_GAIN,
+    FACE_TRACK_RETRY,
+    FACE_TRACK_SHARPNESS,
+    FACE_TRACK_TTL,
+)
+
+
+def iou(a, b):
+    """Interseção sobre união de duas caixas [x1, y1, x2, y2]."""
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return float(inter / union) if union > 0 else 0.0
+
+
+def sharpness(data, box):
+    """Variância do Laplaciano do rosto (caixa nas coordenadas da imagem) em 112x112; None se não der."""
+    if isinstance(data, np.ndarray) and data.ndim >= 2:
+        img = cv2.cvtColor(data, cv2.COLOR_BGR2GRAY) if data.ndim == 3 else data
+    else:
+        img = cv2.imdecode(np.frombuffer(memoryview(data), dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    h, w = img.shape[:2]
+    x1, y1, x2, y2 = (int(round(float(v))) for v in box[:4])
+    region = img[max(y1, 0):min(y2, h), max(x1, 0):min(x2, w)]
+    if region.size == 0:
+        return None
+    return float(cv2.Laplacian(cv2.resize(region, (112, 112)), cv2.CV_64F).var())
+
+
+def face_quality(box, kps=None, sharp=None, sharp_ref=FACE_TRACK_SHARPNESS):
+    """Qualidade barata do rosto: lado menor da caixa x frontalidade (5 pontos) x nitidez.
+
+    A nitidez entra como fração de `sharp_ref` (saturada em 1): um frame
+    tremido do mesmo rosto vale menos que um parado.
+    """
+    quality = float(min(box[2] - box[0], box[3] - box[1]))
+    if kps is not None:
+        eyes = (kps[0] + kps[1]) / 2
+        eye_distance = np.linalg.norm(kps[1] - kps[0])
+        if eye_distance <= 0:
+            return 0.0
+        yaw = abs(kps[2][0] - eyes[0]) / eye_distance
+        quality *= max(0.0, 1.0 - float(yaw))
+    if sharp is not None and sharp_ref > 0:
+        quality *= min(1.0, sharp / sharp_ref)
+    return quality
+
+
+def _landmarks_close(a, b):
+    # Centro dos olhos andou menos de meia distância interocular entre os frames
+    eye_distance = np.linalg.norm(a[1] - a[0])
+    return eye_distance > 0 and np.linalg.norm((a[0] + a[1]) / 2 - (b[0] + b[1]) / 2) < eye_distance / 2
+
+
+class Track:
+    def __init__(self, track_id, box, kps, now):
+        self.id = track_id
+        self.box = box
+        self.kps = kps
+        self.last_seen = now
+        self.last_processed = None
+        self.best_quality = 0.0
+        self.quality = 0.0
+        self.status = None
+
+
+class FaceTracker:
+    """Trilhas dos rostos de uma sessão contínua e quando vale gerar o embedding.
+
+    O rosto de um frame continua na trilha cuja última caixa tem IoU >=
+    `iou_threshold` com a dele (ou, com landmarks, cujo centro dos olhos
+    andou pouco). Embedding e busca no índice só rodam para uma trilha nova,
+    quando a qualidade do rosto (tamanho x frontalidade x nitidez) supera em
+    `min_gain` a do último frame processado, ou, para trilha ainda não
+    reconhecida, `retry` segundos depois da última tentativa; trilha já
+    reconhecida não é reprocessada. Só o frame com desfecho gravado em
+    `record` conta como tentativa. Trilhas sem rosto por `ttl` segundos são
+    descartadas.
+    """
+
+    def __init__(self, iou_threshold=FACE_TRACK_IOU, ttl=FACE_TRACK_TTL, min_gain=FACE_TRACK_MIN_GAIN,
+                 retry=FACE_TRACK_RETRY):
+        self.iou_threshold = iou_threshold
+        self.ttl = ttl
+        self.min_gain = min_gain
+        self.retry = retry
+        self.tracks = {}
+        self._ids = itertools.count(1)
+        self.frames = 0
+        self.embeddings = 0
+
+    def _match(self, box, kps):
+        best, best_score = None, self.iou_threshold
+        for track in self.tracks.values():
+            score = iou(track.box, box)
+            if score < self.iou_threshold and kps is not None and track.kps is not None:
+                if _landmarks_close(track.kps, kps):
+                    score = self.iou_threshold
+            if score >= best_score:
+                best, best_score = track, score
+        return best
+
+    def observe(self, box, kps=None, now=None, sharp=None):
+        """(trilha, processar): a trilha do rosto deste frame e se ele vai para o embedding.
+
+        sharp: nitidez do rosto neste frame (ver `sharpness`), se já calculada.
+        """
+        now = time.monotonic() if now is None else now
+        self.frames += 1
+        self.tracks = {i: t for i, t in self.tracks.items() if now - t.last_seen <= self.ttl}
+
+        box = np.asarray(box, dtype=np.float32)[:4]
+        kps = None if kps is None else np.asarray(kps, dtype=np.float32).reshape(5, 2)
+        track = self._match(box, kps)
+        if track is None:
+            track = Track(next(self._ids), box, kps, now)
+            self.tracks[track.id] = track
+        else:
+            track.box, track.kps, track.last_seen = box, kps, now
+
+        quality = track.quality = face_quality(box, kps, sharp)
+        if track.status is None:
+            process = True
+        elif track.status == "reconhecido":
+            process = False
+        else:
+            process = (
+                quality > track.best_quality * (1 + self.min_gain)
+                or now - track.last_processed >= self.retry
+            )
+        return track, process
+
+    def record(self, track, status):
+        """Guarda o desfecho do embedding da trilha ("reconhecido", "ambiguo", "erro"...).
+
+        O último frame observado da trilha passa a ser a tentativa: qualidade a
+        superar e início da espera de `retry`.
+        """
+        track.status = status
+        track.best_quality = max(track.quality, track.best_quality)
+        track.last_processed = track.last_seen
+        self.embeddings += 1
+
+    def reset(self):
+        self.tracks.clear()
+
+    def metrics(self):
+        return {
+            "frames": self.frames,
+            "embeddings": self.embeddings,
+            "trilhas_ativas": len(self.tracks),
+        }
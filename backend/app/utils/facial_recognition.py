@@ -1,62 +1,691 @@
-import faiss
-import numpy as np
+import atexit
+import json
 import os
 import pickle
-import insightface
-import cv2  
+import threading
+import time
+
+import numpy as np
+
+from app.config import (
+    FACE_DATA_DIR,
+    FACE_JOURNAL_FSYNC_EVERY,
+    FACE_JOURNAL_FSYNC_INTERVAL,
+    FACE_SNAPSHOT_EVERY,
+    FACE_SHARDS,
+    FACE_SHARD_WORKERS,
+    FACE_BATCH_WINDOW_MS,
+    FACE_BATCH_MAX_SIZE,
+    FACE_POOL_SIZE,
+    FACE_POOL_INTRA_OP_THREADS,
+    FACE_POOL_INTER_OP_THREADS,
+    FACE_CACHE_SIZE,
+    FACE_CACHE_TTL,
+    FACE_CACHE_DHASH_BITS,
+    FACE_MAX_TEMPLATES,
+    FACE_TEMPLATE_CANDIDATES,
+    FACE_TOP_K,
+    FACE_MAX_TOP_K,
+    FACE_MIN_SIMILARITY,
+    FACE_MIN_MARGIN,
+    FACE_CANDIDATE_MIN_SIMILARITY,
+    FACE_CALIBRATION_SAMPLE,
+    FACE_CALIBRATION_TTL,
+    FACE_DUPLICATE_SIMILARITY,
+    FACE_PROFILE,
+    FACE_EMBEDDING_MODEL,
+    FACE_EMBEDDING_VERSION,
+    FACE_MAX_CONCURRENT,
+    FACE_MAX_QUEUE,
+)
+from app.utils.face_admission import AdmissionGate
+from app.utils.face_batching import InferenceScheduler
+from app.utils.face_calibration import ConfidenceCalibrator, similarity_from_distance
+from app.utils.face_metadata import PatientMetadata
 
+# Arquivos do formato antigo (índice inteiro regravado a cada cadastro).
+# Só são lidos uma vez, para migrar para o snapshot + journal em FACE_DATA_DIR.
 FAISS_INDEX_FILE = "faiss_index.bin"
 ID_MAP_FILE = "id_map.pkl"
 
-model = insightface.app.FaceAnalysis(name='buffalo_l')
-model.prepare(ctx_id=0, det_size=(640, 640))
-
-# FAISS index para embeddings 512D
 dimension = 512
-index = faiss.IndexFlatL2(dimension)
-id_map = []
-
-def _load_index():
-    global index, id_map
-    if os.path.exists(FAISS_INDEX_FILE):
-        index = faiss.read_index(FAISS_INDEX_FILE)
-    if os.path.exists(ID_MAP_FILE):
-        with open(ID_MAP_FILE, "rb") as f:
-            id_map[:] = pickle.load(f)
-
-def _save_index():
-    faiss.write_index(index, FAISS_INDEX_FILE)
-    with open(ID_MAP_FILE, "wb") as f:
-        pickle.dump(id_map, f)
-
-def _extract_embedding(image_path: str):
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"Não foi possível carregar a imagem: {image_path}")
-    
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    
-    faces = model.get(img_rgb)
-    if not faces:
-        raise ValueError("Nenhum rosto detectado")
-    
-    embedding = faces[0].embedding.astype(np.float32)
-    embedding /= np.linalg.norm(embedding)  
-    return np.array([embedding], dtype=np.float32)
-
-def register_face(image_path: str, db_id: int):
-    embedding = _extract_embedding(image_path)
-    index.add(embedding)
-    id_map.append(db_id)
-    _save_index()
-
-def recognize_face(image_path: str, threshold=1.0):
-    embedding = _extract_embedding(image_path)
-    distances, indices = index.search(embedding, 1)
-
-    if distances[0][0] <= threshold and indices[0][0] < len(id_map):
-        return id_map[indices[0][0]], float(distances[0][0])
-
-    return None, None
-
-_load_index()
\ No newline at end of file
+# Id de cada template: idPaciente * TEMPLATE_SLOTS + posição (0..TEMPLATE_SLOTS-1)
+TEMPLATE_SLOTS = 16
+
+# Gravado pela migração de modelo (flask face migrar): qual modelo está em uso e
+# em que subdiretório de FACE_DATA_DIR está o índice gerado com ele. Trocar este
+# arquivo troca modelo e índice juntos, de uma vez, em todos os workers.
+ACTIVE_MODEL_FILE = os.path.join(FACE_DATA_DIR, "ATIVO")
+
+
+def active_model():
+    """{"perfil", "pack", "versao", "diretorio"} do modelo em uso (ATIVO ou a configuração)."""
+    try:
+        with open(ACTIVE_MODEL_FILE) as f:
+            active = json.load(f)
+    except FileNotFoundError:
+        active = {"perfil": FACE_PROFILE, "pack": FACE_EMBEDDING_MODEL, "versao": FACE_EMBEDDING_VERSION, "diretorio": ""}
+    active["diretorio"] = os.path.join(FACE_DATA_DIR, active["diretorio"])
+    return active
+
+
+# Resumo de cada paciente (nome, status, nascimento, foto) ao lado do índice; não
+# depende do modelo, então fica na raiz de FACE_DATA_DIR mesmo depois de uma migração
+# Tabela lateral; o formato anterior (metadados.bin, com a foto) é ignorado e
+# `flask face reconstruir` preenche esta de uma vez
+METADATA_FILE = os.path.join(FACE_DATA_DIR, "resumos.bin")
+_metadata = None
+
+
+def patient_metadata():
+    """Tabela lateral de resumos dos pacientes (aberta sem carregar o modelo)."""
+    global _metadata
+    if _metadata is None:
+        _metadata = PatientMetadata(METADATA_FILE)
+    return _metadata
+
+
+def _active_stamp():
+    try:
+        st = os.stat(ACTIVE_MODEL_FILE)
+        return st.st_ino, st.st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class DuplicateFaceError(ValueError):
+    """O rosto enviado no cadastro já pertence (provavelmente) a outro paciente."""
+
+    def __init__(self, candidates):
+        super().__init__("Rosto já cadastrado para outro paciente")
+        self.candidates = candidates
+
+
+class StaleEngineError(RuntimeError):
+    """O modelo ativo mudou (migração) e a escrita no índice antigo foi recusada."""
+
+
+# Vagas da busca e do cadastro no processo (0 = um lote cheio por processo de inferência)
+_gate = AdmissionGate(FACE_MAX_CONCURRENT or FACE_BATCH_MAX_SIZE * max(1, FACE_POOL_SIZE), FACE_MAX_QUEUE)
+
+
+class FaceEngine:
+    """Modelo (ou pool de inferência) + índice de embeddings do processo.
+
+    Nada disso é carregado no import do módulo: importar as rotas custa
+    milissegundos e o InsightFace/FAISS só sobem em get_engine(), no primeiro
+    uso ou na thread de aquecimento (start_warmup).
+    """
+
+    def __init__(self):
+        # Imports pesados (onnxruntime, insightface, faiss) só quando o motor sobe
+        from app.utils.face_cache import RecognitionCache
+        from app.utils.face_model import build_model, model_profile, warm_up
+        from app.utils.face_pool import InferencePool
+        from app.utils.face_store import FaceStore, SharedFaceIndex, ShardedFaceIndex, shard_directories
+
+        self.active_stamp = _active_stamp()
+        self.active = active_model()
+        data_dir = self.active["diretorio"]
+
+        # Com FACE_POOL_SIZE > 0 a inferência roda em processos separados, cada um com
+        # o seu modelo; o processo web nem chega a carregar o InsightFace
+        self.pool = InferencePool(
+            FACE_POOL_SIZE,
+            intra_op_threads=FACE_POOL_INTRA_OP_THREADS,
+            inter_op_threads=FACE_POOL_INTER_OP_THREADS,
+            profile=self.active["perfil"],
+            overrides={"pack": self.active["pack"]},
+        ) if FACE_POOL_SIZE > 0 else None
+        if self.pool is not None:
+            self.model = None
+            self.pool.warm_up()
+        else:
+            self.model = build_model(model_profile(self.active["perfil"], pack=self.active["pack"]))
+            warm_up(self.model)
+
+        # Índice de embeddings 512D endereçado por idPaciente (backend escolhido por
+        # FACE_INDEX_TYPE), compartilhado entre os workers via snapshot mapeado em memória
+        # e dividido em FACE_SHARDS shards independentes
+        self.data_dir = data_dir
+        self.stores = [
+            FaceStore(
+                directory,
+                dimension,
+                fsync_every=FACE_JOURNAL_FSYNC_EVERY,
+                fsync_interval=FACE_JOURNAL_FSYNC_INTERVAL,
+            )
+            for directory in shard_directories(data_dir, FACE_SHARDS)
+        ]
+        self.index = ShardedFaceIndex(self.stores, workers=FACE_SHARD_WORKERS, guard=self._check_active)
+        # Templates de cada paciente (vários embeddings ao longo do tempo); o índice
+        # principal guarda só o centróide deles, usado na primeira etapa da busca
+        self.template_store = FaceStore(
+            os.path.join(data_dir, "templates"),
+            dimension,
+            fsync_every=FACE_JOURNAL_FSYNC_EVERY,
+            fsync_interval=FACE_JOURNAL_FSYNC_INTERVAL,
+        )
+        self.templates = SharedFaceIndex(self.template_store, kind="flat", guard=self._check_active)
+        self._load_index()
+        atexit.register(self.index.sync)
+        atexit.register(self.template_store.sync)
+
+        # Frames repetidos do quiosque não passam de novo pelo modelo
+        self.cache = RecognitionCache(
+            FACE_CACHE_SIZE,
+            ttl=FACE_CACHE_TTL,
+            dhash_bits=FACE_CACHE_DHASH_BITS,
+        ) if FACE_CACHE_SIZE > 0 else None
+
+        # Curva padrão até o primeiro ajuste terminar (ver calibration)
+        self._calibrator = ConfidenceCalibrator(center=FACE_MIN_SIMILARITY)
+        self._calibration_key = None
+        self._calibration_thread = None
+        self._calibration_lock = threading.Lock()
+
+        self.scheduler = InferenceScheduler(
+            _recognize_batch,
+            window_ms=FACE_BATCH_WINDOW_MS,
+            max_batch=FACE_BATCH_MAX_SIZE,
+            workers=FACE_POOL_SIZE or 1,
+        )
+
+    def close(self):
+        # Motor substituído por outro modelo (migração): grava o journal, encerra as
+        # threads de micro-lote e da busca por shard e solta o pool
+        self.index.sync()
+        self.template_store.sync()
+        self.scheduler.close()
+        self.index.close()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=False)  # o que já foi enviado termina
+
+    def _check_active(self):
+        # Roda com o lock do store: a migração grava o ATIVO segurando os locks do índice
+        # antigo, então um cadastro que esperava o lock durante a troca não grava nele
+        if _active_stamp() != self.active_stamp:
+            raise StaleEngineError("O modelo ativo mudou durante o cadastro")
+
+    def _publish_split(self, ids, vectors):
+        from app.utils.face_index import FaceIndex, build_index
+        from app.utils.face_store import shard_of
+
+        # Cada shard recebe os seus pacientes; shard já publicado (outro worker) fica como está
+        owners = shard_of(ids, len(self.stores))
+        for i, store in enumerate(self.stores):
+            with store.lock():
+                if store.current_generation() != 0:
+                    continue
+                rows = owners == i
+                store.publish(FaceIndex(dimension=dimension, index=build_index("flat", vectors[rows], ids[rows], dimension)))
+
+    def _migrate_legacy_index(self):
+        import faiss
+        from app.utils.face_index import positional_to_ids
+
+        # Formato antigo: índice posicional + lista id_map (uma linha por foto)
+        legacy = faiss.read_index(FAISS_INDEX_FILE)
+        id_map = []
+        if os.path.exists(ID_MAP_FILE):
+            with open(ID_MAP_FILE, "rb") as f:
+                id_map = pickle.load(f)
+        ids, vectors = positional_to_ids(legacy, id_map)
+        self._publish_split(np.asarray(ids, dtype=np.int64), np.asarray(vectors, dtype=np.float32))
+
+    def _migrate_unsharded_index(self):
+        from app.utils.face_store import FaceStore, SharedFaceIndex
+
+        # FACE_SHARDS passou de 1 para N: o índice único em data_dir é dividido entre os shards
+        unsharded = SharedFaceIndex(FaceStore(self.data_dir, dimension), kind="flat")
+        ids, vectors = unsharded.items()
+        self._publish_split(np.asarray(ids), np.asarray(vectors))
+
+    def _load_index(self):
+        if all(store.current_generation() == 0 for store in self.stores):
+            if os.path.exists(FAISS_INDEX_FILE):
+                self._migrate_legacy_index()
+            elif len(self.stores) > 1 and os.path.exists(os.path.join(self.data_dir, "CURRENT")):
+                self._migrate_unsharded_index()
+
+        # Abre o snapshot vigente de cada shard e reaplica o journal por cima dele
+        self.index.refresh()
+        self.templates.refresh()
+
+        # A configuração pode ter mudado desde a última publicação
+        for shard in self.index.needs_rebuild():
+            shard.compact()
+
+    def maybe_compact(self):
+        # Só os shards com journal grande: um shard cheio não atrasa os cadastros dos outros
+        self.index.compact(min_pending=FACE_SNAPSHOT_EVERY)
+        if self.templates.pending >= FACE_SNAPSHOT_EVERY:
+            self.templates.compact()
+
+    def patient_templates(self, db_id):
+        """(ids, vetores) dos templates do paciente."""
+        return self.templates.vectors_between(db_id * TEMPLATE_SLOTS, (db_id + 1) * TEMPLATE_SLOTS)
+
+    def add_template(self, db_id, embedding):
+        """Acrescenta um template ao paciente e atualiza o centróide no índice principal.
+
+        Com o conjunto cheio (FACE_MAX_TEMPLATES) o novo embedding substitui o
+        template mais parecido com ele, o que mantém as fotos mais diversas.
+        """
+        ids, templates = self.patient_templates(db_id)
+        if not len(ids):
+            # Paciente cadastrado antes dos templates: o vetor único vira o primeiro template
+            _, legacy = self.index.vectors_between(db_id, db_id + 1)
+            if len(legacy):
+                ids = np.array([db_id * TEMPLATE_SLOTS], dtype=np.int64)
+                templates = legacy[:1]
+                self.templates.add(int(ids[0]), templates[0])
+
+        if len(ids) < FACE_MAX_TEMPLATES:
+            used = set((ids - db_id * TEMPLATE_SLOTS).tolist())
+            slot = next(i for i in range(TEMPLATE_SLOTS) if i not in used)
+            template_id = db_id * TEMPLATE_SLOTS + slot
+            templates = np.vstack([templates, embedding[None, :]])
+        else:
+            replaced = int(np.argmax(templates @ embedding))
+            template_id = int(ids[replaced])
+            templates = templates.copy()
+            templates[replaced] = embedding
+
+        # Write-ahead: o registro vai para o journal compartilhado antes de entrar no índice
+        self.templates.add(template_id, embedding)
+        centroid = templates.mean(axis=0)
+        self.index.add(db_id, centroid / np.linalg.norm(centroid))
+        return template_id
+
+    def restore_template(self, db_id, slot, embedding=None):
+        """Volta o slot do paciente ao template dado (None = vazio) e refaz o centróide."""
+        template_id = db_id * TEMPLATE_SLOTS + slot
+        if embedding is None:
+            self.templates.remove(template_id)
+        else:
+            self.templates.add(template_id, embedding)
+        _, templates = self.patient_templates(db_id)
+        if len(templates):
+            centroid = templates.mean(axis=0)
+            self.index.add(db_id, centroid / np.linalg.norm(centroid))
+        else:
+            self.index.remove(db_id)
+
+    def remove_patient(self, db_id):
+        ids, _ = self.patient_templates(db_id)
+        for template_id in ids.tolist():
+            self.templates.remove(template_id)
+        return self.index.remove(db_id)
+
+    def search(self, queries, k=1, shards=None):
+        """Top-k (distâncias, ids) por consulta: centróides primeiro, templates só dos candidatos.
+
+        `shards` restringe a busca a alguns shards do índice (padrão: todos, em paralelo).
+        """
+        pool = max(FACE_TEMPLATE_CANDIDATES, k)
+        distances, ids = self.index.search(queries, pool, shards=shards)
+        if FACE_TEMPLATE_CANDIDATES > 1:
+            distances = distances.copy()
+            templates_of = {}
+            for row, query in enumerate(queries):
+                for col, db_id in enumerate(ids[row]):
+                    if db_id < 0:
+                        continue
+                    if db_id not in templates_of:
+                        templates_of[db_id] = self.patient_templates(int(db_id))[1]
+                    templates = templates_of[db_id]
+                    if len(templates):
+                        # L2 ao quadrado entre vetores normalizados, na mesma escala do índice
+                        distances[row, col] = max(float(np.min(2 - 2 * templates @ query)), 0.0)
+
+        distances = np.where(ids < 0, np.inf, distances)
+        order = np.argsort(distances, axis=1)[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    def calibration(self):
+        """Calibrador de confiança vigente; o reajuste roda numa thread, fora da busca.
+
+        Geração nova do índice ou FACE_CALIBRATION_TTL vencido disparam um
+        ajuste em segundo plano; até ele terminar as buscas seguem com o
+        calibrador anterior, trocado inteiro quando o novo fica pronto.
+        """
+        period = int(time.monotonic() // FACE_CALIBRATION_TTL) if FACE_CALIBRATION_TTL > 0 else 0
+        key = (self.index.generation, period)
+        if key != self._calibration_key:
+            with self._calibration_lock:
+                if key != self._calibration_key and self._calibration_thread is None:
+                    self._calibration_thread = threading.Thread(
+                        target=self._refit_calibration, args=(key,), name="face-calibration", daemon=True
+                    )
+                    self._calibration_thread.start()
+        return self._calibrator
+
+    def _refit_calibration(self, key):
+        calibrator = None
+        try:
+            genuine, impostor = self._calibration_scores()
+            calibrator = ConfidenceCalibrator.fit(genuine, impostor, center=FACE_MIN_SIMILARITY)
+        except Exception as e:
+            # Falha não repete a cada busca: a próxima tentativa é na próxima chave
+            print("Erro ao calibrar a confiança do reconhecimento facial:", str(e))
+        with self._calibration_lock:
+            if calibrator is not None:
+                self._calibrator = calibrator
+            self._calibration_key = key
+            self._calibration_thread = None
+
+    def _calibration_scores(self):
+        # Genuínos: cada template contra os demais do mesmo paciente (como numa busca real).
+        # Impostores: um template de cada paciente contra o melhor candidato de outro paciente.
+        # Snapshot e journal: pacientes cadastrados desde a última compactação também
+        # entram (removidos caem fora abaixo, sem templates vivos)
+        template_ids = np.union1d(np.asarray(self.templates.snapshot.ids), self.templates.delta.items()[0])
+        patients = np.unique(template_ids // TEMPLATE_SLOTS)
+        if len(patients) > FACE_CALIBRATION_SAMPLE:
+            patients = np.random.default_rng(0).choice(patients, FACE_CALIBRATION_SAMPLE, replace=False)
+
+        genuine, queries, owners = [], [], []
+        for db_id in patients.tolist():
+            _, templates = self.patient_templates(db_id)
+            if not len(templates):
+                continue
+            for i in range(len(templates)):
+                others = np.delete(templates, i, axis=0)
+                if len(others):
+                    genuine.append(float(np.max(others @ templates[i])))
+            queries.append(templates[0])
+            owners.append(db_id)
+
+        impostor = []
+        if queries:
+            distances, ids = self.search(np.stack(queries), k=2)
+            for row, owner in enumerate(owners):
+                for distance, db_id in zip(distances[row], ids[row]):
+                    if db_id >= 0 and db_id != owner:
+                        impostor.append(float(similarity_from_distance(distance)))
+                        break
+        return genuine, impostor
+
+    def embed(self, images, hints=None):
+        # Um embedding (ou exceção) por imagem, no pool de processos ou aqui mesmo
+        if self.pool is not None:
+            return self.pool.embed_images(images, hints)
+        from app.utils.face_model import embed_images
+        return embed_images(self.model, images, hints)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+_warmup_thread = None
+_load_error = None
+_load_seconds = None
+
+
+def get_engine():
+    """Motor de reconhecimento facial do processo, carregado no primeiro uso.
+
+    Se a migração de modelo trocou o arquivo ATIVO, o motor é recarregado com o
+    modelo e o índice novos; requisições em andamento terminam no motor antigo.
+    """
+    global _engine, _load_error, _load_seconds
+    if _engine is None or _engine.active_stamp != _active_stamp():
+        with _engine_lock:
+            if _engine is None or _engine.active_stamp != _active_stamp():
+                previous = _engine
+                start = time.perf_counter()
+                try:
+                    _engine = FaceEngine()
+                except Exception as e:
+                    # Não fica em cache: a próxima chamada tenta carregar de novo
+                    _load_error = e
+                    raise
+                _load_error = None
+                _load_seconds = time.perf_counter() - start
+                if previous is not None:
+                    previous.close()
+    return _engine
+
+
+def _warm_up():
+    try:
+        get_engine()
+    except Exception as e:
+        print(f"Erro ao carregar o reconhecimento facial: {e}")
+
+
+def start_warmup():
+    """Carrega o motor numa thread de fundo; as rotas já respondem enquanto isso."""
+    global _warmup_thread
+    with _engine_lock:
+        if _warmup_thread is None and _engine is None:
+            _warmup_thread = threading.Thread(target=_warm_up, name="face-warmup", daemon=True)
+            _warmup_thread.start()
+    return _warmup_thread
+
+
+def status():
+    if _engine is not None:
+        estado = "pronto"
+    elif _engine_lock.locked():
+        estado = "carregando"
+    elif _load_error is not None:
+        estado = "erro"
+    else:
+        estado = "frio"
+
+    result = {"pronto": _engine is not None, "estado": estado}
+    if _engine is not None:
+        result["modelo"] = f"{_engine.active['pack']} v{_engine.active['versao']}"
+    if _load_seconds is not None:
+        result["tempo_carga_s"] = round(_load_seconds, 3)
+    if estado == "erro":
+        result["erro"] = str(_load_error)
+    return result
+
+
+def _extract_embedding(image):
+    embedding = get_engine().embed([image])[0]
+    if isinstance(embedding, Exception):
+        raise embedding
+    return embedding[None, :]
+
+
+def _decide(distances, ids, k, calibrator):
+    """Lista de candidatos e decisão: reconhecido, ambíguo (margem pequena) ou não encontrado."""
+    valid = ids >= 0
+    similarities = similarity_from_distance(distances[valid])
+    confidences = calibrator(similarities)
+    candidates = [
+        {"idPaciente": int(db_id), "similaridade": round(float(sim), 4), "confianca": round(float(conf), 4)}
+        for db_id, sim, conf in zip(ids[valid], similarities, confidences)
+    ]
+
+    best = candidates[0] if candidates else None
+    # Sem segundo candidato a margem é medida contra o limiar de aceitação
+    second = candidates[1]["similaridade"] if len(candidates) > 1 else FACE_MIN_SIMILARITY - FACE_MIN_MARGIN
+    margin = round(best["similaridade"] - second, 4) if best else None
+
+    if best is None or best["similaridade"] < FACE_MIN_SIMILARITY:
+        status = "nao_encontrado"
+    elif margin < FACE_MIN_MARGIN:
+        status = "ambiguo"
+    else:
+        status = "reconhecido"
+
+    return {
+        "status": status,
+        "idPaciente": best["idPaciente"] if status == "reconhecido" else None,
+        "margem": margin,
+        "candidatos": [c for c in candidates[:k] if c["similaridade"] >= FACE_CANDIDATE_MIN_SIMILARITY],
+    }
+
+
+def _recognize_batch(items):
+    # items: [(imagem, k, dica)]; devolve (decisão, embedding) ou exceção por item
+    engine = get_engine()
+    results = engine.embed([image for image, _, _ in items], [hint for _, _, hint in items])
+    owners = [i for i, r in enumerate(results) if not isinstance(r, Exception)]
+
+    if owners:
+        # Uma única busca no índice para o lote todo (k >= 2 para medir a margem)
+        k = max(2, max(items[i][1] for i in owners))
+        distances, ids = engine.search(np.stack([results[i] for i in owners]), k)
+        calibrator = engine.calibration()
+        for row, i in enumerate(owners):
+            results[i] = (_decide(distances[row], ids[row], items[i][1], calibrator), results[i])
+    return results
+
+
+def _recognize(image, k, hint, deadline=None):
+    if FACE_BATCH_MAX_SIZE > 1:
+        return get_engine().scheduler.run((image, k, hint), deadline=deadline)
+
+    result = _recognize_batch([(image, k, hint)])[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def _recognize_cached(engine, image, k, hint, deadline=None):
+    from app.utils.face_cache import content_hash, face_dhash
+
+    cache = engine.cache
+    engine.index.refresh()
+    version = engine.index.version
+    cache.sync(version)
+
+    key = content_hash(image)
+    result = cache.match(key, k)
+    if result is not None:
+        return result
+
+    phash = None
+    if cache.dhash_bits and hint:
+        # Só a região do rosto já conhecida (caixa da dica ou recorte do cliente) vai
+        # para o dHash: no frame inteiro o fundo domina e rostos diferentes colidem.
+        # A imagem segue em bytes para o modelo, que decodifica no processo dele
+        if hint.get("caixa") is not None:
+            phash = face_dhash(image, hint["caixa"])
+        elif hint.get("recorte"):
+            phash = face_dhash(image)
+
+    embedding = cache.embedding(key, phash)
+    if embedding is None:
+        result, embedding = _recognize(image, k, hint, deadline)
+        cache.put_embedding(key, embedding, phash)
+    else:
+        # Mesmo rosto de um frame recente: só a busca no índice
+        distances, ids = engine.search(embedding[None, :], max(k, 2))
+        result = _decide(distances[0], ids[0], k, engine.calibration())
+
+    cache.put_match(key, k, result, version)
+    return result
+
+
+def _find_duplicates(engine, embedding, db_id):
+    distances, ids = engine.search(embedding[None, :], FACE_TOP_K + 1)
+    similarities = similarity_from_distance(distances[0])
+    return [
+        {"idPaciente": int(other), "similaridade": round(float(sim), 4)}
+        for other, sim in zip(ids[0], similarities)
+        if other >= 0 and other != db_id and sim >= FACE_DUPLICATE_SIMILARITY
+    ]
+
+
+def embedding_model():
+    """(modelo, versão) dos embeddings gerados agora, para gravar no banco."""
+    active = _engine.active if _engine is not None else active_model()
+    return active["pack"], active["versao"]
+
+
+def register_face(image, db_id: int, check_duplicates=False, deadline=None):
+    """Acrescenta a foto como template do paciente; devolve (slot, embedding) para o banco.
+
+    Passa pelo mesmo controle de admissão da busca (ver recognize_face). Se
+    a migração trocar o modelo enquanto o cadastro espera o lock do índice, o
+    embedding é refeito no motor novo.
+    """
+    # Cada foto do paciente vira mais um template (até FACE_MAX_TEMPLATES)
+    with _gate.admit(deadline):
+        for _ in range(3):
+            engine = get_engine()
+            embedding = _extract_embedding(image)
+            if check_duplicates:
+                # Mesmo rosto já cadastrado sob outro paciente: nada é gravado
+                duplicates = _find_duplicates(engine, embedding[0], db_id)
+                if duplicates:
+                    raise DuplicateFaceError(duplicates)
+            try:
+                template_id = engine.add_template(db_id, embedding[0])
+            except StaleEngineError:
+                continue
+            engine.maybe_compact()
+            return template_id % TEMPLATE_SLOTS, embedding[0]
+    raise StaleEngineError("O modelo ativo mudou várias vezes durante o cadastro")
+
+
+def stored_template(db_id: int, slot: int):
+    """Embedding guardado no slot de template do paciente, ou None se o slot estiver vazio."""
+    template_id = db_id * TEMPLATE_SLOTS + slot
+    ids, vectors = get_engine().templates.vectors_between(template_id, template_id + 1)
+    return vectors[0] if len(ids) else None
+
+
+def restore_template(db_id: int, slot: int, embedding=None):
+    """Desfaz um register_face que não chegou ao banco: o slot volta ao template anterior (ou vazio)."""
+    get_engine().restore_template(db_id, slot, embedding)
+
+
+def remove_face(db_id: int):
+    engine = get_engine()
+    removed = engine.remove_patient(db_id)
+    engine.maybe_compact()
+    return removed
+
+
+def top_k(k):
+    """k pedido pelo cliente (None = FACE_TOP_K); ValueError fora de 1..FACE_MAX_TOP_K."""
+    if k is None:
+        return FACE_TOP_K
+    if not 1 <= k <= FACE_MAX_TOP_K:
+        raise ValueError(f"k deve estar entre 1 e {FACE_MAX_TOP_K}")
+    return k
+
+
+def recognize_face(image, k=None, hint=None, deadline=None):
+    """Top-k candidatos do rosto com similaridade de cosseno e confiança calibrada.
+
+    Devolve {"status", "idPaciente", "margem", "candidatos"}; status é
+    "reconhecido", "ambiguo" (1º e 2º candidatos próximos demais: a recepção
+    confirma) ou "nao_encontrado". hint: caixa/landmarks (ou recorte) já
+    calculados no cliente; ver face_model.locate_face. Passa pelo controle de
+    admissão: levanta FaceOverloadedError se não houver vaga até o deadline
+    (time.monotonic()). k fora de 1..FACE_MAX_TOP_K levanta ValueError.
+    """
+    k = top_k(k)
+    with _gate.admit(deadline):
+        engine = get_engine()
+        if engine.cache is not None:
+            return _recognize_cached(engine, image, k, hint, deadline)
+        return _recognize(image, k, hint, deadline)[0]
+
+
+def metrics():
+    result = {"carga": status(), "admissao": _gate.metrics()}
+    if _engine is None:
+        return result  # métricas não forçam a carga do modelo
+
+    result.update({
+        "lote": _engine.scheduler.metrics(),
+        "pool": {"processos": _engine.pool.size if _engine.pool else 0},
+        "cache": _engine.cache.metrics() if _engine.cache else None,
+        "calibracao": _engine._calibrator.metrics(),
+        "indice": {
+            "shards": len(_engine.index.shards),
+            "geracao": list(_engine.index.generation),
+            "pendentes_no_journal": _engine.index.pending,
+            "templates_pendentes_no_journal": _engine.templates.pending,
+        },
+    })
+    return result
@@ -1,8 +1,18 @@
-from app import create_app
+import os
 
-app = create_app()
+from app import create_app, iniciar_segundo_plano
 
 if __name__ == "__main__":
+    # O app só é criado aqui: o pool de inferência usa spawn, que reimporta este
+    # arquivo (como __mp_main__) em cada processo, e lá nada de banco nem admin.
+    # Servidores WSGI usam wsgi:app
+    app = create_app()
+
+    # Com o reloader do debug, só o processo filho (WERKZEUG_RUN_MAIN) atende requisições:
+    # o modelo facial e a fila de cadastros sobem já na subida, sem esperar o primeiro request
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        iniciar_segundo_plano(app)
+
     # Rodar servidor Flask
     # host='0.0.0.0' permite acessar de fora, útil se precisar testar de outro dispositivo
     app.run(debug=True, host='0.0.0.0', port=5000)
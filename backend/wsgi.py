@@ -0,0 +1,4 @@
+# Ponto de entrada dos servidores WSGI (ex.: gunicorn wsgi:app); main.py é só o servidor de desenvolvimento
+from app import create_app
+
+app = create_app()
@@ -4,15 +4,23 @@ import { useForm, Controller } from "react-hook-form";
 import { yupResolver } from "@hookform/resolvers/yup";
 import { IMaskInput } from "react-imask";
 import FormField from "../../components/FormField";
-import { getPaciente, savePaciente } from "../../services/pacientes";
+import { getCadastroFacial, getPaciente, savePaciente } from "../../services/pacientes";
 import { pacienteSchema } from "../../validations/pacienteSchema";
 
+const CADASTRO_EM_ANDAMENTO = ["pendente", "processando"];
+const CADASTRO_INTERVALO_MS = 1000;
+const CADASTRO_TENTATIVAS = 60;
+
+const esperar = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
 export default function PacienteForm() {
   const { id } = useParams();
   const navigate = useNavigate();
   const [fotoPreview, setFotoPreview] = useState(null);
   const [fotoFile, setFotoFile] = useState(null);
   const [loading, setLoading] = useState(false);
+  // Desfecho do cadastro facial (feito em segundo plano) do paciente recém-criado
+  const [cadastroFacial, setCadastroFacial] = useState(null);
 
   const {
     control,
@@ -69,6 +77,7 @@ export default function PacienteForm() {
 
   // Carrega dados para edição
   useEffect(() => {
+    setCadastroFacial(null);
     if (id) {
       setLoading(true);
       getPaciente(id)
@@ -96,6 +105,22 @@ export default function PacienteForm() {
     }
   }, [id, reset]);
   
+  // Acompanha o cadastro facial até sair da fila (ou até o limite de tentativas)
+  async function acompanharCadastroFacial(idPaciente, inicial) {
+    let cadastro = inicial;
+    for (let i = 0; i < CADASTRO_TENTATIVAS && CADASTRO_EM_ANDAMENTO.includes(cadastro.status); i++) {
+      setCadastroFacial({ ...cadastro, idPaciente });
+      await esperar(CADASTRO_INTERVALO_MS);
+      try {
+        cadastro = await getCadastroFacial(idPaciente);
+      } catch (e) {
+        console.error("Erro ao consultar cadastro facial:", e);
+      }
+    }
+    setCadastroFacial({ ...cadastro, idPaciente, encerrado: true });
+    return cadastro;
+  }
+
   async function onSubmit(formData) {
     setLoading(true);
     try {
@@ -138,8 +163,17 @@ export default function PacienteForm() {
         payload.append("foto", fotoFile);
       }
       
-      await savePaciente(payload, id); 
-      
+      const salvo = await savePaciente(payload, id);
+
+      // Paciente novo: o rosto entra no índice em segundo plano; só sai da tela
+      // quando o cadastro facial conclui, para o operador ver duplicado/falha
+      if (!id && salvo?.cadastroFacial) {
+        const cadastro = await acompanharCadastroFacial(salvo.idPaciente, salvo.cadastroFacial);
+        if (cadastro.status !== "concluido") {
+          return;
+        }
+      }
+
       navigate("/pacientes");
     } catch (error) {
       console.error("Erro ao salvar paciente:", error);
@@ -177,6 +211,9 @@ export default function PacienteForm() {
     );
   };
 
+  const cadastroEmAndamento = cadastroFacial && CADASTRO_EM_ANDAMENTO.includes(cadastroFacial.status);
+  const cadastroComProblema = cadastroFacial && ["duplicado", "falhou"].includes(cadastroFacial.status);
+
   // Estilo para campos com erro
   const getInputStyle = (fieldName) => {
     return errors[fieldName] ? {
@@ -191,6 +228,62 @@ export default function PacienteForm() {
       <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'flex-start', marginBottom: '2rem' }}>
         <div>
           <h2 style={{ margin: 0, color: '#2c3e50' }}>{id ? "Editar" : "Novo"} Paciente</h2>
+          {cadastroFacial && (
+            <div style={{
+              backgroundColor: cadastroComProblema ? '#fef2f2' : '#eff6ff',
+              border: cadastroComProblema ? '1px solid #fecaca' : '1px solid #bfdbfe',
+              color: cadastroComProblema ? '#dc2626' : '#1e3a8a',
+              padding: '0.75rem',
+              borderRadius: '0.375rem',
+              marginTop: '1rem',
+              fontSize: '0.875rem'
+            }}>
+              {cadastroEmAndamento && !cadastroFacial.encerrado && (
+                <span>Paciente salvo. Processando a foto para o reconhecimento facial...</span>
+              )}
+              {cadastroEmAndamento && cadastroFacial.encerrado && (
+                <span>Paciente salvo. A foto continua na fila do reconhecimento facial; confira o cadastro mais tarde.</span>
+              )}
+              {cadastroFacial.status === 'concluido' && (
+                <span>Cadastro facial concluído.</span>
+              )}
+              {cadastroFacial.status === 'duplicado' && (
+                <div>
+                  <strong>Paciente salvo, mas o rosto já está cadastrado para outro paciente.</strong>
+                  <ul style={{ margin: '0.5rem 0 0 1rem', padding: 0 }}>
+                    {cadastroFacial.duplicados.map((d) => (
+                      <li key={d.idPaciente}>
+                        Paciente #{d.idPaciente} (similaridade {Math.round(d.similaridade * 100)}%)
+                      </li>
+                    ))}
+                  </ul>
+                </div>
+              )}
+              {cadastroFacial.status === 'falhou' && (
+                <div>
+                  <strong>Paciente salvo, mas a foto não entrou no reconhecimento facial:</strong>{' '}
+                  {cadastroFacial.erro}
+                </div>
+              )}
+              {cadastroFacial.encerrado && cadastroFacial.status !== 'concluido' && (
+                <div style={{ marginTop: '0.5rem' }}>
+                  {cadastroComProblema && (
+                    <button
+                      type="button"
+                      className="button primary"
+                      onClick={() => navigate(`/pacientes/${cadastroFacial.idPaciente}/editar`)}
+                      style={{ marginRight: '0.5rem' }}
+                    >
+                      Enviar outra foto
+                    </button>
+                  )}
+                  <button type="button" className="button secondary" onClick={() => navigate("/pacientes")}>
+                    Voltar para a lista
+                  </button>
+                </div>
+              )}
+            </div>
+          )}
           {Object.keys(errors).length > 0 && (
             <div style={{ 
               backgroundColor: '#fef2f2', 
@@ -223,7 +316,7 @@ export default function PacienteForm() {
           <button 
             type="submit" 
             className="button primary" 
-            disabled={loading}
+            disabled={loading || Boolean(cadastroFacial)}
           >
             {loading ? "Salvando..." : "Salvar"}
           </button>
@@ -1,15 +1,16 @@
 import React, { useRef, useEffect, useState } from "react";
 import * as faceapi from "face-api.js";
 import api from "../../services/api"; // Ajuste o caminho conforme necessário
+import { getPaciente } from "../../services/pacientes";
 
 function FaceID() {
   const videoRef = useRef(null);
   const canvasRef = useRef(null);
+  const sessaoRef = useRef(null);
   const [modelsLoaded, setModelsLoaded] = useState(false);
-  const [lastSentTime, setLastSentTime] = useState(0);
   const [detectionError, setDetectionError] = useState(null);
   const [pacienteEncontrado, setPacienteEncontrado] = useState(null);
-  const [loading, setLoading] = useState(false);
+  const [candidatos, setCandidatos] = useState([]);
   const [status, setStatus] = useState("Aguardando detecção...");
 
   // Inicia câmera
@@ -69,6 +70,32 @@ function FaceID() {
     loadModels();
   }, []);
 
+  // Sessão contínua: os frames vão por um WebSocket e o backend só roda o
+  // reconhecimento quando aparece um rosto novo ou a qualidade melhora
+  useEffect(() => {
+    if (!modelsLoaded) return;
+
+    const url = api.defaults.baseURL.replace(/^http/, "ws") + "/reconhecimento/sessao";
+    const ws = new WebSocket(url);
+    ws.binaryType = "arraybuffer";
+    // O token vai na primeira mensagem, não na URL (que fica nos logs de acesso)
+    ws.onopen = () => {
+      ws.send(JSON.stringify({ tipo: "auth", token: localStorage.getItem("token") || "" }));
+    };
+    ws.onmessage = (evento) => tratarResultado(JSON.parse(evento.data));
+    ws.onclose = () => {
+      if (sessaoRef.current === ws) {
+        setDetectionError("Conexão com o servidor de reconhecimento encerrada");
+      }
+    };
+    sessaoRef.current = ws;
+
+    return () => {
+      sessaoRef.current = null;
+      ws.close();
+    };
+  }, [modelsLoaded]);
+
   // Loop de detecção
   useEffect(() => {
     if (!modelsLoaded) return;
@@ -104,11 +131,7 @@ function FaceID() {
           setStatus("Rosto detectado - Analisando...");
 
           if (isFaceVisible(detection)) {
-            const now = Date.now();
-            if (now - lastSentTime > 3000) { // Reduzido para 3 segundos
-              sendFaceToBackend();
-              setLastSentTime(now);
-            }
+            enviarFrame(detection);
           }
         } else {
           setStatus("Nenhum rosto detectado");
@@ -122,7 +145,7 @@ function FaceID() {
 
     const interval = setInterval(detectFaces, 300);
     return () => clearInterval(interval);
-  }, [modelsLoaded, lastSentTime]);
+  }, [modelsLoaded]);
 
   const isFaceVisible = (detection) => {
     const box = detection.detection.box;
@@ -130,65 +153,117 @@ function FaceID() {
     return box.width > minSize && box.height > minSize;
   };
 
-  const sendFaceToBackend = async () => {
+  // 5 pontos no padrão do backend (olhos, ponta do nariz, cantos da boca)
+  // a partir dos 68 landmarks do face-api
+  const cincoPontos = (landmarks) => {
+    const media = (pontos) => [
+      pontos.reduce((soma, p) => soma + p.x, 0) / pontos.length,
+      pontos.reduce((soma, p) => soma + p.y, 0) / pontos.length,
+    ];
+    const pos = landmarks.positions;
+    return [
+      media(landmarks.getLeftEye()),
+      media(landmarks.getRightEye()),
+      [pos[30].x, pos[30].y],
+      [pos[48].x, pos[48].y],
+      [pos[54].x, pos[54].y],
+    ];
+  };
+
+  const enviarFrame = (detection) => {
+    const ws = sessaoRef.current;
+    // Frame anterior ainda na fila de envio: este é descartado
+    if (!ws || ws.readyState !== WebSocket.OPEN || ws.bufferedAmount > 0) return;
+
     try {
-      setLoading(true);
-      setStatus("Enviando imagem para reconhecimento...");
+      // Envia só o recorte do rosto (com margem), não o frame inteiro
+      const video = videoRef.current;
+      const box = detection.detection.box;
+      const margem = Math.max(box.width, box.height) * 0.4;
+      const x = Math.max(Math.floor(box.x - margem), 0);
+      const y = Math.max(Math.floor(box.y - margem), 0);
+      const largura = Math.min(Math.ceil(box.x + box.width + margem), video.videoWidth) - x;
+      const altura = Math.min(Math.ceil(box.y + box.height + margem), video.videoHeight) - y;
 
-      // Capturar frame do vídeo
       const canvas = document.createElement("canvas");
-      canvas.width = videoRef.current.videoWidth;
-      canvas.height = videoRef.current.videoHeight;
+      canvas.width = largura;
+      canvas.height = altura;
       const ctx = canvas.getContext("2d");
-      ctx.drawImage(videoRef.current, 0, 0, canvas.width, canvas.height);
-      
-      canvas.toBlob(async (blob) => {
-        try {
-          const formData = new FormData();
-          formData.append("foto", blob, "face_capture.jpg");
-
-          const response = await api.post("/pacientes/encontrar", formData, {
-            headers: {
-              "Content-Type": "multipart/form-data",
-            },
-          });
-
-          if (response.data.status === "success") {
-            setPacienteEncontrado(response.data.paciente);
-            setStatus("Paciente identificado com sucesso!");
-            setDetectionError(null);
-            
-            if (videoRef.current && videoRef.current.srcObject) {
-              videoRef.current.srcObject.getTracks().forEach(track => track.stop());
-            }
-          } else {
-            setStatus("Paciente não encontrado");
-            setPacienteEncontrado(null);
-          }
-        } catch (error) {
-          console.error("Erro ao enviar para backend:", error);
-          setStatus("Erro no reconhecimento");
-          if (error.response?.data?.erro) {
-            setDetectionError(error.response.data.erro);
-          } else {
-            setDetectionError("Erro de comunicação com o servidor");
-          }
-        } finally {
-          setLoading(false);
+      ctx.drawImage(video, x, y, largura, altura, 0, 0, largura, altura);
+
+      // Caixa e landmarks nas coordenadas do vídeo (o backend acompanha o rosto
+      // entre frames por elas); origem = canto do recorte no vídeo
+      const cabecalho = new TextEncoder().encode(JSON.stringify({
+        caixa: [box.x, box.y, box.x + box.width, box.y + box.height],
+        pontos: cincoPontos(detection.landmarks),
+        origem: [x, y],
+      }));
+      const tamanho = new ArrayBuffer(4);
+      new DataView(tamanho).setUint32(0, cabecalho.length);
+
+      canvas.toBlob((blob) => {
+        if (blob && ws.readyState === WebSocket.OPEN) {
+          ws.send(new Blob([tamanho, cabecalho, blob]));
         }
       }, "image/jpeg", 0.8);
-      
     } catch (err) {
       console.error("Erro ao capturar imagem:", err);
-      setLoading(false);
       setStatus("Erro ao processar imagem");
     }
   };
 
+  const tratarResultado = (resultado) => {
+    if (resultado.erro) {
+      setDetectionError(resultado.erro);
+      return;
+    }
+
+    if (resultado.status === "success") {
+      mostrarPaciente(resultado.paciente);
+      setCandidatos([]);
+      setStatus("Paciente identificado com sucesso!");
+      setDetectionError(null);
+
+      if (videoRef.current && videoRef.current.srcObject) {
+        videoRef.current.srcObject.getTracks().forEach(track => track.stop());
+      }
+    } else if (resultado.status === "ambiguous") {
+      // Dois ou mais pacientes parecidos: a recepção escolhe na lista
+      setCandidatos(resultado.candidatos);
+      setStatus("Confirme o paciente entre os candidatos");
+    } else {
+      setStatus("Paciente não encontrado");
+      setPacienteEncontrado(null);
+    }
+  };
+
+  // O reconhecimento devolve só o resumo; CPF, telefone e e-mail vêm do cadastro completo
+  const mostrarPaciente = (resumo) => {
+    setPacienteEncontrado(resumo);
+    getPaciente(resumo.idPaciente)
+      .then((completo) => setPacienteEncontrado((atual) =>
+        atual && atual.idPaciente === completo.idPaciente ? completo : atual))
+      .catch((err) => console.error("Erro ao carregar o cadastro do paciente:", err));
+  };
+
+  const confirmarCandidato = (paciente) => {
+    mostrarPaciente(paciente);
+    setCandidatos([]);
+    setStatus("Paciente confirmado pela recepção");
+    if (videoRef.current && videoRef.current.srcObject) {
+      videoRef.current.srcObject.getTracks().forEach(track => track.stop());
+    }
+  };
+
   const reiniciarReconhecimento = () => {
     setPacienteEncontrado(null);
+    setCandidatos([]);
     setDetectionError(null);
     setStatus("Reiniciando...");
+    // O mesmo visitante pode ser reconhecido de novo
+    if (sessaoRef.current && sessaoRef.current.readyState === WebSocket.OPEN) {
+      sessaoRef.current.send(JSON.stringify({ tipo: "reiniciar" }));
+    }
     startVideo();
     setTimeout(() => setStatus("Aguardando detecção..."), 1000);
   };
@@ -208,9 +283,10 @@ function FaceID() {
           <h2 className="text-xl font-semibold mb-4 text-green-600">Paciente Identificado</h2>
           <div className="space-y-2">
             <p><strong>Nome:</strong> {pacienteEncontrado.nomeComp}</p>
-            <p><strong>CPF:</strong> {pacienteEncontrado.cpf}</p>
-            <p><strong>Telefone:</strong> {pacienteEncontrado.telefone}</p>
-            <p><strong>Email:</strong> {pacienteEncontrado.email}</p>
+            <p><strong>CPF:</strong> {pacienteEncontrado.cpf || '-'}</p>
+            <p><strong>Telefone:</strong> {pacienteEncontrado.telefone || '-'}</p>
+            <p><strong>Email:</strong> {pacienteEncontrado.email || '-'}</p>
+            <p><strong>Data de nascimento:</strong> {pacienteEncontrado.dataNasc ? pacienteEncontrado.dataNasc.split('-').reverse().join('/') : '-'}</p>
             <p><strong>Status:</strong> {pacienteEncontrado.status === 'A' ? 'Ativo' : 'Inativo'}</p>
           </div>
           <button
@@ -249,13 +325,23 @@ function FaceID() {
               }`}>
                 {status}
               </div>
-              {loading && (
-                <div className="mt-2">
-                  <div className="animate-spin rounded-full h-6 w-6 border-b-2 border-blue-500 mx-auto"></div>
-                </div>
-              )}
             </div>
             
+            {candidatos.length > 0 && (
+              <div className="mb-4 space-y-2">
+                {candidatos.map((c) => (
+                  <button
+                    key={c.paciente.idPaciente}
+                    onClick={() => confirmarCandidato(c.paciente)}
+                    className="w-full flex justify-between items-center border rounded px-3 py-2 hover:bg-blue-50"
+                  >
+                    <span>{c.paciente.nomeComp}</span>
+                    <span className="text-sm text-gray-500">{(c.confianca * 100).toFixed(0)}%</span>
+                  </button>
+                ))}
+              </div>
+            )}
+
             <div className="text-sm text-gray-600">
               <p>• Posicione seu rosto no centro da imagem</p>
               <p>• Certifique-se de que há boa iluminação</p>
@@ -22,4 +22,8 @@ export const savePaciente = async (formData, id = null) => {
     // Criar novo paciente
     return (await api.post("/pacientes", formData, config)).data;
   }
-};
\ No newline at end of file
+};
+
+// Status do cadastro facial em segundo plano (pendente, processando, concluido, duplicado, falhou)
+export const getCadastroFacial = async (id) =>
+  (await api.get(`/pacientes/${id}/cadastro-facial`)).data;